@@ -1,13 +1,27 @@
+import time
+
+# Taken ahead of the other imports, for --profile-startup
+STARTED_AT = time.perf_counter()
+
 import sys
 import sqlite3
-import json
 import os
 from PyQt6.QtWidgets import (QApplication, QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QLineEdit, QTextEdit, QLabel,
-                             QTableWidget, QTableWidgetItem, QDialog, QFileDialog, QHeaderView, QMessageBox, QSplitter,
-                             QFrame, QStyleFactory, QComboBox, QMainWindow, QToolBar, QStatusBar)
-from PyQt6.QtCore import QDate, Qt, QSize
+                             QTableView, QDialog, QFileDialog, QHeaderView, QMessageBox, QSplitter,
+                             QFrame, QStyleFactory, QComboBox, QMainWindow, QToolBar, QStatusBar, QProgressDialog,
+                             QInputDialog, QCheckBox, QListWidget, QListWidgetItem)
+from PyQt6.QtCore import QDate, Qt, QSize, QEvent, QObject, QThread, QEventLoop, pyqtSignal, pyqtSlot
 from PyQt6.QtGui import QFont, QIcon, QColor, QAction
-from persiantools.jdatetime import JalaliDate
+from database import (CHANGE_DELETE, CHANGE_INSERT, CHANGE_RESET, PAGE_SIZE, TAG_FACETS, TAG_SEPARATOR,
+                      AttachmentCancelled, ConflictError, FuzzyQuery, RecentQuery, SearchQuery, format_tag,
+                      get_data_dir, get_repository, init_db, is_truncated_preview, jalali_day, jalali_from_day,
+                      jalali_month_start, jalali_today, parse_tag)
+from backup import (BACKUP_DELTA, IMPORT_MERGE_BY_CONTENT, IMPORT_MERGE_BY_ID, IMPORT_REPLACE, BackupCancelled,
+                    backup_header, export_backup_stream, export_incremental_backup, export_snapshot,
+                    import_backup_stream, restore_backup_chain, restore_snapshot)
+from migrations import MigrationCancelled
+import instrumentation
+from instrumentation import timed
 
 
 # Resource path helper function
@@ -23,95 +37,192 @@ def resource_path(relative_path):
         return os.path.join(base_path, relative_path)
 
 
-# Get the application data directory
-def get_data_dir():
-        """Get the appropriate data directory based on the platform"""
-        if getattr(sys, 'frozen', False):
-                # If the application is frozen (PyInstaller bundle)
-                if sys.platform == 'darwin':  # macOS
-                        # On macOS, use ~/Library/Application Support/YourAppName
-                        app_name = "IT_Problem_Tracker"
-                        data_dir = os.path.join(os.path.expanduser("~"), "Library", "Application Support", app_name)
-                elif sys.platform == 'win32':  # Windows
-                        # On Windows, use %APPDATA%\YourAppName
-                        app_name = "IT_Problem_Tracker"
-                        data_dir = os.path.join(os.environ.get('APPDATA', os.path.expanduser("~")), app_name)
-                else:  # Linux and other platforms
-                        # On Linux, use ~/.local/share/YourAppName
-                        app_name = "it_problem_tracker"
-                        data_dir = os.path.join(os.path.expanduser("~"), ".local", "share", app_name)
-        else:
-                # If running in development mode, use the current directory
-                data_dir = os.path.abspath(os.path.dirname(sys.argv[0]))
-
-        # Create the directory if it doesn't exist
-        os.makedirs(data_dir, exist_ok=True)
-
-        return data_dir
-
-
-# Get database path
-def get_db_path():
-        """Get the full path to the database file"""
-        return os.path.join(get_data_dir(), "problems.db")
-
-
-# Database Setup
-def init_db():
-        db_path = get_db_path()
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        cursor.execute('''CREATE TABLE IF NOT EXISTS problems (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                date TEXT,
-                subject TEXT,
-                problem TEXT,
-                solution TEXT
-            )''')
-        conn.commit()
-        conn.close()
-        print(f"Database initialized at: {db_path}")
+# Background Jobs
+class BackgroundJob(QObject):
+        """Runs job(progress, is_cancelled) on a worker thread"""
+        progress = pyqtSignal(object, object)
+        done = pyqtSignal()
+
+        def __init__(self, job):
+                super().__init__()
+                self.job = job
+                self.cancelled = False
+                self.result = None
+                self.error = None
+
+        @pyqtSlot()
+        def run(self):
+                try:
+                        self.result = self.job(self.progress.emit, self.is_cancelled)
+                except Exception as e:
+                        self.error = e
+                self.done.emit()
+
+        def is_cancelled(self):
+                return self.cancelled
+
+        def cancel(self):
+                self.cancelled = True
+
+
+def run_with_progress(parent, title, label, job):
+        """Run job on a worker thread behind a cancellable progress dialog and return its result"""
+        dialog = QProgressDialog(label, "Cancel", 0, 100, parent)
+        dialog.setWindowTitle(title)
+        dialog.setWindowModality(Qt.WindowModality.ApplicationModal)
+        dialog.setAutoClose(False)
+        dialog.setAutoReset(False)
+        dialog.setMinimumDuration(0)
+
+        thread = QThread()
+        worker = BackgroundJob(job)
+        worker.moveToThread(thread)
+
+        def show_progress(done, total):
+                if total:
+                        dialog.setValue(min(100, int(done * 100 / total)))
+
+        loop = QEventLoop()
+        thread.started.connect(worker.run)
+        worker.progress.connect(show_progress)
+        worker.done.connect(loop.quit)
+        dialog.canceled.connect(worker.cancel)
+
+        thread.start()
+        dialog.show()
+        loop.exec()
+        thread.quit()
+        thread.wait()
+        dialog.close()
+
+        if worker.error is not None:
+                raise worker.error
+        return worker.result
 
 
 # Backup Functionality
-def export_backup():
+def export_backup(parent=None):
+        options = QFileDialog.Option.DontUseNativeDialog
+        file_path, _ = QFileDialog.getSaveFileName(parent, "Save Backup", "backup.bak.gz",
+                                                   "Compressed Backup Files (*.bak.gz)", options=options)
+        if file_path:
+                try:
+                        count = run_with_progress(
+                                parent, "Export Backup", "Writing backup...",
+                                lambda progress, is_cancelled: export_backup_stream(
+                                        get_repository(), file_path, progress, is_cancelled))
+                except BackupCancelled:
+                        return
+                except Exception as e:
+                        QMessageBox.critical(parent, "Error", f"Failed to save backup: {str(e)}")
+                        return
+
+                QMessageBox.information(parent, "Backup Complete", f"Backup of {count} records saved as {file_path}")
+
+
+def export_snapshot_backup(parent=None):
+        """Save a page-level copy of the database file"""
+        options = QFileDialog.Option.DontUseNativeDialog
+        file_path, _ = QFileDialog.getSaveFileName(parent, "Save Snapshot", "snapshot.sqlite",
+                                                   "Database Snapshots (*.sqlite)", options=options)
+        if file_path:
+                try:
+                        run_with_progress(parent, "Export Snapshot", "Copying database...",
+                                          lambda progress, is_cancelled: export_snapshot(
+                                                  get_repository(), file_path, progress, is_cancelled))
+                except BackupCancelled:
+                        return
+                except Exception as e:
+                        QMessageBox.critical(parent, "Error", f"Failed to save snapshot: {str(e)}")
+                        return
+
+                QMessageBox.information(parent, "Backup Complete", f"Snapshot saved as {file_path}")
+
+
+def restore_snapshot_backup(parent=None):
+        """Replace the database with a snapshot"""
         options = QFileDialog.Option.DontUseNativeDialog
-        file_path, _ = QFileDialog.getSaveFileName(None, "Save Backup", "backup.bak", "Backup Files (*.bak)",
+        file_path, _ = QFileDialog.getOpenFileName(parent, "Open Snapshot", "", "Database Snapshots (*.sqlite)",
                                                    options=options)
         if file_path:
-                conn = sqlite3.connect(get_db_path())
-                cursor = conn.cursor()
-                cursor.execute("SELECT * FROM problems")
-                data = cursor.fetchall()
+                reply = QMessageBox.question(parent, "Confirm Restore",
+                                             "Replace all entries with the contents of this snapshot?",
+                                             QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
+                                             QMessageBox.StandardButton.No)
+                if reply != QMessageBox.StandardButton.Yes:
+                        return False
+
+                try:
+                        count = run_with_progress(parent, "Restore Snapshot", "Copying snapshot...",
+                                                  lambda progress, is_cancelled: restore_snapshot(
+                                                          get_repository(), file_path, progress, is_cancelled))
+                        QMessageBox.information(parent, "Restore Complete",
+                                                f"Database restored from {file_path} ({count} records)")
+                        return True
+                except BackupCancelled:
+                        return False
+                except Exception as e:
+                        QMessageBox.critical(parent, "Error", f"Failed to restore snapshot: {str(e)}")
+                        return False
 
-                with open(file_path, "w", encoding="utf-8") as file:
-                        json.dump(data, file, ensure_ascii=False, indent=4)
 
-                conn.close()
-                QMessageBox.information(None, "Backup Complete", f"Backup saved as {file_path}")
+# Choices offered when importing a backup
+IMPORT_MODES = {
+        "Replace all entries with the backup": IMPORT_REPLACE,
+        "Merge, updating entries with the same ID": IMPORT_MERGE_BY_ID,
+        "Merge, adding only entries not already present": IMPORT_MERGE_BY_CONTENT,
+}
 
 
-def import_backup():
+def export_incremental(parent=None):
+        """Back up only what changed since the last backup"""
         options = QFileDialog.Option.DontUseNativeDialog
-        file_path, _ = QFileDialog.getOpenFileName(None, "Open Backup", "", "Backup Files (*.bak)", options=options)
+        file_path, _ = QFileDialog.getSaveFileName(parent, "Save Incremental Backup", "backup-incremental.bak.gz",
+                                                   "Compressed Backup Files (*.bak.gz)", options=options)
         if file_path:
                 try:
-                        conn = sqlite3.connect(get_db_path())
-                        cursor = conn.cursor()
+                        count = run_with_progress(
+                                parent, "Export Incremental Backup", "Writing changes...",
+                                lambda progress, is_cancelled: export_incremental_backup(
+                                        get_repository(), file_path, progress, is_cancelled))
+                except BackupCancelled:
+                        return
+                except Exception as e:
+                        QMessageBox.critical(parent, "Error", f"Failed to save backup: {str(e)}")
+                        return
 
-                        with open(file_path, "r", encoding="utf-8") as file:
-                                data = json.load(file)
+                QMessageBox.information(parent, "Backup Complete",
+                                        f"Incremental backup of {count} changes saved as {file_path}")
 
-                        cursor.execute("DELETE FROM problems")
-                        for record in data:
-                                cursor.execute("INSERT INTO problems VALUES (?, ?, ?, ?, ?)", record)
 
-                        conn.commit()
-                        conn.close()
-                        QMessageBox.information(None, "Restore Complete", f"Database restored from {file_path}")
+def import_backup(parent=None):
+        options = QFileDialog.Option.DontUseNativeDialog
+        file_paths, _ = QFileDialog.getOpenFileNames(parent, "Open Backup (a full backup and its incremental backups)",
+                                                     "", "Backup Files (*.bak *.bak.gz)", options=options)
+        if file_paths:
+                try:
+                        if len(file_paths) == 1 and (backup_header(file_paths[0]) or {}).get("kind") != BACKUP_DELTA:
+                                choice, ok = QInputDialog.getItem(parent, "Import Backup",
+                                                                  "How should the backup be imported?",
+                                                                  list(IMPORT_MODES), 0, False)
+                                if not ok:
+                                        return False
+                                job = lambda progress, is_cancelled: import_backup_stream(
+                                        get_repository(), file_paths[0], IMPORT_MODES[choice], progress, is_cancelled)
+                        else:
+                                # A full backup followed by its increments, or increments on top of this database
+                                job = lambda progress, is_cancelled: restore_backup_chain(
+                                        get_repository(), file_paths, progress, is_cancelled)
+
+                        read, changed = run_with_progress(parent, "Import Backup", "Restoring backup...", job)
+                        QMessageBox.information(parent, "Restore Complete",
+                                                f"Read {read} records from {len(file_paths)} file(s), "
+                                                f"{changed} entries changed")
                         return True
+                except BackupCancelled:
+                        return False
                 except Exception as e:
-                        QMessageBox.critical(None, "Error", f"Failed to restore backup: {str(e)}")
+                        QMessageBox.critical(parent, "Error", f"Failed to restore backup: {str(e)}")
                         return False
 
 
@@ -121,6 +232,7 @@ class EntryDialog(QDialog):
                 super().__init__(parent)
                 self.record_id = record_id
                 self.is_edit_mode = record_id is not None
+                self.revision = None
 
                 title = "Edit Problem Entry" if self.is_edit_mode else "New Problem Entry"
                 self.setWindowTitle(title)
@@ -135,7 +247,7 @@ class EntryDialog(QDialog):
                 color: #FFFFFF;
                 background: transparent;
             }
-            QLineEdit, QTextEdit {
+            QLineEdit, QTextEdit, QListWidget {
                 border: 1px solid #4A4A48;
                 border-radius: 4px;
                 padding: 8px;
@@ -159,7 +271,7 @@ class EntryDialog(QDialog):
                 # Fields
                 date_layout = QHBoxLayout()
                 date_label = QLabel("Date:")
-                self.date = QLabel(str(JalaliDate.today()))
+                self.date = QLabel(jalali_today())
                 date_layout.addWidget(date_label)
                 date_layout.addWidget(self.date)
                 date_layout.addStretch()
@@ -174,6 +286,15 @@ class EntryDialog(QDialog):
                 subject_label.setStyleSheet(
                         "font-weight: bold; color: #FFFFFF; margin-top: 10px; background: transparent;")
 
+                tags_label = QLabel("Tags:")
+                layout.addWidget(tags_label)
+                self.tags = QLineEdit()
+                self.tags.setPlaceholderText("Comma separated, e.g. system:Windows, vendor:HP, severity:high, site:Tehran")
+                self.tags.setCompleter(TagCompleter(self.tags))
+                layout.addWidget(self.tags)
+                tags_label.setStyleSheet(
+                        "font-weight: bold; color: #FFFFFF; margin-top: 10px; background: transparent;")
+
                 problem_label = QLabel("Problem Description:")
                 layout.addWidget(problem_label)
                 self.problem = QTextEdit()
@@ -184,6 +305,26 @@ class EntryDialog(QDialog):
                 problem_label.setStyleSheet(
                         "font-weight: bold; color: #FFFFFF; margin-top: 10px; background: transparent;")
 
+                # Existing problems similar to the one being typed, shown only while there are some
+                self.suggestions_label = QLabel("Similar existing problems:")
+                self.suggestions_label.setStyleSheet(
+                        "font-weight: bold; color: #F0C674; margin-top: 10px; background: transparent;")
+                self.suggestions_label.hide()
+                layout.addWidget(self.suggestions_label)
+                self.suggestions = QListWidget()
+                self.suggestions.setMaximumHeight(120)
+                self.suggestions.setLayoutDirection(Qt.LayoutDirection.RightToLeft)  # Right-to-left for Persian
+                self.suggestions.hide()
+                layout.addWidget(self.suggestions)
+
+                # Only new entries are checked for duplicates
+                self.similarity_engine = None if self.is_edit_mode else getattr(parent, "similarity_engine", None)
+                if self.similarity_engine is not None:
+                        self.subject.textChanged.connect(self.suggest_similar)
+                        self.problem.textChanged.connect(self.suggest_similar)
+                        self.similarity_engine.suggestions_ready.connect(self.show_suggestions)
+                        self.finished.connect(self.stop_suggestions)
+
                 solution_label = QLabel("Solution:")
                 layout.addWidget(solution_label)
                 self.solution = QTextEdit()
@@ -215,45 +356,305 @@ class EntryDialog(QDialog):
                         self.load_data()
 
         def load_data(self):
-                conn = sqlite3.connect(get_db_path())
-                cursor = conn.cursor()
-                cursor.execute("SELECT date, subject, problem, solution FROM problems WHERE id = ?", (self.record_id,))
-                record = cursor.fetchone()
-                conn.close()
+                record = record_cache.get(self.record_id)
 
                 if record:
                         self.date.setText(record[0])
                         self.subject.setText(record[1])
                         self.problem.setPlainText(record[2])
                         self.solution.setPlainText(record[3])
+                        # Saving checks nobody else changed the record since this revision
+                        self.revision = record[4]
+                        self.tags.setText(", ".join(format_tag(facet, name)
+                                                    for facet, name in get_repository().tags_of(self.record_id)))
+
+        def entered_tags(self):
+                """(facet, name) of the tags typed in, ValueError for one without a name"""
+                tags = [parse_tag(text) for text in self.tags.text().split(",") if text.strip()]
+                return list(dict.fromkeys(tags))
+
+        def suggest_similar(self):
+                """Look up similar problems once typing pauses"""
+                text = f"{self.subject.text()}\n{self.problem.toPlainText()}"
+                if text.strip():
+                        self.similarity_engine.submit(text)
+                else:
+                        self.similarity_engine.cancel()
+                        self.show_suggestions([])
+
+        def show_suggestions(self, records):
+                """Fill the suggestions list with (id, date, subject, problem_preview, solution_preview) rows"""
+                self.suggestions.clear()
+                for record_id, date, subject, problem, solution in records:
+                        item = QListWidgetItem(f"{subject}  ({date})")
+                        item.setToolTip(f"{problem}\n\nSolution: {solution}")
+                        item.setData(Qt.ItemDataRole.UserRole, record_id)
+                        self.suggestions.addItem(item)
+                self.suggestions_label.setVisible(bool(records))
+                self.suggestions.setVisible(bool(records))
+
+        def stop_suggestions(self):
+                self.similarity_engine.cancel()
+                self.similarity_engine.suggestions_ready.disconnect(self.show_suggestions)
 
         def save_entry(self):
                 # Validate inputs
                 if not self.subject.text().strip():
                         QMessageBox.warning(self, "Validation Error", "Subject cannot be empty!")
                         return
+                try:
+                        tags = self.entered_tags()
+                except ValueError as e:
+                        QMessageBox.warning(self, "Validation Error", str(e))
+                        return
 
-                conn = sqlite3.connect(get_db_path())
-                cursor = conn.cursor()
+                repository = get_repository()
 
                 try:
                         if self.is_edit_mode:
-                                cursor.execute(
-                                        "UPDATE problems SET date=?, subject=?, problem=?, solution=? WHERE id=?",
-                                        (self.date.text(), self.subject.text(), self.problem.toPlainText(),
-                                         self.solution.toPlainText(), self.record_id))
+                                repository.update(self.record_id, self.date.text(), self.subject.text(),
+                                                  self.problem.toPlainText(), self.solution.toPlainText(), self.revision,
+                                                  tags)
                         else:
-                                cursor.execute(
-                                        "INSERT INTO problems (date, subject, problem, solution) VALUES (?, ?, ?, ?)",
-                                        (str(JalaliDate.today()), self.subject.text(), self.problem.toPlainText(),
-                                         self.solution.toPlainText()))
+                                repository.add(jalali_today(), self.subject.text(), self.problem.toPlainText(),
+                                               self.solution.toPlainText(), tags)
 
-                        conn.commit()
-                        conn.close()
                         self.accept()
+                except ConflictError as e:
+                        self.resolve_conflict(e.current)
+                except Exception as e:
+                        QMessageBox.critical(self, "Error", f"Failed to save entry: {str(e)}")
+
+        def resolve_conflict(self, current):
+                """Let the user choose between their edit and the one saved meanwhile by someone else"""
+                mine = (self.date.text(), self.subject.text(), self.problem.toPlainText(), self.solution.toPlainText())
+                tags = self.entered_tags()
+                dialog = ConflictDialog(self, mine, current)
+                dialog.exec()
+
+                repository = get_repository()
+                try:
+                        if dialog.choice == ConflictDialog.OVERWRITE:
+                                repository.update(self.record_id, *mine, current[4], tags)
+                                self.accept()
+                        elif dialog.choice == ConflictDialog.SAVE_AS_NEW:
+                                repository.add(*mine, tags)
+                                self.accept()
+                        elif dialog.choice == ConflictDialog.DISCARD:
+                                self.accept()
+                        elif current is not None:
+                                # Keep editing, the next save overwrites the version just shown
+                                self.revision = current[4]
+                except ConflictError as e:
+                        # Changed yet again while the dialog was open
+                        self.resolve_conflict(e.current)
                 except Exception as e:
                         QMessageBox.critical(self, "Error", f"Failed to save entry: {str(e)}")
-                        conn.close()
+
+
+# Write Conflict Dialog
+class ConflictDialog(QDialog):
+        """Shows the user's edit next to the version someone else saved first, and records what to do about it"""
+
+        KEEP_EDITING, OVERWRITE, DISCARD, SAVE_AS_NEW = range(4)
+
+        def __init__(self, parent, mine, theirs):
+                super().__init__(parent)
+                self.choice = self.KEEP_EDITING
+                self.setWindowTitle("Edit Conflict")
+                self.setGeometry(300, 150, 1000, 600)
+                self.setStyleSheet("""
+            QDialog {
+                background-color: #30302E;
+                color: #FFFFFF;
+            }
+            QLabel {
+                color: #FFFFFF;
+                background: transparent;
+            }
+            QTextEdit {
+                border: 1px solid #4A4A48;
+                border-radius: 4px;
+                padding: 8px;
+                background-color: #3A3A38;
+                color: #FFFFFF;
+            }
+            QPushButton {
+                border-radius: 4px;
+                padding: 8px 16px;
+                font-weight: bold;
+                color: #000000;
+            }
+        """)
+
+                layout = QVBoxLayout()
+                if theirs is None:
+                        message = "This record was deleted by someone else while you were editing it."
+                else:
+                        message = "This record was changed by someone else while you were editing it."
+                header = QLabel(message)
+                header.setStyleSheet("font-weight: bold; color: #F0C674;")
+                layout.addWidget(header)
+
+                # Both versions side by side
+                versions = QHBoxLayout()
+                versions.addWidget(self.version_view("Your version", mine))
+                if theirs is not None:
+                        versions.addWidget(self.version_view("Their version", theirs[:4]))
+                layout.addLayout(versions)
+
+                # Buttons
+                button_layout = QHBoxLayout()
+                keep_btn = QPushButton("Keep Editing")
+                keep_btn.setStyleSheet("background-color: #4A4A48; color: #FFFFFF;")
+                keep_btn.clicked.connect(self.reject)
+                button_layout.addWidget(keep_btn)
+
+                discard_btn = QPushButton("Discard My Changes")
+                discard_btn.setStyleSheet("background-color: #7A1818; color: #000000;")
+                discard_btn.clicked.connect(lambda: self.choose(self.DISCARD))
+                button_layout.addWidget(discard_btn)
+
+                if theirs is None:
+                        save_btn = QPushButton("Save as New")
+                        save_btn.clicked.connect(lambda: self.choose(self.SAVE_AS_NEW))
+                else:
+                        save_btn = QPushButton("Overwrite Theirs")
+                        save_btn.clicked.connect(lambda: self.choose(self.OVERWRITE))
+                save_btn.setStyleSheet("background-color: #296F62; color: #000000;")
+                button_layout.addWidget(save_btn)
+                layout.addLayout(button_layout)
+
+                self.setLayout(layout)
+
+        def version_view(self, title, record):
+                """Read-only view of a (date, subject, problem, solution) version"""
+                date, subject, problem, solution = record
+                frame = QFrame()
+                frame_layout = QVBoxLayout(frame)
+                title_label = QLabel(title)
+                title_label.setStyleSheet("font-weight: bold; font-size: 14px;")
+                frame_layout.addWidget(title_label)
+                text = QTextEdit()
+                text.setReadOnly(True)
+                text.setLayoutDirection(Qt.LayoutDirection.RightToLeft)  # Right-to-left for Persian
+                text.setPlainText(f"{date}\n{subject}\n\nProblem:\n{problem}\n\nSolution:\n{solution}")
+                frame_layout.addWidget(text)
+                return frame
+
+        def choose(self, choice):
+                self.choice = choice
+                self.accept()
+
+
+# Attachment Thumbnails
+from PyQt6.QtCore import QBuffer, QByteArray, QIODevice, QThreadPool
+from PyQt6.QtGui import QImageReader, QPixmap
+
+THUMBNAIL_SIZE = 96
+
+# Bigger images get no thumbnail, formats that cannot decode to a smaller size need the whole image in memory
+MAX_THUMBNAIL_SOURCE_SIZE = 32 * 1024 * 1024
+
+
+class BlobDevice(QIODevice):
+        """Read-only QIODevice over an incremental blob handle, image readers take what they need from it"""
+
+        def __init__(self, blob):
+                super().__init__()
+                self.blob = blob
+
+        def isSequential(self):
+                return False
+
+        def size(self):
+                return len(self.blob)
+
+        def readData(self, max_size):
+                # Unbuffered, so the device position is where the reader wants to continue
+                self.blob.seek(self.pos())
+                return self.blob.read(max_size)
+
+        def writeData(self, data):
+                return -1
+
+
+def make_thumbnail(repository, blob_id, conn):
+        """PNG thumbnail of an image blob, saved for next time, or None if it cannot be decoded"""
+        with repository.open_blob(blob_id, conn) as blob:
+                source = BlobDevice(blob)
+                source.open(QIODevice.OpenModeFlag.ReadOnly | QIODevice.OpenModeFlag.Unbuffered)
+                reader = QImageReader(source)
+                # Decoded straight to the thumbnail size where the format allows it
+                original = reader.size()
+                if original.width() > THUMBNAIL_SIZE or original.height() > THUMBNAIL_SIZE:
+                        reader.setScaledSize(original.scaled(THUMBNAIL_SIZE, THUMBNAIL_SIZE,
+                                                             Qt.AspectRatioMode.KeepAspectRatio))
+                image = reader.read()
+                source.close()
+        if image.isNull():
+                return None
+
+        encoded = QByteArray()
+        target = QBuffer(encoded)
+        target.open(QIODevice.OpenModeFlag.WriteOnly)
+        image.save(target, "PNG")
+        target.close()
+        data = bytes(encoded)
+        repository.save_thumbnail(blob_id, data, conn)
+        return data
+
+
+class ThumbnailLoader(QObject):
+        """Reads or makes thumbnails of image attachments on a background thread, one at a time"""
+        # Blob id and the PNG data of its thumbnail
+        ready = pyqtSignal(int, bytes)
+
+        def __init__(self):
+                super().__init__()
+                self.pool = QThreadPool()
+                # One at a time, so that they share one connection
+                self.pool.setMaxThreadCount(1)
+                self.conn = None
+
+        def request(self, blob_id, mime_type, size):
+                """Emit ready with the thumbnail of an image attachment, nothing for other files"""
+                if (mime_type or "").startswith("image/") and size <= MAX_THUMBNAIL_SOURCE_SIZE:
+                        self.pool.start(lambda: self.load(blob_id))
+
+        def load(self, blob_id):
+                """Runs on the pool's thread"""
+                repository = get_repository()
+                try:
+                        if self.conn is None:
+                                self.conn = repository.open_connection(check_same_thread=False)
+                        data = repository.thumbnail(blob_id, self.conn)
+                        if data is None:
+                                data = make_thumbnail(repository, blob_id, self.conn)
+                except sqlite3.Error:
+                        # Removed meanwhile, e.g. from another window
+                        return
+                if data is not None:
+                        self.ready.emit(blob_id, data)
+
+        def shutdown(self):
+                """Drop queued thumbnails, wait for the one being made and close the connection"""
+                self.pool.clear()
+                self.pool.waitForDone()
+                if self.conn is not None:
+                        self.conn.close()
+                        self.conn = None
+
+
+thumbnail_loader = ThumbnailLoader()
+
+
+def format_size(size):
+        for unit in ("bytes", "KB", "MB"):
+                if size < 1024:
+                        return f"{size:.0f} {unit}"
+                size /= 1024
+        return f"{size:.1f} GB"
 
 
 # Problem Detail View Dialog
@@ -290,11 +691,7 @@ class ProblemDetailDialog(QDialog):
             """)
 
                 # Get data
-                conn = sqlite3.connect(get_db_path())
-                cursor = conn.cursor()
-                cursor.execute("SELECT date, subject, problem, solution FROM problems WHERE id = ?", (self.record_id,))
-                self.record = cursor.fetchone()
-                conn.close()
+                self.record = record_cache.get(self.record_id)
 
                 if not self.record:
                         QMessageBox.critical(self, "Error", "Record not found!")
@@ -308,6 +705,14 @@ class ProblemDetailDialog(QDialog):
                 date_label.setStyleSheet("font-weight: bold; color: #CCCCCC; background: transparent;")
                 layout.addWidget(date_label)
 
+                # Tags
+                tags = get_repository().tags_of(self.record_id)
+                if tags:
+                        tags_label = QLabel("Tags: " + ", ".join(format_tag(facet, name) for facet, name in tags))
+                        tags_label.setStyleSheet("color: #CCCCCC; background: transparent;")
+                        tags_label.setWordWrap(True)
+                        layout.addWidget(tags_label)
+
                 # Problem
                 problem_header = QLabel("Problem Description:")
                 problem_header.setStyleSheet(
@@ -332,6 +737,35 @@ class ProblemDetailDialog(QDialog):
                 solution_text.setLayoutDirection(Qt.LayoutDirection.RightToLeft)  # Right-to-left for Persian
                 layout.addWidget(solution_text)
 
+                # Attachments
+                attachments_header = QLabel("Attachments:")
+                attachments_header.setStyleSheet(
+                        "font-weight: bold; color: #FFFFFF; margin-top: 10px; background: transparent;")
+                layout.addWidget(attachments_header)
+
+                self.attachments = QListWidget()
+                self.attachments.setIconSize(QSize(THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+                self.attachments.setMaximumHeight(THUMBNAIL_SIZE * 2)
+                self.attachments.itemDoubleClicked.connect(self.save_attachment)
+                layout.addWidget(self.attachments)
+
+                attachment_layout = QHBoxLayout()
+                add_attachment_btn = QPushButton("Add Attachment...")
+                add_attachment_btn.clicked.connect(self.add_attachment)
+                save_attachment_btn = QPushButton("Save Attachment...")
+                save_attachment_btn.clicked.connect(self.save_attachment)
+                remove_attachment_btn = QPushButton("Remove Attachment")
+                remove_attachment_btn.clicked.connect(self.remove_attachment)
+                for button in (add_attachment_btn, save_attachment_btn, remove_attachment_btn):
+                        button.setStyleSheet("background-color: #4A4A48; color: #FFFFFF;")
+                        attachment_layout.addWidget(button)
+                layout.addLayout(attachment_layout)
+
+                # List items waiting for the thumbnail of each blob
+                self.pending_thumbnails = {}
+                thumbnail_loader.ready.connect(self.show_thumbnail)
+                self.load_attachments()
+
                 # Buttons
                 button_layout = QHBoxLayout()
 
@@ -349,11 +783,94 @@ class ProblemDetailDialog(QDialog):
 
                 self.setLayout(layout)
 
+        def load_attachments(self):
+                """List the attachments, their thumbnails are made on a background thread and follow"""
+                self.attachments.clear()
+                self.pending_thumbnails = {}
+                for attachment_id, name, mime_type, size, blob_id in get_repository().list_attachments(self.record_id):
+                        item = QListWidgetItem(f"{name}  ({format_size(size)})")
+                        item.setData(Qt.ItemDataRole.UserRole, (attachment_id, name))
+                        self.attachments.addItem(item)
+                        if blob_id not in self.pending_thumbnails:
+                                thumbnail_loader.request(blob_id, mime_type, size)
+                        self.pending_thumbnails.setdefault(blob_id, []).append(item)
+
+        def show_thumbnail(self, blob_id, data):
+                pixmap = QPixmap()
+                # Also called for the attachments of other dialogs, and may still arrive once this one is closed
+                items = self.pending_thumbnails.pop(blob_id, []) if self.pending_thumbnails is not None else []
+                if items and pixmap.loadFromData(data):
+                        for item in items:
+                                item.setIcon(QIcon(pixmap))
+
+        def done(self, result):
+                if self.pending_thumbnails is not None:
+                        thumbnail_loader.ready.disconnect(self.show_thumbnail)
+                        self.pending_thumbnails = None
+                super().done(result)
+
+        def selected_attachment(self):
+                item = self.attachments.currentItem()
+                return item.data(Qt.ItemDataRole.UserRole) if item else (None, None)
+
+        def add_attachment(self):
+                options = QFileDialog.Option.DontUseNativeDialog
+                file_paths, _ = QFileDialog.getOpenFileNames(self, "Add Attachments", "", "All Files (*)", options=options)
+                for file_path in file_paths:
+                        try:
+                                attached = run_with_progress(
+                                        self, "Add Attachment", f"Copying {os.path.basename(file_path)}...",
+                                        lambda progress, is_cancelled, file_path=file_path:
+                                                get_repository().add_attachment(self.record_id, file_path,
+                                                                                progress=progress,
+                                                                                is_cancelled=is_cancelled))
+                        except AttachmentCancelled:
+                                break
+                        except Exception as e:
+                                QMessageBox.critical(self, "Error", f"Failed to attach {file_path}: {str(e)}")
+                                break
+                        if attached is None:
+                                QMessageBox.warning(self, "Error", "This record was deleted meanwhile.")
+                                break
+                self.load_attachments()
+
+        def save_attachment(self):
+                attachment_id, name = self.selected_attachment()
+                if attachment_id is None:
+                        return
+                options = QFileDialog.Option.DontUseNativeDialog
+                file_path, _ = QFileDialog.getSaveFileName(self, "Save Attachment", name, "All Files (*)",
+                                                           options=options)
+                if file_path:
+                        try:
+                                saved = run_with_progress(
+                                        self, "Save Attachment", f"Writing {name}...",
+                                        lambda progress, is_cancelled: get_repository().save_attachment(
+                                                attachment_id, file_path, progress, is_cancelled))
+                        except AttachmentCancelled:
+                                return
+                        except Exception as e:
+                                QMessageBox.critical(self, "Error", f"Failed to save attachment: {str(e)}")
+                                return
+                        if not saved:
+                                QMessageBox.warning(self, "Error", "This attachment was removed meanwhile.")
+                                self.load_attachments()
+
+        def remove_attachment(self):
+                attachment_id, name = self.selected_attachment()
+                if attachment_id is None:
+                        return
+                reply = QMessageBox.question(self, "Confirm Removal", f"Remove the attachment {name}?",
+                                             QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
+                                             QMessageBox.StandardButton.No)
+                if reply == QMessageBox.StandardButton.Yes:
+                        get_repository().delete_attachment(attachment_id)
+                        self.load_attachments()
+
         def edit_record(self):
                 self.close()
                 dialog = EntryDialog(self.parent(), self.record_id)
-                if dialog.exec():
-                        self.parent().load_entries()
+                dialog.exec()
 
         def delete_record(self):
                 reply = QMessageBox.question(self, "Confirm Deletion",
@@ -362,159 +879,1030 @@ class ProblemDetailDialog(QDialog):
                                              QMessageBox.StandardButton.No)
 
                 if reply == QMessageBox.StandardButton.Yes:
-                        conn = sqlite3.connect(get_db_path())
-                        cursor = conn.cursor()
-                        cursor.execute("DELETE FROM problems WHERE id = ?", (self.record_id,))
-                        conn.commit()
-                        conn.close()
+                        get_repository().delete(self.record_id)
                         self.accept()  # Close and signal success
 
 
 # Custom RTL Text Delegate for Table Items
-from PyQt6.QtWidgets import QStyledItemDelegate
-from PyQt6.QtGui import QTextDocument
+import html
+from collections import OrderedDict
+from PyQt6.QtWidgets import QStyledItemDelegate, QStyle, QApplication
+from PyQt6.QtGui import QTextDocument, QAbstractTextDocumentLayout, QPalette
 from PyQt6.QtCore import QRectF
 
+# Laid-out documents kept by RTLTextDelegate, enough for several screens of cells
+DOCUMENT_CACHE_SIZE = 512
+
 
 class RTLTextDelegate(QStyledItemDelegate):
+        def __init__(self, parent=None):
+                super().__init__(parent)
+                # LRU of (text, width, font) -> QTextDocument already laid out at that width. Resizing a column
+                # only adds entries for the new width, those of the old one are the first to go
+                self.documents = OrderedDict()
+
+        def clear_cache(self):
+                """Drop laid-out documents, e.g. after a theme change"""
+                self.documents.clear()
+
+        def document(self, text, width, font):
+                key = (text, width, font.key())
+                doc = self.documents.get(key)
+                if doc is not None:
+                        self.documents.move_to_end(key)
+                        return doc
+
+                doc = QTextDocument()
+                doc.setDefaultFont(font)
+                doc.setDocumentMargin(0)
+                doc.setTextWidth(width)
+                # Escaped so user text containing "<" or "&" is shown as typed instead of parsed as markup
+                body = html.escape(text).replace("\n", "<br>")
+                # align="right" is absolute, text-align:right would be mirrored to the left by dir="rtl"
+                doc.setHtml(f'<div dir="rtl" align="right">{body}</div>')
+
+                self.documents[key] = doc
+                if len(self.documents) > DOCUMENT_CACHE_SIZE:
+                        self.documents.popitem(last=False)
+                return doc
+
+        def sizeHint(self, option, index):
+                # Room for the padding added around the text in paint()
+                return super().sizeHint(option, index) + QSize(10, 10)
+
+        @timed("ui.paint")
         def paint(self, painter, option, index):
                 text = index.data(Qt.ItemDataRole.DisplayRole)
                 if text:
                         painter.save()
 
-                        doc = QTextDocument()
-                        doc.setHtml(f'<div dir="rtl" style="text-align:right;">{text}</div>')
-
-                        option.rect.adjust(5, 5, -5, -5)  # Add some padding
-                        painter.translate(option.rect.topLeft())
+                        # Background, alternating colors and selection
+                        style = option.widget.style() if option.widget else QApplication.style()
+                        style.drawPrimitive(QStyle.PrimitiveElement.PE_PanelItemViewItem, option, painter,
+                                            option.widget)
+
+                        selected = option.state & QStyle.StateFlag.State_Selected
+                        color = option.palette.color(
+                                QPalette.ColorRole.HighlightedText if selected else QPalette.ColorRole.Text)
+
+                        rect = option.rect.adjusted(5, 5, -5, -5)  # Add some padding
+                        font = option.font
+
+                        if "\n" not in text and option.fontMetrics.horizontalAdvance(text) <= rect.width():
+                                # Fast path: a single line that fits needs no rich-text layout at all
+                                painter.setPen(color)
+                                painter.setFont(font)
+                                painter.setLayoutDirection(Qt.LayoutDirection.RightToLeft)
+                                painter.drawText(rect, int(Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignAbsolute
+                                                           | Qt.AlignmentFlag.AlignTop), text)
+                        else:
+                                doc = self.document(text, rect.width(), font)
+                                painter.translate(rect.topLeft())
+                                painter.setClipRect(QRectF(0, 0, rect.width(), rect.height()))
 
-                        ctx = QRectF(0, 0, option.rect.width(), option.rect.height())
-                        doc.drawContents(painter, ctx)
+                                context = QAbstractTextDocumentLayout.PaintContext()
+                                context.palette.setColor(QPalette.ColorRole.Text, color)
+                                doc.documentLayout().draw(painter, context)
 
                         painter.restore()
                 else:
                         super().paint(painter, option, index)
 
 
+# Problems Table Model
+import bisect
+from PyQt6.QtCore import QAbstractTableModel, QModelIndex
+
+# Columns are reversed for a better RTL experience
+TABLE_HEADERS = ["Solution", "Problem", "Subject", "Date"]
+
+# Which field of a (id, date, subject, problem_preview, solution_preview) row each column shows
+COLUMN_FIELDS = {0: 4, 1: 3, 2: 2, 3: 1}
+
+# Columns whose rows only carry a preview, with the field holding the full text
+FULL_TEXT_FIELDS = {0: "solution", 1: "problem"}
+
+
+class ProblemTableModel(QAbstractTableModel):
+        """Table model that pages rows in from a keyset query as the view scrolls"""
+
+        def __init__(self, parent=None):
+                super().__init__(parent)
+                self.search_query = RecentQuery()
+                self.records = []
+                # The loaded rows by record id, their sort keys then locate them in records
+                self.rows_by_id = {}
+                self.has_more = False
+
+        def reset_records(self, search_query, records):
+                """Show the first page of search_query, later pages are fetched on demand"""
+                self.beginResetModel()
+                self.search_query = search_query
+                self.records = list(records)
+                self.rows_by_id = {record[0]: record for record in self.records}
+                self.has_more = len(records) >= PAGE_SIZE
+                self.endResetModel()
+
+        def row_of(self, record_id):
+                """Row of the table showing record_id, None if it is not loaded"""
+                record = self.rows_by_id.get(record_id)
+                if record is None:
+                        return None
+                return bisect.bisect_left(self.records, self.search_query.sort_key(record),
+                                          key=self.search_query.sort_key)
+
+        def update_records(self, record_ids, rows):
+                """Show rows, as returned by search_query.rows(record_ids), in place of the given records
+
+                Records missing from rows no longer match the query and are removed. Each record costs a binary
+                search and at most one inserted, removed or moved row, the rest of the table is left as it is.
+                """
+                sort_key = self.search_query.sort_key
+                rows = {row[0]: row for row in rows}
+                for record_id in record_ids:
+                        old = self.row_of(record_id)
+                        row = rows.get(record_id)
+                        new = None
+                        if row is not None:
+                                new = bisect.bisect_left(self.records, sort_key(row), key=sort_key)
+                                if new == len(self.records) and self.has_more:
+                                        # Past the last loaded row, a later page brings it
+                                        new = None
+
+                        if old is None and new is None:
+                                continue
+                        if old is None:
+                                self.beginInsertRows(QModelIndex(), new, new)
+                                self.records.insert(new, row)
+                                self.endInsertRows()
+                        elif new is None:
+                                self.beginRemoveRows(QModelIndex(), old, old)
+                                del self.records[old]
+                                self.endRemoveRows()
+                                del self.rows_by_id[record_id]
+                                continue
+                        elif new in (old, old + 1):
+                                self.records[old] = row
+                                self.dataChanged.emit(self.index(old, 0), self.index(old, len(TABLE_HEADERS) - 1))
+                        else:
+                                # Moved rather than removed and inserted, so that a selected row stays selected
+                                self.beginMoveRows(QModelIndex(), old, old, QModelIndex(), new)
+                                del self.records[old]
+                                new = new if new < old else new - 1
+                                self.records.insert(new, row)
+                                self.endMoveRows()
+                                self.dataChanged.emit(self.index(new, 0), self.index(new, len(TABLE_HEADERS) - 1))
+                        self.rows_by_id[record_id] = row
+
+        def rowCount(self, parent=QModelIndex()):
+                return 0 if parent.isValid() else len(self.records)
+
+        def columnCount(self, parent=QModelIndex()):
+                return 0 if parent.isValid() else len(TABLE_HEADERS)
+
+        def canFetchMore(self, parent=QModelIndex()):
+                return not parent.isValid() and self.has_more
+
+        def fetchMore(self, parent=QModelIndex()):
+                if parent.isValid():
+                        return
+
+                # Every loaded row may have been deleted since
+                after = self.search_query.key(self.records[-1]) if self.records else None
+                page = get_repository().fetch_page(self.search_query, after)
+                self.has_more = len(page) >= PAGE_SIZE
+                # Changes since the loaded rows were ranked shift bm25 scores a little, a row already shown can
+                # then come again past the last one
+                page = [record for record in page if record[0] not in self.rows_by_id]
+                if not page:
+                        return
+
+                first = len(self.records)
+                self.beginInsertRows(QModelIndex(), first, first + len(page) - 1)
+                self.records.extend(page)
+                self.rows_by_id.update((record[0], record) for record in page)
+                self.endInsertRows()
+
+        def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+                if orientation == Qt.Orientation.Horizontal and role == Qt.ItemDataRole.DisplayRole:
+                        return TABLE_HEADERS[section]
+                return None
+
+        def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+                if not index.isValid():
+                        return None
+
+                record = self.records[index.row()]
+                column = index.column()
+                text = str(record[COLUMN_FIELDS[column]] or "")
+
+                if role == Qt.ItemDataRole.DisplayRole:
+                        return text
+                if role == Qt.ItemDataRole.ToolTipRole and column != 3:
+                        if column in FULL_TEXT_FIELDS and is_truncated_preview(text):
+                                # Only hovered cells pay for reading the full text
+                                return get_repository().full_text(record[0], FULL_TEXT_FIELDS[column]) or ""
+                        return text
+                if role == Qt.ItemDataRole.TextAlignmentRole:
+                        if column == 1:
+                                return int(Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignVCenter)
+                        return int(Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter)
+                if role == Qt.ItemDataRole.UserRole:
+                        # Record ID for future reference
+                        return record[0]
+                return None
+
+
+# Change Notifications
+class ChangeNotifier(QObject):
+        """Repository listener handing the changes it reports to the GUI thread, whichever thread made them"""
+        changed = pyqtSignal(str, list)
+
+        def __init__(self, repository, parent=None):
+                super().__init__(parent)
+                self.repository = repository
+                repository.add_listener(self.report)
+
+        def report(self, kind, record_ids):
+                self.changed.emit(kind, record_ids)
+
+        def shutdown(self):
+                self.repository.remove_listener(self.report)
+
+
+# Record Cache
+import threading
+
+# Records kept for the detail and edit dialogs
+RECORD_CACHE_SIZE = 256
+
+# Rows above and below the table's current row read ahead into the cache
+PREFETCH_NEIGHBOURS = 3
+
+
+class RecordCache:
+        """Least recently used (date, subject, problem, solution, revision) rows, as get_for_update returns them
+
+        Records changed through the repository are dropped as it reports them. Changes committed by other
+        processes show in PRAGMA data_version and drop the whole cache.
+        """
+
+        def __init__(self, size=RECORD_CACHE_SIZE):
+                self.size = size
+                self.records = OrderedDict()
+                self.lock = threading.Lock()
+                # Bumped whenever entries are dropped, rows read before that are then not stored
+                self.generation = 0
+                self.repository = None
+                self.data_version = None
+                self.pool = QThreadPool()
+                # One prefetch at a time, so that they share one connection
+                self.pool.setMaxThreadCount(1)
+                self.conn = None
+
+        def validate(self):
+                """Drop everything if the database was changed from elsewhere since the last look"""
+                repository = get_repository()
+                if repository is not self.repository:
+                        self.shutdown()
+                        if self.repository is not None:
+                                self.repository.remove_listener(self.on_change)
+                        self.repository = repository
+                        repository.add_listener(self.on_change)
+                data_version = repository.data_version()
+                if data_version != self.data_version:
+                        self.clear()
+                        self.data_version = data_version
+
+        def get(self, record_id):
+                """The record, None if it does not exist"""
+                self.validate()
+                with self.lock:
+                        record = self.records.get(record_id)
+                        if record is not None:
+                                self.records.move_to_end(record_id)
+                                return record
+                        generation = self.generation
+                record = self.repository.get_for_update(record_id)
+                if record is not None:
+                        self.store({record_id: record}, generation)
+                return record
+
+        def store(self, records, generation):
+                with self.lock:
+                        if generation != self.generation:
+                                return
+                        for record_id, record in records.items():
+                                self.records[record_id] = record
+                                self.records.move_to_end(record_id)
+                        while len(self.records) > self.size:
+                                self.records.popitem(last=False)
+
+        def on_change(self, kind, record_ids):
+                """Repository listener, on the thread that made the change"""
+                if kind == CHANGE_RESET:
+                        self.clear()
+                elif kind != CHANGE_INSERT:
+                        with self.lock:
+                                for record_id in record_ids:
+                                        self.records.pop(record_id, None)
+                                self.generation += 1
+
+        def clear(self):
+                with self.lock:
+                        self.records.clear()
+                        self.generation += 1
+
+        def prefetch(self, record_ids):
+                """Read the records that are not cached yet on a background thread"""
+                self.validate()
+                with self.lock:
+                        missing = [record_id for record_id in record_ids if record_id not in self.records]
+                        generation = self.generation
+                if missing:
+                        self.pool.start(lambda: self.fetch(missing, generation))
+
+        def fetch(self, record_ids, generation):
+                """Runs on the pool's thread"""
+                # Superseded while queued, e.g. by stepping further
+                with self.lock:
+                        if generation != self.generation:
+                                return
+                        record_ids = [record_id for record_id in record_ids if record_id not in self.records]
+                if not record_ids:
+                        return
+                try:
+                        if self.conn is None:
+                                self.conn = self.repository.open_connection(check_same_thread=False)
+                        rows = self.repository.get_many_for_update(record_ids, conn=self.conn)
+                except sqlite3.Error:
+                        # Only a read ahead, the dialogs read the record themselves on a miss
+                        return
+                self.store({row[0]: row[1:] for row in rows}, generation)
+
+        def shutdown(self):
+                """Wait for the running prefetch and close its connection"""
+                self.pool.clear()
+                self.pool.waitForDone()
+                if self.conn is not None:
+                        self.conn.close()
+                        self.conn = None
+                self.clear()
+
+
+record_cache = RecordCache()
+
+
+# Background Search Engine
+from PyQt6.QtCore import QTimer
+
+# Delay between the last keystroke and running the search
+SEARCH_DEBOUNCE_MS = 250
+
+
+class SearchWorker(QObject):
+        """Runs search queries on the engine's background thread with its own connection"""
+        results_ready = pyqtSignal(int, object, list, int)
+        search_failed = pyqtSignal(int, str)
+        facets_ready = pyqtSignal(int, dict)
+
+        def __init__(self, engine):
+                super().__init__()
+                self.engine = engine
+                self.conn = None
+
+        def connection(self):
+                if self.conn is None:
+                        # Shared with the GUI thread only for interrupt() and the final close()
+                        self.conn = get_repository().open_connection(check_same_thread=False)
+                return self.conn
+
+        @pyqtSlot(int, object)
+        def run_search(self, generation, search_query):
+                # Skip requests that were superseded while waiting in the queue
+                if generation != self.engine.generation:
+                        return
+
+                try:
+                        # Only the first page is fetched here, the table model pages in the rest on scroll
+                        repository = get_repository()
+                        records = repository.fetch_page(search_query, conn=self.connection())
+                        total = repository.count(search_query, conn=self.connection())
+                except sqlite3.OperationalError as e:
+                        if generation != self.engine.generation:
+                                # Interrupted by a newer keystroke
+                                return
+                        self.search_failed.emit(generation, str(e))
+                        return
+
+                self.results_ready.emit(generation, search_query, records, total)
+                # The table first, the tag counts of the results follow
+                self.count_facets(generation, search_query)
+
+        @pyqtSlot(int, object)
+        def count_facets(self, generation, search_query):
+                if generation != self.engine.generation:
+                        return
+                try:
+                        facets = get_repository().facet_counts(search_query, conn=self.connection())
+                except sqlite3.OperationalError:
+                        # Interrupted, or failed like the search itself, which reported it already
+                        return
+                self.facets_ready.emit(generation, facets)
+
+
+class SearchEngine(QObject):
+        """Debounces search requests and runs them off the GUI thread, dropping stale results"""
+        search_requested = pyqtSignal(int, object)
+        facets_requested = pyqtSignal(int, object)
+        results_ready = pyqtSignal(object, list, int)
+        search_failed = pyqtSignal(str)
+        facets_ready = pyqtSignal(dict)
+
+        def __init__(self, parent=None):
+                super().__init__(parent)
+                self.generation = 0
+                self.pending = None
+
+                self.debounce_timer = QTimer(self)
+                self.debounce_timer.setSingleShot(True)
+                self.debounce_timer.setInterval(SEARCH_DEBOUNCE_MS)
+                self.debounce_timer.timeout.connect(self.dispatch)
+
+                self.thread = QThread()
+                self.worker = SearchWorker(self)
+                self.worker.moveToThread(self.thread)
+                self.search_requested.connect(self.worker.run_search)
+                self.facets_requested.connect(self.worker.count_facets)
+                self.worker.results_ready.connect(self.on_results)
+                self.worker.search_failed.connect(self.on_failed)
+                self.worker.facets_ready.connect(self.on_facets)
+                self.thread.start()
+
+        def submit(self, search_query):
+                """Schedule a search once typing pauses"""
+                self.pending = search_query
+                self.debounce_timer.start()
+
+        def search_now(self, search_query):
+                """Run a search without waiting for the debounce delay"""
+                self.pending = search_query
+                self.debounce_timer.stop()
+                self.dispatch()
+
+        def count_facets(self, search_query):
+                """Count the tags of the rows of search_query, for rows listed without a search"""
+                self.facets_requested.emit(self.generation, search_query)
+
+        def dispatch(self):
+                if self.pending is None:
+                        return
+                search_query = self.pending
+                self.pending = None
+                self.invalidate()
+                self.search_requested.emit(self.generation, search_query)
+
+        def invalidate(self):
+                """Discard pending and in-flight searches"""
+                self.generation += 1
+                self.debounce_timer.stop()
+                if self.worker.conn is not None:
+                        # Abort the query the worker is running, it is stale now
+                        self.worker.conn.interrupt()
+
+        def on_results(self, generation, search_query, records, total):
+                if generation == self.generation:
+                        self.results_ready.emit(search_query, records, total)
+
+        def on_failed(self, generation, message):
+                if generation == self.generation:
+                        self.search_failed.emit(message)
+
+        def on_facets(self, generation, facets):
+                if generation == self.generation:
+                        self.facets_ready.emit(facets)
+
+        def shutdown(self):
+                """Stop the worker thread and close its connection"""
+                self.pending = None
+                self.invalidate()
+                self.thread.quit()
+                self.thread.wait()
+                if self.worker.conn is not None:
+                        self.worker.conn.close()
+                        self.worker.conn = None
+
+
+# Similar Problem Suggestions
+# Delay between the last keystroke and looking up similar problems
+SUGGESTION_DEBOUNCE_MS = 300
+
+
+class SimilarityWorker(QObject):
+        """Owns the similarity index and answers lookups on the engine's background thread"""
+        suggestions_ready = pyqtSignal(int, list)
+        failed = pyqtSignal(str)
+
+        def __init__(self, engine):
+                super().__init__()
+                self.engine = engine
+                self.conn = None
+                self.index = None
+
+        def update_index(self):
+                """Load or build the index on first use, then apply the changes made since it was saved"""
+                # Imported here, on the worker thread, numpy takes a while to load
+                from similarity import SimilarityIndex
+
+                repository = get_repository()
+                if self.conn is None:
+                        # Only closed by the GUI thread, after this thread has stopped
+                        self.conn = repository.open_connection(check_same_thread=False)
+
+                if self.index is None:
+                        self.index = SimilarityIndex.load()
+                        if self.index is None:
+                                self.index = SimilarityIndex.build(repository, self.conn)
+                                self.index.save(full=True)
+                                return
+                if self.index.refresh(repository, self.conn):
+                        self.index.save()
+
+        def guarded(self, action, description):
+                """Result of action, or None once its failure is reported through failed
+
+                Slots must not raise, PyQt aborts the application. An index that fails is thrown away with its
+                files, the next request builds it again from the database.
+                """
+                try:
+                        from similarity import INDEX_ERRORS, SimilarityIndex
+                except ImportError as e:
+                        self.failed.emit(f"Could not {description}: {e}")
+                        return None
+
+                try:
+                        return action()
+                except sqlite3.Error as e:
+                        self.failed.emit(f"Could not {description}: {e}")
+                except INDEX_ERRORS as e:
+                        self.index = None
+                        try:
+                                SimilarityIndex.discard()
+                        except OSError:
+                                pass
+                        self.failed.emit(f"Could not {description}, rebuilding the similarity index: {e!r}")
+                return None
+
+        def lookup(self, text):
+                self.update_index()
+                matches = self.index.query(text)
+                return get_repository().get_summaries([record_id for record_id, _ in matches], conn=self.conn)
+
+        @pyqtSlot()
+        def refresh(self):
+                self.guarded(self.update_index, "update the similarity index")
+
+        @pyqtSlot(int, str)
+        def suggest(self, generation, text):
+                # Skip requests that were superseded while waiting in the queue
+                if generation != self.engine.generation:
+                        return
+
+                records = self.guarded(lambda: self.lookup(text), "look up similar problems")
+                if records is not None:
+                        self.suggestions_ready.emit(generation, records)
+
+
+class SimilarityEngine(QObject):
+        """Debounces similar-problem lookups and runs them off the GUI thread, dropping stale results"""
+        suggest_requested = pyqtSignal(int, str)
+        refresh_requested = pyqtSignal()
+        suggestions_ready = pyqtSignal(list)
+        failed = pyqtSignal(str)
+
+        def __init__(self, parent=None):
+                super().__init__(parent)
+                self.generation = 0
+                self.pending = None
+
+                self.debounce_timer = QTimer(self)
+                self.debounce_timer.setSingleShot(True)
+                self.debounce_timer.setInterval(SUGGESTION_DEBOUNCE_MS)
+                self.debounce_timer.timeout.connect(self.dispatch)
+
+                self.thread = QThread()
+                self.worker = SimilarityWorker(self)
+                self.worker.moveToThread(self.thread)
+                self.suggest_requested.connect(self.worker.suggest)
+                self.refresh_requested.connect(self.worker.refresh)
+                self.worker.suggestions_ready.connect(self.on_suggestions)
+                self.worker.failed.connect(self.failed)
+                self.thread.start()
+
+        def submit(self, text):
+                """Look up problems similar to text once typing pauses"""
+                self.pending = text
+                self.debounce_timer.start()
+
+        def dispatch(self):
+                if self.pending is None:
+                        return
+                text = self.pending
+                self.pending = None
+                self.generation += 1
+                self.suggest_requested.emit(self.generation, text)
+
+        def cancel(self):
+                """Discard pending and in-flight lookups"""
+                self.pending = None
+                self.generation += 1
+                self.debounce_timer.stop()
+
+        def refresh(self):
+                """Bring the index up to date with the database, e.g. after a save"""
+                self.refresh_requested.emit()
+
+        def on_suggestions(self, generation, records):
+                if generation == self.generation:
+                        self.suggestions_ready.emit(records)
+
+        def shutdown(self):
+                """Stop the worker thread and close its connection"""
+                self.cancel()
+                self.thread.quit()
+                self.thread.wait()
+                if self.worker.conn is not None:
+                        self.worker.conn.close()
+                        self.worker.conn = None
+
+
+# Date Range Filter
+# Options of the date filter, the last one asks for a range
+DATE_FILTERS = ["Any date", "Last 7 days", "This month", "Custom range..."]
+CUSTOM_DATE_FILTER = len(DATE_FILTERS) - 1
+
+
+class DateRangeDialog(QDialog):
+        """Asks for an inclusive range of Jalali dates"""
+
+        def __init__(self, parent=None, first=None, last=None):
+                super().__init__(parent)
+                self.setWindowTitle("Custom Date Range")
+                self.days = None
+
+                layout = QVBoxLayout()
+                fields = QHBoxLayout()
+                self.first = QLineEdit(first or jalali_month_start())
+                self.last = QLineEdit(last or jalali_today())
+                for label, field in (("From:", self.first), ("To:", self.last)):
+                        field.setPlaceholderText("YYYY-MM-DD")
+                        fields.addWidget(QLabel(label))
+                        fields.addWidget(field)
+                layout.addLayout(fields)
+
+                buttons = QHBoxLayout()
+                cancel_btn = QPushButton("Cancel")
+                cancel_btn.clicked.connect(self.reject)
+                apply_btn = QPushButton("Apply")
+                apply_btn.setStyleSheet("background-color: #296F62; color: #000000;")
+                apply_btn.clicked.connect(self.apply)
+                buttons.addWidget(cancel_btn)
+                buttons.addWidget(apply_btn)
+                layout.addLayout(buttons)
+                self.setLayout(layout)
+
+        def apply(self):
+                first = jalali_day(self.first.text().strip())
+                last = jalali_day(self.last.text().strip())
+                if first is None or last is None:
+                        QMessageBox.warning(self, "Validation Error", "Enter dates as YYYY-MM-DD, e.g. 1403-01-15")
+                        return
+                self.days = (min(first, last), max(first, last))
+                self.accept()
+
+
+# Tags
+from PyQt6.QtCore import QStringListModel
+from PyQt6.QtWidgets import QCompleter, QTreeWidget, QTreeWidgetItem
+
+# Tags listed per facet in the facet panel, the most used ones
+FACET_TAGS_SHOWN = 30
+
+
+def facet_order(facet):
+        """Sort key of facets, the usual ones first, plain tags last"""
+        if facet in TAG_FACETS:
+                return 0, TAG_FACETS.index(facet), ""
+        return (2 if not facet else 1), 0, facet
+
+
+def facet_title(facet):
+        return facet.capitalize() if facet else "Other"
+
+
+class TagCompleter(QCompleter):
+        """Completes the last tag of a comma separated list, from the tags in use and the usual facets"""
+
+        def __init__(self, parent=None):
+                tags = [format_tag(facet, name) for facet, name in get_repository().all_tags()]
+                super().__init__(QStringListModel([facet + TAG_SEPARATOR for facet in TAG_FACETS] + tags), parent)
+                self.setCaseSensitivity(Qt.CaseSensitivity.CaseInsensitive)
+
+        def splitPath(self, path):
+                return [path.split(",")[-1].strip()]
+
+        def pathFromIndex(self, index):
+                text = self.widget().text()
+                done = text.rsplit(",", 1)[0] + ", " if "," in text else ""
+                return done + super().pathFromIndex(index)
+
+
+class FacetPanel(QTreeWidget):
+        """Tags of the listed rows with their counts, grouped by facet. Checked tags filter the rows"""
+        filter_changed = pyqtSignal()
+
+        def __init__(self, parent=None):
+                super().__init__(parent)
+                self.setHeaderHidden(True)
+                # {facet: {tag_id: name}} of the checked tags
+                self.checked = {}
+                self.itemChanged.connect(self.toggle_tag)
+
+        def tags(self):
+                """{facet: tag ids} of the checked tags, as the queries take them"""
+                return {facet: sorted(tags) for facet, tags in self.checked.items()}
+
+        def show_counts(self, facets):
+                """Show facet_counts results, checked tags stay listed whatever their count"""
+                # No itemChanged while the items are being made
+                self.blockSignals(True)
+                self.clear()
+                for facet in sorted(set(facets) | set(self.checked), key=facet_order):
+                        counts = facets.get(facet, [])[:FACET_TAGS_SHOWN]
+                        checked = self.checked.get(facet, {})
+                        shown = {tag_id for tag_id, _, _ in counts}
+                        counts += [(tag_id, name, 0) for tag_id, name in checked.items() if tag_id not in shown]
+
+                        top = QTreeWidgetItem(self, [facet_title(facet)])
+                        for tag_id, name, records in counts:
+                                item = QTreeWidgetItem(top, [f"{name} ({records})"])
+                                item.setData(0, Qt.ItemDataRole.UserRole, (facet, tag_id, name))
+                                item.setCheckState(0, Qt.CheckState.Checked if tag_id in checked
+                                                   else Qt.CheckState.Unchecked)
+                        top.setExpanded(True)
+                self.blockSignals(False)
+
+        def toggle_tag(self, item, column):
+                tag = item.data(0, Qt.ItemDataRole.UserRole)
+                if tag is None:
+                        return
+                facet, tag_id, name = tag
+                if item.checkState(0) == Qt.CheckState.Checked:
+                        self.checked.setdefault(facet, {})[tag_id] = name
+                else:
+                        self.checked.get(facet, {}).pop(tag_id, None)
+                        if not self.checked.get(facet):
+                                self.checked.pop(facet, None)
+                self.filter_changed.emit()
+
+
+# Diagnostics Dialog
+from PyQt6.QtWidgets import QTableWidget, QTableWidgetItem
+
+# Columns of the latency table, with the histogram field each one shows
+LATENCY_COLUMNS = [("Operation", None), ("Count", "count"), ("Mean ms", "mean_ms"), ("p50 ms", "p50_ms"),
+                   ("p95 ms", "p95_ms"), ("p99 ms", "p99_ms"), ("Max ms", "max_ms")]
+
+
+class DiagnosticsDialog(QDialog):
+        """Latency histograms and slow operations recorded while the tracker runs with --instrument"""
+
+        def __init__(self, parent=None):
+                super().__init__(parent)
+                self.setWindowTitle("Diagnostics")
+                self.setGeometry(300, 150, 1000, 700)
+                layout = QVBoxLayout()
+
+                if instrumentation.ENABLED:
+                        message = (f"Operations taking {instrumentation.recorder.slow_threshold_ms} ms or more are"
+                                   f" logged to {instrumentation.recorder.slow_log_path or 'memory only'}")
+                else:
+                        message = "Instrumentation is off, start the tracker with --instrument to record timings."
+                layout.addWidget(QLabel(message))
+
+                self.latencies = QTableWidget(0, len(LATENCY_COLUMNS))
+                self.latencies.setHorizontalHeaderLabels([title for title, _ in LATENCY_COLUMNS])
+                self.latencies.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+                self.latencies.verticalHeader().setVisible(False)
+                self.latencies.horizontalHeader().setSectionResizeMode(0, QHeaderView.ResizeMode.Stretch)
+                layout.addWidget(self.latencies, 2)
+
+                layout.addWidget(QLabel("Slow operations:"))
+                slow_layout = QHBoxLayout()
+                self.slow_list = QListWidget()
+                self.slow_list.currentRowChanged.connect(self.show_slow_operation)
+                slow_layout.addWidget(self.slow_list, 1)
+                self.slow_details = QTextEdit()
+                self.slow_details.setReadOnly(True)
+                slow_layout.addWidget(self.slow_details, 2)
+                layout.addLayout(slow_layout, 3)
+
+                # Buttons
+                button_layout = QHBoxLayout()
+                for label, slot in (("Refresh", self.refresh), ("Reset", self.reset),
+                                    ("Save as JSON...", self.save_json), ("Close", self.accept)):
+                        button = QPushButton(label)
+                        button.clicked.connect(slot)
+                        button_layout.addWidget(button)
+                layout.addLayout(button_layout)
+
+                self.setLayout(layout)
+                self.refresh()
+
+        def refresh(self):
+                snapshot = instrumentation.recorder.snapshot()
+                histograms = snapshot["histograms"]
+                self.latencies.setRowCount(len(histograms))
+                for row, (name, histogram) in enumerate(histograms.items()):
+                        for column, (_, field) in enumerate(LATENCY_COLUMNS):
+                                if field is None:
+                                        text = name
+                                elif field == "count":
+                                        text = str(histogram[field])
+                                else:
+                                        text = f"{histogram[field]:.2f}"
+                                item = QTableWidgetItem(text)
+                                if field is not None:
+                                        item.setTextAlignment(
+                                                Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter)
+                                self.latencies.setItem(row, column, item)
+
+                # Newest first
+                self.slow_operations = snapshot["slow_operations"][::-1]
+                self.slow_list.clear()
+                for entry in self.slow_operations:
+                        self.slow_list.addItem(f"{entry['time']}  {entry['operation']}  {entry['duration_ms']:.0f} ms")
+                self.slow_details.clear()
+
+        def show_slow_operation(self, row):
+                if not 0 <= row < len(self.slow_operations):
+                        return
+                entry = self.slow_operations[row]
+                lines = [f"{entry['operation']} took {entry['duration_ms']:.1f} ms on {entry['thread']}", ""]
+                for statement in entry["statements"]:
+                        lines.append(statement["sql"])
+                        lines.extend(f"    {detail}" for detail in statement["plan"])
+                        lines.append("")
+                if not entry["statements"]:
+                        lines.append("No SQL was run.")
+                self.slow_details.setPlainText("\n".join(lines))
+
+        def reset(self):
+                instrumentation.recorder.reset()
+                self.refresh()
+
+        def save_json(self):
+                options = QFileDialog.Option.DontUseNativeDialog
+                file_path, _ = QFileDialog.getSaveFileName(self, "Save Diagnostics", "diagnostics.json",
+                                                           "JSON Files (*.json)", options=options)
+                if file_path:
+                        try:
+                                instrumentation.recorder.dump(file_path)
+                        except OSError as e:
+                                QMessageBox.critical(self, "Error", f"Failed to save diagnostics: {str(e)}")
+
+
+# Application Style
+# Applied once to the whole application, so it is parsed a single time rather than per window
+APP_STYLESHEET = """
+    QMainWindow {
+        background-color: #30302E;
+        font-family: 'Segoe UI', Arial, sans-serif;
+        font-size: 10pt;
+        color: #FFFFFF;
+    }
+    QWidget {
+        background-color: #30302E;
+        color: #FFFFFF;
+    }
+    QPushButton {
+        padding: 8px 16px;
+        border-radius: 4px;
+        border: none;
+        font-weight: bold;
+        background-color: #4A4A48;
+        color: #FFFFFF;
+    }
+    QPushButton:hover {
+        background-color: #5A5A58;
+    }
+    QLineEdit, QTextEdit {
+        padding: 8px;
+        border: 1px solid #4A4A48;
+        border-radius: 4px;
+        background-color: #3A3A38;
+        color: #FFFFFF;
+        selection-background-color: #5E9CF9;
+        selection-color: #30302E;
+    }
+    QComboBox {
+        padding: 8px;
+        border: 1px solid #4A4A48;
+        border-radius: 4px;
+        background-color: #3A3A38;
+        color: #FFFFFF;
+        selection-background-color: #5E9CF9;
+    }
+    QComboBox QAbstractItemView {
+        background-color: #3A3A38;
+        color: #FFFFFF;
+        selection-background-color: #5E9CF9;
+        selection-color: #30302E;
+    }
+    QTableView {
+        gridline-color: #4A4A48;
+        background-color: #3A3A38;
+        color: #FFFFFF;
+        selection-background-color: #5E9CF9;
+        selection-color: #30302E;
+        alternate-background-color: #454543;
+        border: 1px solid #4A4A48;
+        border-radius: 4px;
+    }
+    QTreeWidget {
+        background-color: #3A3A38;
+        color: #FFFFFF;
+        selection-background-color: #5E9CF9;
+        selection-color: #30302E;
+        border: 1px solid #4A4A48;
+        border-radius: 4px;
+    }
+    QHeaderView::section {
+        background-color: #252523;
+        color: #FFFFFF;
+        padding: 8px;
+        font-weight: bold;
+        border: none;
+        border-right: 1px solid #4A4A48;
+    }
+    QScrollBar:vertical {
+        background-color: #3A3A38;
+        width: 14px;
+        margin: 15px 3px 15px 3px;
+        border: 1px solid #4A4A48;
+        border-radius: 4px;
+    }
+    QScrollBar::handle:vertical {
+        background-color: #4A4A48;
+        min-height: 20px;
+        border-radius: 2px;
+    }
+    QScrollBar::add-line:vertical {
+        background: none;
+        height: 0px;
+    }
+    QScrollBar::sub-line:vertical {
+        background: none;
+        height: 0px;
+    }
+    QStatusBar {
+        background-color: #252523;
+        color: #FFFFFF;
+    }
+    QLabel {
+        color: #FFFFFF;
+        background: transparent;
+    }
+    QFrame {
+        background-color: #4A4A48;
+    }
+    QMenu {
+        background-color: #3A3A38;
+        color: #FFFFFF;
+        border: 1px solid #4A4A48;
+    }
+    QMenu::item:selected {
+        background-color: #5E9CF9;
+        color: #30302E;
+    }
+    QToolTip {
+        background-color: #3A3A38;
+        color: #FFFFFF;
+        border: 1px solid #4A4A48;
+    }
+    QTableView::item {
+        direction: rtl;
+        text-align: right;
+    }
+"""
+
+
 # Main Application Window
 class MainApp(QMainWindow):
         def __init__(self):
                 super().__init__()
                 self.setWindowTitle("IT Problem Tracker")
                 self.setGeometry(300, 100, 1200, 800)
-                self.setStyleSheet("""
-        QMainWindow {
-            background-color: #30302E;
-            font-family: 'Segoe UI', Arial, sans-serif;
-            font-size: 10pt;
-            color: #FFFFFF;
-        }
-        QWidget {
-            background-color: #30302E;
-            color: #FFFFFF;
-        }
-        QPushButton {
-            padding: 8px 16px;
-            border-radius: 4px;
-            border: none;
-            font-weight: bold;
-            background-color: #4A4A48;
-            color: #FFFFFF;
-        }
-        QPushButton:hover {
-            background-color: #5A5A58;
-        }
-        QLineEdit, QTextEdit {
-            padding: 8px;
-            border: 1px solid #4A4A48;
-            border-radius: 4px;
-            background-color: #3A3A38;
-            color: #FFFFFF;
-            selection-background-color: #5E9CF9;
-            selection-color: #30302E;
-        }
-        QComboBox {
-            padding: 8px;
-            border: 1px solid #4A4A48;
-            border-radius: 4px;
-            background-color: #3A3A38;
-            color: #FFFFFF;
-            selection-background-color: #5E9CF9;
-        }
-        QComboBox QAbstractItemView {
-            background-color: #3A3A38;
-            color: #FFFFFF;
-            selection-background-color: #5E9CF9;
-            selection-color: #30302E;
-        }
-        QTableWidget {
-            gridline-color: #4A4A48;
-            background-color: #3A3A38;
-            color: #FFFFFF;
-            selection-background-color: #5E9CF9;
-            selection-color: #30302E;
-            alternate-background-color: #454543;
-            border: 1px solid #4A4A48;
-            border-radius: 4px;
-        }
-        QHeaderView::section {
-            background-color: #252523;
-            color: #FFFFFF;
-            padding: 8px;
-            font-weight: bold;
-            border: none;
-            border-right: 1px solid #4A4A48;
-        }
-        QScrollBar:vertical {
-            background-color: #3A3A38;
-            width: 14px;
-            margin: 15px 3px 15px 3px;
-            border: 1px solid #4A4A48;
-            border-radius: 4px;
-        }
-        QScrollBar::handle:vertical {
-            background-color: #4A4A48;
-            min-height: 20px;
-            border-radius: 2px;
-        }
-        QScrollBar::add-line:vertical {
-            background: none;
-            height: 0px;
-        }
-        QScrollBar::sub-line:vertical {
-            background: none;
-            height: 0px;
-        }
-        QStatusBar {
-            background-color: #252523;
-            color: #FFFFFF;
-        }
-        QLabel {
-            color: #FFFFFF;
-            background: transparent;
-        }
-        QFrame {
-            background-color: #4A4A48;
-        }
-        QMenu {
-            background-color: #3A3A38;
-            color: #FFFFFF;
-            border: 1px solid #4A4A48;
-        }
-        QMenu::item:selected {
-            background-color: #5E9CF9;
-            color: #30302E;
-        }
-        QToolTip {
-            background-color: #3A3A38;
-            color: #FFFFFF;
-            border: 1px solid #4A4A48;
-        }
-        QTableWidget::item {
-            direction: rtl;
-            text-align: right;
-        }
-    """)
 
                 # Create central widget
                 central_widget = QWidget()
@@ -534,6 +1922,19 @@ class MainApp(QMainWindow):
                 self.status_label.setStyleSheet("background: transparent;")
                 self.statusBar.addPermanentWidget(self.status_label)
 
+                # Searches run on a background thread
+                self.search_engine = SearchEngine(self)
+                self.search_engine.results_ready.connect(self.show_search_results)
+                self.search_engine.search_failed.connect(self.show_search_error)
+
+                # Suggests existing problems similar to a new one, also off the GUI thread
+                self.similarity_engine = SimilarityEngine(self)
+                self.similarity_engine.failed.connect(self.show_similarity_error)
+
+                # Saved changes are applied to the rows shown rather than reloading them
+                self.change_notifier = ChangeNotifier(get_repository(), self)
+                self.change_notifier.changed.connect(self.apply_changes)
+
                 # Top controls
                 top_layout = QHBoxLayout()
 
@@ -541,7 +1942,7 @@ class MainApp(QMainWindow):
                 search_layout = QVBoxLayout()
                 self.search_bar = QLineEdit()
                 self.search_bar.setPlaceholderText("Search by subject, problem, or solution...")
-                self.search_bar.textChanged.connect(self.search)
+                self.search_bar.textChanged.connect(self.schedule_search)
                 self.search_bar.setLayoutDirection(Qt.LayoutDirection.RightToLeft)  # Right-to-left for Persian
                 search_layout.addWidget(self.search_bar)
                 top_layout.addLayout(search_layout, 3)
@@ -553,6 +1954,21 @@ class MainApp(QMainWindow):
                 self.filter_combo.currentTextChanged.connect(self.search)
                 self.filter_combo.setLayoutDirection(Qt.LayoutDirection.RightToLeft)  # Right-to-left for Persian
                 filter_layout.addWidget(self.filter_combo)
+
+                # Fuzzy search tolerates misspelled keywords
+                self.fuzzy_check = QCheckBox("Fuzzy")
+                self.fuzzy_check.setToolTip("Also find records with similar spellings of the keyword")
+                self.fuzzy_check.setStyleSheet("background: transparent;")
+                self.fuzzy_check.toggled.connect(self.search)
+                filter_layout.addWidget(self.fuzzy_check)
+
+                # Date range of the listed records, applied to searches as well
+                self.days = None
+                self.date_combo = QComboBox()
+                self.date_combo.addItems(DATE_FILTERS)
+                self.date_combo.activated.connect(self.change_date_filter)
+                filter_layout.addWidget(self.date_combo)
+                self.date_filter = 0
                 top_layout.addLayout(filter_layout, 1)
 
                 # Actions panel
@@ -588,23 +2004,22 @@ class MainApp(QMainWindow):
                         "color: #CCCCCC; font-style: italic; margin-bottom: 5px; background: transparent;")
                 main_layout.addWidget(instruction_label)
 
-                self.table = QTableWidget()
-                self.table.setColumnCount(4)
+                # Rows are paged in by the model as the table scrolls
+                self.model = ProblemTableModel(self)
+                self.table = QTableView()
+                self.table.setModel(self.model)
 
                 # Set table to RTL layout direction
                 self.table.setLayoutDirection(Qt.LayoutDirection.RightToLeft)
 
-                # Reverse the column order for better RTL experience
-                self.table.setHorizontalHeaderLabels(["Solution", "Problem", "Subject", "Date"])
-
                 # Set RTL alignment for header
                 self.table.horizontalHeader().setLayoutDirection(Qt.LayoutDirection.RightToLeft)
 
                 # Add custom delegate for RTL text direction
-                rtl_delegate = RTLTextDelegate()
-                self.table.setItemDelegate(rtl_delegate)
+                self.rtl_delegate = RTLTextDelegate(self.table)
+                self.table.setItemDelegate(self.rtl_delegate)
 
-                self.table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)  # Disable direct editing
+                self.table.setEditTriggers(QTableView.EditTrigger.NoEditTriggers)  # Disable direct editing
                 self.table.setAlternatingRowColors(True)
                 self.table.verticalHeader().setVisible(False)  # Hide row numbers
                 self.table.verticalHeader().setDefaultSectionSize(60)  # Increase row height
@@ -618,21 +2033,33 @@ class MainApp(QMainWindow):
                 self.table.horizontalHeader().setSectionResizeMode(0, QHeaderView.ResizeMode.Stretch)  # Solution
 
                 self.table.doubleClicked.connect(self.show_details)  # Double-click to view details
+                # Opening the records around the current row then needs no query
+                self.table.selectionModel().currentRowChanged.connect(self.prefetch_neighbours)
 
                 # Additional stylesheet for table items to ensure RTL text flow
                 self.table.setStyleSheet("""
-            QTableWidget::item {
+            QTableView::item {
                 direction: rtl;
                 text-align: right;
             }
             """)
 
-                main_layout.addWidget(self.table)
+                # Tags of the listed rows, beside the table
+                self.facet_panel = FacetPanel()
+                self.facet_panel.filter_changed.connect(self.search)
+                self.search_engine.facets_ready.connect(self.facet_panel.show_counts)
+
+                splitter = QSplitter(Qt.Orientation.Horizontal)
+                splitter.addWidget(self.facet_panel)
+                splitter.addWidget(self.table)
+                splitter.setStretchFactor(1, 1)
+                splitter.setSizes([220, 980])
+                main_layout.addWidget(splitter)
 
                 # Display application data directory in status bar temporarily
                 self.status_label.setText(f"Data directory: {get_data_dir()}")
-                # Load entries after a short delay
-                self.load_entries()
+                # Load entries once the window has painted
+                QTimer.singleShot(0, self.load_entries)
 
         def create_toolbar(self):
                 toolbar = QToolBar("Main Toolbar")
@@ -663,141 +2090,279 @@ class MainApp(QMainWindow):
 
                 # Export backup action
                 export_action = QAction("Export Backup", self)
-                export_action.triggered.connect(export_backup)
+                export_action.triggered.connect(lambda: export_backup(self))
                 toolbar.addAction(export_action)
 
+                # Incremental backup action
+                incremental_action = QAction("Export Incremental Backup", self)
+                incremental_action.triggered.connect(lambda: export_incremental(self))
+                toolbar.addAction(incremental_action)
+
                 # Import backup action
                 import_action = QAction("Import Backup", self)
                 import_action.triggered.connect(self.import_and_refresh)
                 toolbar.addAction(import_action)
 
+                toolbar.addSeparator()
+
+                # Snapshot actions
+                snapshot_action = QAction("Export Snapshot", self)
+                snapshot_action.triggered.connect(lambda: export_snapshot_backup(self))
+                toolbar.addAction(snapshot_action)
+
+                restore_snapshot_action = QAction("Restore Snapshot", self)
+                restore_snapshot_action.triggered.connect(self.restore_snapshot_and_refresh)
+                toolbar.addAction(restore_snapshot_action)
+
+                toolbar.addSeparator()
+
+                # Latency histograms and slow operations
+                diagnostics_action = QAction("Diagnostics", self)
+                diagnostics_action.triggered.connect(lambda: DiagnosticsDialog(self).exec())
+                toolbar.addAction(diagnostics_action)
+
                 self.addToolBar(toolbar)
 
-        def load_entries(self, limit=20):
-                """Load entries from database with optional limit"""
-                conn = sqlite3.connect(get_db_path())
-                cursor = conn.cursor()
-                cursor.execute("SELECT id, date, subject, problem, solution FROM problems ORDER BY id DESC LIMIT ?",
-                               (limit,))
-                records = cursor.fetchall()
-                conn.close()
-
-                self.display_records(records)
-                self.status_label.setText(f"Showing {len(records)} records")
+        @timed("ui.load_entries")
+        def load_entries(self):
+                """Load the most recent entries, older ones are paged in as the table scrolls"""
+                search_query = RecentQuery(self.days, self.facet_panel.tags())
+                repository = get_repository()
+                records = repository.fetch_page(search_query)
+                total = repository.count(search_query)
+
+                self.display_records(search_query, records)
+                self.search_engine.count_facets(search_query)
+                self.status_label.setText(f"Showing {total} records")
                 self.status_label.setStyleSheet("background: transparent;")
 
-        def display_records(self, records):
-                """Display the given records in the table"""
-                self.table.setRowCount(len(records))
-                for row_idx, row_data in enumerate(records):
-                        record_id = row_data[0]
-
-                        # Truncate long text for display
-                        truncate_length = 100
-
-                        # Date (column index changed for RTL)
-                        date_item = QTableWidgetItem(str(row_data[1]))
-                        date_item.setTextAlignment(int(Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter))
-                        self.table.setItem(row_idx, 3, date_item)  # Changed column index for RTL
-
-                        # Subject (column index changed for RTL)
-                        subject_item = QTableWidgetItem(row_data[2])
-                        subject_item.setTextAlignment(int(Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter))
-                        subject_item.setToolTip(row_data[2])
-                        self.table.setItem(row_idx, 2, subject_item)  # Changed column index for RTL
-
-                        # Problem (truncated) (column index changed for RTL)
-                        problem_text = row_data[3]
-                        problem_display = problem_text[:truncate_length] + "..." if len(
-                                problem_text) > truncate_length else problem_text
-                        problem_item = QTableWidgetItem(problem_display)
-                        problem_item.setTextAlignment(Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignVCenter)
-                        problem_item.setToolTip(problem_text)
-                        self.table.setItem(row_idx, 1, problem_item)  # Changed column index for RTL
-
-                        # Solution (truncated) (column index changed for RTL)
-                        solution_text = row_data[4]
-                        solution_display = solution_text[:truncate_length] + "..." if len(
-                                solution_text) > truncate_length else solution_text
-                        solution_item = QTableWidgetItem(solution_display)
-                        solution_item.setTextAlignment(int(Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter))
-                        solution_item.setToolTip(solution_text)
-                        self.table.setItem(row_idx, 0, solution_item)  # Changed column index for RTL
-
-                        # Store record ID in each item for future reference
-                        for col in range(4):
-                                item = self.table.item(row_idx, col)
-                                item.setData(Qt.ItemDataRole.UserRole, record_id)
+        @timed("ui.display_records")
+        def display_records(self, search_query, records):
+                """Display the first page of records returned by search_query in the table"""
+                self.model.reset_records(search_query, records)
+                self.table.scrollToTop()
+
+        def schedule_search(self):
+                """Search once the user pauses typing"""
+                keyword = self.search_bar.text()
+                if not keyword:
+                        self.search()
+                        return
+                self.search_engine.submit(self.search_query(keyword))
 
         def search(self):
                 """Search database based on keyword and filter"""
                 keyword = self.search_bar.text()
-                filter_by = self.filter_combo.currentText()
-
-                conn = sqlite3.connect("problems.db")
-                cursor = conn.cursor()
 
                 if not keyword:
                         # If search is empty, show recent entries
+                        self.search_engine.invalidate()
                         self.load_entries()
                         return
 
-                # Build query based on filter
-                if filter_by == "All":
-                        query = """SELECT id, date, subject, problem, solution FROM problems 
-                    WHERE subject LIKE ? OR problem LIKE ? OR solution LIKE ? 
-                    ORDER BY id DESC"""
-                        params = (f"%{keyword}%", f"%{keyword}%", f"%{keyword}%")
-                elif filter_by == "Subject":
-                        query = """SELECT id, date, subject, problem, solution FROM problems 
-                    WHERE subject LIKE ? ORDER BY id DESC"""
-                        params = (f"%{keyword}%",)
-                elif filter_by == "Problem":
-                        query = """SELECT id, date, subject, problem, solution FROM problems 
-                    WHERE problem LIKE ? ORDER BY id DESC"""
-                        params = (f"%{keyword}%",)
-                elif filter_by == "Solution":
-                        query = """SELECT id, date, subject, problem, solution FROM problems 
-                    WHERE solution LIKE ? ORDER BY id DESC"""
-                        params = (f"%{keyword}%",)
-
-                cursor.execute(query, params)
-                records = cursor.fetchall()
-                conn.close()
-
-                self.display_records(records)
-                self.status_label.setText(f"Found {len(records)} matching records")
+                self.search_engine.search_now(self.search_query(keyword))
+
+        def search_query(self, keyword):
+                """Query for keyword with the current filter and search mode"""
+                query_class = FuzzyQuery if self.fuzzy_check.isChecked() else SearchQuery
+                return query_class(keyword, self.filter_combo.currentText(), self.days, self.facet_panel.tags())
+
+        def change_date_filter(self, option):
+                """Apply the date range picked in date_combo"""
+                last = jalali_day(jalali_today())
+                if option == 0:
+                        days = None
+                elif option == 1:
+                        days = (last - 6, last)
+                elif option == 2:
+                        days = (jalali_day(jalali_month_start()), last)
+                else:
+                        dialog = DateRangeDialog(self, *self.custom_range())
+                        if not dialog.exec():
+                                # Keep the filter that was in effect
+                                self.date_combo.setCurrentIndex(self.date_filter)
+                                return
+                        days = dialog.days
+                        start, end = (str(jalali_from_day(day)) for day in days)
+                        self.date_combo.setItemText(CUSTOM_DATE_FILTER, f"{start} to {end}")
+
+                self.date_filter = option
+                self.days = days
+                self.search()
+
+        def custom_range(self):
+                """The custom range last applied, as Jalali date strings"""
+                if self.date_filter != CUSTOM_DATE_FILTER:
+                        return None, None
+                return tuple(str(jalali_from_day(day)) for day in self.days)
+
+        def show_search_results(self, search_query, records, total):
+                """Display the results delivered by the search engine"""
+                self.display_records(search_query, records)
+                self.status_label.setText(f"Found {total} matching records")
+
+        def show_search_error(self, message):
+                self.status_label.setText(f"Search failed: {message}")
+
+        def show_similarity_error(self, message):
+                self.status_label.setText(message)
 
         def add_new_entry(self):
                 """Open dialog to add a new entry"""
                 dialog = EntryDialog(self)
                 if dialog.exec():
-                        self.load_entries()
+                        self.similarity_engine.refresh()
                         self.status_label.setText("New problem added successfully")
 
         def show_details(self, index):
                 """Show detailed view of a problem when double-clicked"""
-                record_id = self.table.item(index.row(), index.column()).data(Qt.ItemDataRole.UserRole)
+                record_id = index.data(Qt.ItemDataRole.UserRole)
                 if record_id:
                         dialog = ProblemDetailDialog(self, record_id)
                         if dialog.exec():  # This will be true if delete was successful
-                                self.load_entries()
                                 self.status_label.setText("Problem deleted successfully")
+                        # The record may have been edited or deleted
+                        self.similarity_engine.refresh()
+
+        @timed("ui.apply_changes")
+        def apply_changes(self, kind, record_ids):
+                """Show records added, edited or deleted anywhere in the application, keeping the query,
+                the selection and the rows in view"""
+                if kind == CHANGE_RESET:
+                        self.reload_results()
+                        self.similarity_engine.refresh()
+                        return
+                search_query = self.model.search_query
+                rows = [] if kind == CHANGE_DELETE else get_repository().fetch_rows(search_query, record_ids)
+
+                # The record at the top of the view stays there, unless the view is at the very top
+                anchor = None
+                if self.table.verticalScrollBar().value() > 0 and self.table.rowAt(0) >= 0:
+                        anchor = self.model.records[self.table.rowAt(0)][0]
+                self.model.update_records(record_ids, rows)
+                row = self.model.row_of(anchor) if anchor is not None else None
+                if row is not None:
+                        self.table.scrollTo(self.model.index(row, 0), QTableView.ScrollHint.PositionAtTop)
+                # Tags may have changed with the records
+                self.search_engine.count_facets(search_query)
+
+        def reload_results(self):
+                """Run the query shown again, after changes too many to apply one by one"""
+                search_query = self.model.search_query
+                if isinstance(search_query, RecentQuery):
+                        self.load_entries()
+                else:
+                        self.search_engine.search_now(search_query)
+
+        def prefetch_neighbours(self, current, previous):
+                if not current.isValid():
+                        return
+                records = self.model.records
+                first = max(0, current.row() - PREFETCH_NEIGHBOURS)
+                last = min(len(records), current.row() + PREFETCH_NEIGHBOURS + 1)
+                record_cache.prefetch([record[0] for record in records[first:last]])
 
         def import_and_refresh(self):
                 """Import backup and refresh the view if successful"""
-                if import_backup():
-                        self.load_entries()
+                if import_backup(self):
+                        self.similarity_engine.refresh()
                         self.status_label.setText("Database restored from backup")
 
+        def restore_snapshot_and_refresh(self):
+                """Restore a snapshot and refresh the view if successful"""
+                if restore_snapshot_backup(self):
+                        self.similarity_engine.refresh()
+                        self.status_label.setText("Database restored from snapshot")
+
+        def changeEvent(self, event):
+                # Cached cell layouts depend on the palette, style and font
+                delegate = getattr(self, "rtl_delegate", None)  # Style changes also arrive during __init__
+                if delegate and event.type() in (QEvent.Type.PaletteChange, QEvent.Type.StyleChange,
+                                                 QEvent.Type.FontChange):
+                        delegate.clear_cache()
+                super().changeEvent(event)
+
+        def closeEvent(self, event):
+                self.search_engine.shutdown()
+                self.similarity_engine.shutdown()
+                self.change_notifier.shutdown()
+                record_cache.shutdown()
+                thumbnail_loader.shutdown()
+                get_repository().close()
+                super().closeEvent(event)
+
+
+# Database Upgrade
+def upgrade_database():
+        """Bring the database up to the current schema, behind a progress dialog when there is anything to do"""
+        # A current schema costs a single pragma read, everything else happens on a worker thread
+        if not get_repository().needs_upgrade():
+                return True
+        try:
+                run_with_progress(None, "Upgrading Database", "Upgrading the database to the new version...",
+                                  lambda progress, is_cancelled: init_db(progress, is_cancelled))
+        except MigrationCancelled:
+                QMessageBox.information(None, "Upgrade Paused",
+                                        "The upgrade will resume where it stopped the next time the application starts.")
+                return False
+        except sqlite3.Error as e:
+                QMessageBox.critical(None, "Error", f"Failed to upgrade the database: {e}")
+                return False
+        return True
+
+
+# Startup Profiling
+class StartupProfile:
+        """Times the phases of startup, reported with --profile-startup"""
+
+        def __init__(self, enabled, started_at):
+                self.enabled = enabled
+                self.started_at = started_at
+                self.last = started_at
+                self.phases = []
+
+        def mark(self, phase):
+                """Record that phase, starting where the previous one ended, has just finished"""
+                if not self.enabled:
+                        return
+                now = time.perf_counter()
+                self.phases.append((phase, now - self.last))
+                self.last = now
+
+        def report(self):
+                if not self.enabled:
+                        return
+                for phase, seconds in self.phases:
+                        print(f"{phase:<32}{seconds * 1000:8.1f} ms")
+                print(f"{'Total':<32}{(self.last - self.started_at) * 1000:8.1f} ms")
+
 
 if __name__ == "__main__":
-        init_db()
+        profile = StartupProfile("--profile-startup" in sys.argv, STARTED_AT)
+        profile.mark("Imports")
+        if "--instrument" in sys.argv:
+                # Before any connection is opened, so that every one of them is traced
+                instrumentation.enable(os.path.join(get_data_dir(), "slow-operations.log"))
         app = QApplication(sys.argv)
 
         # In PyQt6, we use setStyle differently
         app.setStyle("Fusion")  # More modern look
+        app.setStyleSheet(APP_STYLESHEET)
+        profile.mark("Application and stylesheet")
+
+        if not upgrade_database():
+                sys.exit(1)
+        profile.mark("Database check")
 
         window = MainApp()
+        profile.mark("Main window")
         window.show()
-        sys.exit(app.exec())
\ No newline at end of file
+        profile.mark("Show")
+
+        def startup_finished():
+                # Queued behind the deferred initial load, so this runs once the first pass of the event loop is over
+                profile.mark("First paint and initial load")
+                profile.report()
+
+        QTimer.singleShot(0, startup_finished)
+        sys.exit(app.exec())
@@ -0,0 +1,642 @@
+import base64
+import gzip
+import hashlib
+import io
+import itertools
+import json
+import os
+import sqlite3
+
+from database import CHANGE_RESET, SCHEMA_VERSION, BlobWriter, RecentQuery
+from instrumentation import timed
+
+# Streaming backups are gzip-compressed newline-delimited JSON: a header line, then one record per line
+BACKUP_FORMAT = "issue-tracker-backup"
+GZIP_MAGIC = b"\x1f\x8b"
+
+# Full backups hold only records and stay readable by version 1 readers,
+# incremental (delta) backups add {"deleted": id} tombstone lines.
+# Backups with attachments add, after the records, {"blob": hash, "size": n} lines each followed by the
+# content as {"chunk": base64} lines, then one {"attachment": {...}} line per attachment. Such a backup
+# lists every attachment of each record it holds.
+# Backups of tagged records add, right after the records, one {"tags": {"problem_id": id, "tags": [[facet, name]]}}
+# line per tagged record, and likewise list every tag of each record they hold
+FULL_BACKUP_VERSION = 1
+DELTA_BACKUP_VERSION = 2
+ATTACHMENTS_BACKUP_VERSION = 3
+TAGS_BACKUP_VERSION = 4
+BACKUP_FORMAT_VERSION = TAGS_BACKUP_VERSION
+
+BACKUP_FULL = "full"
+BACKUP_DELTA = "delta"
+BACKUP_SNAPSHOT = "snapshot"
+
+# Snapshots are copies of the database file made with the SQLite online backup API
+SNAPSHOT_PAGES_PER_STEP = 1024
+
+# Rows read from the cursor and written per progress update
+EXPORT_CHUNK_SIZE = 1000
+
+# Records inserted per executemany call and progress update when importing
+IMPORT_BATCH_SIZE = 5000
+
+# Characters of a legacy JSON backup decoded at a time
+LEGACY_READ_SIZE = 1024 * 1024
+
+# Import modes
+IMPORT_REPLACE = "replace"
+IMPORT_MERGE_BY_ID = "merge-id"
+IMPORT_MERGE_BY_CONTENT = "merge-content"
+
+
+class BackupCancelled(Exception):
+        """Raised inside a backup job when the user cancels it"""
+
+
+class BackupFormatError(Exception):
+        """Raised when a file is not a backup this application can read"""
+
+
+class BackupChainError(Exception):
+        """Raised when incremental backups cannot be applied in sequence"""
+
+
+@timed("backup.export")
+def export_backup_stream(repository, file_path, progress=None, is_cancelled=None):
+        """Write every record to file_path as a compressed stream, returning the number of records written"""
+        # A private connection: this usually runs on a worker thread, and one read transaction
+        # keeps the header and the rows consistent while the app keeps writing
+        conn = repository.open_connection()
+        try:
+                conn.execute("BEGIN")
+                revision = repository.current_revision(conn)
+                total = conn.execute("SELECT COUNT(*) FROM problems").fetchone()[0]
+                header = {"format": BACKUP_FORMAT, "version": FULL_BACKUP_VERSION, "kind": BACKUP_FULL,
+                          "schema_version": SCHEMA_VERSION, "revision": revision, "row_count": total}
+                records = conn.execute("SELECT id, date, subject, problem, solution FROM problems ORDER BY id")
+
+                # Without attachments the backup stays readable by version 1 readers
+                attachments = None
+                if conn.execute("SELECT 1 FROM attachments LIMIT 1").fetchone():
+                        header.update(version=ATTACHMENTS_BACKUP_VERSION, attachments=True)
+                        attachments = lambda file: _write_attachments(repository, conn, file, "", (), is_cancelled)
+
+                sources = [records]
+                lines = total
+                if conn.execute("SELECT 1 FROM tags LIMIT 1").fetchone():
+                        header.update(version=TAGS_BACKUP_VERSION, tags=True)
+                        sources.append(_tag_lines(conn, "", ()))
+                        lines += conn.execute("SELECT COUNT(DISTINCT problem_id) FROM problem_tags").fetchone()[0]
+
+                _write_stream(file_path, header, sources, lines, progress, is_cancelled, attachments)
+                conn.execute("COMMIT")
+
+                repository.record_backup(conn, BACKUP_FULL, file_path, None, revision)
+                # The count taken in the same read transaction, the tag lines are not records
+                return total
+        finally:
+                conn.close()
+
+
+@timed("backup.export_incremental")
+def export_incremental_backup(repository, file_path, progress=None, is_cancelled=None):
+        """Write the records changed and deleted since the last backup, returning how many records that is"""
+        conn = repository.open_connection()
+        try:
+                conn.execute("BEGIN")
+                base_revision = repository.last_backup_revision(conn)
+                if base_revision is None:
+                        raise BackupChainError("Make a full backup before an incremental one")
+                revision = repository.current_revision(conn)
+
+                # All lookups are range scans on the revision indexes. Records whose attachments changed are
+                # included with their attachments even if their text did not
+                changed = conn.execute("SELECT COUNT(*) FROM problems WHERE revision > ? OR attachments_revision > ?",
+                                       (base_revision, base_revision)).fetchone()[0]
+                deleted = conn.execute("SELECT COUNT(*) FROM deleted_problems WHERE revision > ?",
+                                       (base_revision,)).fetchone()[0]
+                header = {"format": BACKUP_FORMAT, "version": DELTA_BACKUP_VERSION, "kind": BACKUP_DELTA,
+                          "schema_version": SCHEMA_VERSION, "base_revision": base_revision, "revision": revision,
+                          "row_count": changed, "deleted_count": deleted}
+                records = conn.execute("""SELECT id, date, subject, problem, solution FROM problems
+                    WHERE revision > ? OR attachments_revision > ? ORDER BY revision""", (base_revision, base_revision))
+                tombstones = conn.execute("SELECT id FROM deleted_problems WHERE revision > ? ORDER BY revision",
+                                          (base_revision,))
+
+                attachments = None
+                if conn.execute("SELECT 1 FROM attachments LIMIT 1").fetchone() or conn.execute(
+                                "SELECT 1 FROM problems WHERE attachments_revision > ? LIMIT 1", (base_revision,)).fetchone():
+                        header.update(version=ATTACHMENTS_BACKUP_VERSION, attachments=True)
+                        attachments = lambda file: _write_attachments(
+                                repository, conn, file, "WHERE p.revision > ? OR p.attachments_revision > ?",
+                                (base_revision, base_revision), is_cancelled)
+
+                # Tags are never deleted, so once there are any the records in the backup may have lost some
+                # and their tags are listed, even when none are left
+                sources = [records]
+                lines = changed + deleted
+                if conn.execute("SELECT 1 FROM tags LIMIT 1").fetchone():
+                        header.update(version=TAGS_BACKUP_VERSION, tags=True)
+                        sources.append(_tag_lines(conn, "WHERE p.revision > ? OR p.attachments_revision > ?",
+                                                  (base_revision, base_revision)))
+                        lines += conn.execute("""SELECT COUNT(DISTINCT pt.problem_id) FROM problem_tags pt
+                            JOIN problems p ON p.id = pt.problem_id WHERE p.revision > ? OR p.attachments_revision > ?""",
+                                              (base_revision, base_revision)).fetchone()[0]
+                sources.append({"deleted": row[0]} for row in tombstones)
+
+                _write_stream(file_path, header, sources, lines, progress, is_cancelled, attachments)
+                conn.execute("COMMIT")
+
+                repository.record_backup(conn, BACKUP_DELTA, file_path, base_revision, revision)
+                return changed + deleted
+        finally:
+                conn.close()
+
+
+def _snapshot_progress(progress, is_cancelled):
+        """Adapt progress/is_cancelled to the callback of sqlite3.Connection.backup"""
+        def callback(status, remaining, total):
+                if is_cancelled and is_cancelled():
+                        # Raising from the callback aborts the page copy
+                        raise BackupCancelled()
+                if progress:
+                        progress(total - remaining, total)
+        return callback
+
+
+@timed("backup.export_snapshot")
+def export_snapshot(repository, file_path, progress=None, is_cancelled=None):
+        """Copy the database page by page to file_path while the application keeps using it"""
+        source = repository.open_connection()
+        temp_path = file_path + ".part"
+        try:
+                if os.path.exists(temp_path):
+                        os.remove(temp_path)
+                target = sqlite3.connect(temp_path)
+                try:
+                        # Other connections may read and write between steps, a write restarts the copy
+                        source.backup(target, pages=SNAPSHOT_PAGES_PER_STEP,
+                                      progress=_snapshot_progress(progress, is_cancelled))
+                        revision = repository.current_revision(target)
+                        # Make the snapshot a single self-contained file
+                        target.execute("PRAGMA journal_mode=DELETE")
+                finally:
+                        target.close()
+
+                os.replace(temp_path, file_path)
+                repository.record_backup(source, BACKUP_SNAPSHOT, file_path, None, revision)
+                return revision
+        except BaseException:
+                if os.path.exists(temp_path):
+                        os.remove(temp_path)
+                raise
+        finally:
+                source.close()
+
+
+@timed("backup.restore_snapshot")
+def restore_snapshot(repository, file_path, progress=None, is_cancelled=None):
+        """Overwrite the database with a snapshot, page by page, keeping its indexes and search index as they are"""
+        snapshot = sqlite3.connect(f"file:{file_path}?mode=ro", uri=True)
+        target = repository.open_connection()
+        try:
+                try:
+                        has_problems = snapshot.execute(
+                                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'problems'").fetchone()
+                except sqlite3.DatabaseError:
+                        has_problems = None
+                if not has_problems:
+                        raise BackupFormatError("Not an Issue Tracker database snapshot")
+
+                snapshot.backup(target, pages=SNAPSHOT_PAGES_PER_STEP,
+                                progress=_snapshot_progress(progress, is_cancelled))
+                # Snapshots taken by older versions are upgraded in place
+                repository.init_schema(target)
+                # Revisions start over from the snapshot's, so what was derived from the old ones must be too
+                repository.renew_database_id(target)
+                # The database now matches the snapshot, so incremental backups can continue from it
+                repository.record_backup(target, BACKUP_SNAPSHOT, file_path, None, repository.current_revision(target))
+                repository.notify(CHANGE_RESET)
+                return repository.count(RecentQuery(), target)
+        finally:
+                target.close()
+                snapshot.close()
+
+
+def _write_stream(file_path, header, sources, total, progress, is_cancelled, attachments=None):
+        """Write the header and the items of every source (cursors or iterables) as NDJSON lines,
+        then call attachments(file) if given to stream the attachment lines"""
+        temp_path = file_path + ".part"
+        written = 0
+        try:
+                with gzip.open(temp_path, "wt", encoding="utf-8", compresslevel=6) as file:
+                        file.write(json.dumps(header) + "\n")
+
+                        for source in sources:
+                                items = iter(source)
+                                while True:
+                                        if is_cancelled and is_cancelled():
+                                                raise BackupCancelled()
+                                        rows = list(itertools.islice(items, EXPORT_CHUNK_SIZE))
+                                        if not rows:
+                                                break
+                                        file.writelines(json.dumps(row, ensure_ascii=False) + "\n" for row in rows)
+                                        written += len(rows)
+                                        if progress:
+                                                progress(written, total)
+                        if attachments:
+                                attachments(file)
+
+                # Only replace an existing backup once the new one is complete
+                os.replace(temp_path, file_path)
+                return written
+        except BaseException:
+                if os.path.exists(temp_path):
+                        os.remove(temp_path)
+                raise
+
+
+def _tag_lines(conn, condition, params):
+        """{"tags": ...} lines of the tagged records matching condition on problems p"""
+        rows = conn.execute(f"""SELECT pt.problem_id, json_group_array(json_array(t.facet, t.name))
+            FROM problem_tags pt JOIN tags t ON t.id = pt.tag_id JOIN problems p ON p.id = pt.problem_id {condition}
+            GROUP BY pt.problem_id ORDER BY pt.problem_id""", params)
+        return ({"tags": {"problem_id": problem_id, "tags": json.loads(tags)}} for problem_id, tags in rows)
+
+
+def _write_attachments(repository, conn, file, condition, params, is_cancelled):
+        """Write the blobs and attachments of the records matching condition on problems p"""
+        # Each content once, however many attachments share it
+        blobs = conn.execute(f"""SELECT id, hash, size FROM blobs WHERE id IN (
+            SELECT a.blob_id FROM attachments a JOIN problems p ON p.id = a.problem_id {condition}) ORDER BY id""", params)
+        for blob_id, digest, size in blobs:
+                file.write(json.dumps({"blob": digest, "size": size}) + "\n")
+                for chunk in repository.blob_chunks(blob_id, conn):
+                        if is_cancelled and is_cancelled():
+                                raise BackupCancelled()
+                        file.write('{"chunk": "' + base64.b64encode(chunk).decode("ascii") + '"}\n')
+
+        attachments = conn.execute(f"""SELECT a.problem_id, a.name, a.mime_type, a.added_at, b.hash
+            FROM attachments a JOIN blobs b ON b.id = a.blob_id JOIN problems p ON p.id = a.problem_id {condition}
+            ORDER BY a.id""", params)
+        for problem_id, name, mime_type, added_at, digest in attachments:
+                file.write(json.dumps({"attachment": {"problem_id": problem_id, "name": name, "mime_type": mime_type,
+                                                      "added_at": added_at, "hash": digest}}, ensure_ascii=False) + "\n")
+
+
+def is_stream_backup(file_path):
+        with open(file_path, "rb") as file:
+                return file.read(2) == GZIP_MAGIC
+
+
+def read_backup_header(file):
+        """Parse and validate the header line of an open streaming backup"""
+        try:
+                header = json.loads(file.readline())
+        except ValueError:
+                raise BackupFormatError("Backup header is not valid JSON")
+        if not isinstance(header, dict) or header.get("format") != BACKUP_FORMAT:
+                raise BackupFormatError("Not an Issue Tracker backup")
+        if header.get("version", 0) > BACKUP_FORMAT_VERSION:
+                raise BackupFormatError("Backup was written by a newer version of the application")
+        return header
+
+
+def iter_legacy_records(file):
+        """Incrementally decode the records of a legacy JSON array backup"""
+        decoder = json.JSONDecoder()
+        buffer = ""
+        position = 0
+        started = False
+        eof = False
+
+        while True:
+                # Skip whitespace and the array punctuation between records
+                while position < len(buffer) and buffer[position] in " \t\r\n,":
+                        position += 1
+                if not started and position < len(buffer):
+                        if buffer[position] != "[":
+                                raise BackupFormatError("Legacy backup is not a JSON array")
+                        started = True
+                        position += 1
+                        continue
+                if position < len(buffer) and buffer[position] == "]":
+                        return
+
+                try:
+                        record, end = decoder.raw_decode(buffer, position)
+                except ValueError:
+                        # The record is cut off at the end of the buffer, read more
+                        if eof:
+                                raise BackupFormatError("Legacy backup is truncated or not valid JSON")
+                        chunk = file.read(LEGACY_READ_SIZE)
+                        eof = not chunk
+                        buffer = buffer[position:] + chunk
+                        position = 0
+                        continue
+
+                if not started:
+                        raise BackupFormatError("Legacy backup is not a JSON array")
+                yield record
+                position = end
+
+
+class BackupReader:
+        """Iterates the records of a streaming or legacy backup, tracking how much of the file was read"""
+
+        def __init__(self, file_path):
+                self.file_path = file_path
+                self.size = os.path.getsize(file_path)
+                self.raw = open(file_path, "rb")
+                self.header = None
+
+                if self.raw.read(2) == GZIP_MAGIC:
+                        self.raw.seek(0)
+                        self.text = io.TextIOWrapper(gzip.GzipFile(fileobj=self.raw), encoding="utf-8")
+                        self.header = read_backup_header(self.text)
+                else:
+                        self.raw.seek(0)
+                        self.text = io.TextIOWrapper(self.raw, encoding="utf-8")
+
+        @property
+        def kind(self):
+                """BACKUP_FULL, BACKUP_DELTA, or None for a legacy JSON backup"""
+                if self.header is None:
+                        return None
+                return self.header.get("kind", BACKUP_FULL)
+
+        def __iter__(self):
+                if self.header is None:
+                        return iter_legacy_records(self.text)
+                return (json.loads(line) for line in self.text if line.strip())
+
+        def bytes_read(self):
+                """Bytes of the (compressed) file consumed so far"""
+                return self.raw.tell()
+
+        def close(self):
+                self.text.close()
+                self.raw.close()
+
+        def __enter__(self):
+                return self
+
+        def __exit__(self, *exc_info):
+                self.close()
+
+
+def content_hash(subject, problem, solution):
+        """Digest identifying a record by its text, used to skip duplicates when merging"""
+        return hashlib.sha1(json.dumps([subject, problem, solution], ensure_ascii=False).encode("utf-8")).digest()
+
+
+def backup_header(file_path):
+        """Header of a streaming backup, or None for a legacy JSON backup"""
+        with BackupReader(file_path) as reader:
+                return reader.header
+
+
+@timed("backup.import")
+def import_backup_stream(repository, file_path, mode=IMPORT_REPLACE, progress=None, is_cancelled=None):
+        """Load a backup in batches inside one transaction, returning (records read, rows changed)"""
+        conn = repository.open_connection()
+        try:
+                with BackupReader(file_path) as reader:
+                        conn.execute("BEGIN IMMEDIATE")
+                        try:
+                                result = _import_records(repository, conn, reader, mode, progress, is_cancelled)
+                                conn.execute("COMMIT")
+                        except BaseException:
+                                # Nothing is written unless the whole backup was read
+                                conn.execute("ROLLBACK")
+                                raise
+                repository.notify(CHANGE_RESET)
+                return result
+        finally:
+                conn.close()
+
+
+@timed("backup.restore_chain")
+def restore_backup_chain(repository, file_paths, progress=None, is_cancelled=None):
+        """Restore a full backup followed by its incremental backups, or apply incremental backups
+        to the current database when no full backup is given. Returns (records read, rows changed)"""
+        readers = [BackupReader(file_path) for file_path in file_paths]
+        conn = repository.open_connection()
+        try:
+                full = [reader for reader in readers if reader.kind != BACKUP_DELTA]
+                deltas = sorted((reader for reader in readers if reader.kind == BACKUP_DELTA),
+                                key=lambda reader: reader.header["base_revision"])
+                if len(full) > 1:
+                        raise BackupChainError("Select at most one full backup")
+
+                # Every delta must start exactly where the previous backup in the chain ended
+                expected = None
+                if full:
+                        expected = full[0].header.get("revision") if full[0].header else None
+                        if deltas and expected is None:
+                                raise BackupChainError("This full backup predates incremental backups")
+                for reader in deltas:
+                        if expected is not None and reader.header["base_revision"] != expected:
+                                raise BackupChainError(
+                                        f"{os.path.basename(reader.file_path)} does not follow revision {expected}")
+                        expected = reader.header["revision"]
+
+                total_size = sum(reader.size for reader in readers)
+                done_size = 0
+                read = changed = 0
+
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                        for reader, mode in [(reader, IMPORT_REPLACE) for reader in full] + \
+                                            [(reader, IMPORT_MERGE_BY_ID) for reader in deltas]:
+                                step_progress = None
+                                if progress:
+                                        step_progress = lambda done, size, offset=done_size: progress(offset + done,
+                                                                                                      total_size)
+                                step_read, step_changed = _import_records(repository, conn, reader, mode,
+                                                                          step_progress, is_cancelled)
+                                read += step_read
+                                changed += step_changed
+                                done_size += reader.size
+                        conn.execute("COMMIT")
+                except BaseException:
+                        conn.execute("ROLLBACK")
+                        raise
+                repository.notify(CHANGE_RESET)
+                return read, changed
+        finally:
+                conn.close()
+                for reader in readers:
+                        reader.close()
+
+
+def _import_records(repository, conn, reader, mode, progress, is_cancelled):
+        # The backup lists every attachment of its records, which replace the ones those records have
+        with_attachments = bool(reader.header and reader.header.get("attachments"))
+        # and every tag
+        with_tags = bool(reader.header and reader.header.get("tags"))
+        # Ids of the records in the backup to the ids they were given here, when these differ
+        id_map = None
+
+        if mode == IMPORT_REPLACE:
+                repository.begin_bulk_load(conn)
+                conn.execute("DELETE FROM attachments")
+                conn.execute("DELETE FROM problem_tags")
+                conn.execute("DELETE FROM tags")
+                conn.execute("DELETE FROM problems")
+                sql = "INSERT INTO problems (id, date, subject, problem, solution) VALUES (?, ?, ?, ?, ?)"
+        elif mode == IMPORT_MERGE_BY_ID:
+                # Only rows that actually differ are rewritten, so the triggers stay cheap
+                sql = """INSERT INTO problems (id, date, subject, problem, solution) VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT(id) DO UPDATE SET date = excluded.date, subject = excluded.subject,
+                        problem = excluded.problem, solution = excluded.solution
+                    WHERE (problems.date, problems.subject, problems.problem, problems.solution)
+                        IS NOT (excluded.date, excluded.subject, excluded.problem, excluded.solution)"""
+        elif mode == IMPORT_MERGE_BY_CONTENT:
+                sql = "INSERT INTO problems (date, subject, problem, solution) VALUES (?, ?, ?, ?)"
+                known = set()
+                cursor = conn.execute("SELECT subject, problem, solution FROM problems")
+                while True:
+                        rows = cursor.fetchmany(IMPORT_BATCH_SIZE)
+                        if not rows:
+                                break
+                        known.update(content_hash(*row) for row in rows)
+                if with_attachments or with_tags:
+                        id_map = {}
+        else:
+                raise ValueError(f"Unknown import mode: {mode}")
+
+        read = 0
+        changed = 0
+        batch = []
+        deleted = []
+        # Content being copied from {"chunk"} lines, None while skipping the chunks of content already stored
+        blob = None
+        in_blob = False
+
+        def flush():
+                nonlocal changed
+                if batch:
+                        if mode == IMPORT_MERGE_BY_ID and with_attachments:
+                                conn.executemany("DELETE FROM attachments WHERE problem_id = ?",
+                                                 [(record[0],) for record in batch])
+                        if mode == IMPORT_MERGE_BY_ID and with_tags:
+                                conn.executemany("DELETE FROM problem_tags WHERE problem_id = ?",
+                                                 [(record[0],) for record in batch])
+                        if id_map is not None:
+                                # One at a time to learn the new ids, only for backups with attachments or tags
+                                for record in batch:
+                                        id_map[record[0]] = conn.execute(sql, record[1:]).lastrowid
+                                changed += len(batch)
+                        else:
+                                changed += conn.executemany(sql, batch).rowcount
+                        batch.clear()
+                if deleted:
+                        changed += conn.executemany("DELETE FROM problems WHERE id = ?", deleted).rowcount
+                        deleted.clear()
+                if is_cancelled and is_cancelled():
+                        raise BackupCancelled()
+                if progress:
+                        progress(reader.bytes_read(), reader.size)
+
+        def finish_blob():
+                nonlocal blob, in_blob
+                if blob is not None:
+                        try:
+                                blob.close()
+                        except ValueError as e:
+                                raise BackupFormatError(str(e))
+                blob = None
+                in_blob = False
+
+        for record in reader:
+                if isinstance(record, dict) and "chunk" in record:
+                        if not in_blob:
+                                raise BackupFormatError("Attachment content without its blob line")
+                        if blob is not None:
+                                try:
+                                        blob.write(base64.b64decode(record["chunk"]))
+                                except ValueError as e:
+                                        raise BackupFormatError(f"Invalid attachment content in backup: {e}")
+                        continue
+                finish_blob()
+
+                if isinstance(record, dict) and "deleted" in record:
+                        # Tombstone from an incremental backup
+                        deleted.append((record["deleted"],))
+                        continue
+                if isinstance(record, dict) and "blob" in record:
+                        # Attachments follow all records, which have to be in place first
+                        flush()
+                        in_blob = True
+                        if repository.find_blob(conn, record["blob"]) is None:
+                                blob = BlobWriter(conn, record["blob"], record["size"])
+                        if is_cancelled and is_cancelled():
+                                raise BackupCancelled()
+                        continue
+                if isinstance(record, dict) and "attachment" in record:
+                        flush()
+                        _import_attachment(repository, conn, record["attachment"], id_map)
+                        continue
+                if isinstance(record, dict) and "tags" in record:
+                        flush()
+                        _import_tags(repository, conn, record["tags"], id_map)
+                        continue
+                if not isinstance(record, list) or len(record) != 5:
+                        raise BackupFormatError(f"Invalid record in backup: {record!r}")
+                read += 1
+
+                if mode == IMPORT_MERGE_BY_CONTENT:
+                        digest = content_hash(*record[2:])
+                        if digest in known:
+                                continue
+                        known.add(digest)
+                        if id_map is None:
+                                record = record[1:]
+
+                batch.append(record)
+                if len(batch) + len(deleted) >= IMPORT_BATCH_SIZE:
+                        flush()
+        finish_blob()
+        flush()
+
+        if mode == IMPORT_REPLACE:
+                repository.end_bulk_load(conn)
+
+        return read, changed
+
+
+def _import_tags(repository, conn, tags, id_map):
+        """Tag a record imported earlier in the backup"""
+        try:
+                problem_id = tags["problem_id"]
+                pairs = [(facet, name) for facet, name in tags["tags"]]
+        except (KeyError, TypeError, ValueError):
+                raise BackupFormatError(f"Invalid tags in backup: {tags!r}")
+        if id_map is not None:
+                # Records skipped as duplicates keep the tags they already have
+                problem_id = id_map.get(problem_id)
+                if problem_id is None:
+                        return
+        if conn.execute("SELECT 1 FROM problems WHERE id = ?", (problem_id,)).fetchone():
+                repository.set_tags(conn, problem_id, pairs)
+
+
+def _import_attachment(repository, conn, attachment, id_map):
+        """Attach content imported earlier in the backup to the record it belongs to"""
+        try:
+                problem_id = attachment["problem_id"]
+                blob_id = repository.find_blob(conn, attachment["hash"])
+                name = attachment["name"]
+        except (KeyError, TypeError):
+                raise BackupFormatError(f"Invalid attachment in backup: {attachment!r}")
+        if blob_id is None:
+                raise BackupFormatError(f"Attachment {name!r} has no content in the backup")
+        if id_map is not None:
+                # Records skipped as duplicates keep the attachments they already have
+                problem_id = id_map.get(problem_id)
+                if problem_id is None:
+                        return
+        conn.execute("""INSERT INTO attachments (problem_id, blob_id, name, mime_type, added_at)
+            SELECT id, ?, ?, ?, ? FROM problems WHERE id = ?""",
+                     (blob_id, name, attachment.get("mime_type"), attachment.get("added_at"), problem_id))
@@ -0,0 +1,103 @@
+import argparse
+import json
+import os
+import random
+import sys
+
+# The benchmarks run from a checkout, next to the application's modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import BULK_ADD_BATCH_SIZE, RECORD_FIELDS, jalali_day, jalali_from_day, jalali_today
+
+# Vocabulary of the generated records, IT support in both languages of the tracker's users
+ENGLISH_SUBJECTS = ["Printer", "VPN", "Outlook", "Network drive", "Password reset", "Windows update", "Driver",
+                    "Scanner", "Wi-Fi", "Teams", "Excel", "Backup", "Antivirus", "Laptop battery", "Monitor"]
+PERSIAN_SUBJECTS = ["چاپگر", "شبکه", "رمز عبور", "ایمیل", "اتصال اینترنت", "نرم‌افزار حسابداری", "اسکنر",
+                    "به‌روزرسانی ویندوز", "درایور", "پشتیبان‌گیری", "ویروس", "باتری لپ‌تاپ", "مانیتور"]
+ENGLISH_WORDS = ["error", "slow", "cannot", "connect", "login", "crash", "freeze", "timeout", "blue screen", "missing",
+                 "permission", "denied", "restart", "cable", "server", "certificate", "expired", "profile", "cache",
+                 "firmware", "queue", "stuck", "sync", "mailbox", "full", "license", "port", "DNS", "proxy", "disk"]
+PERSIAN_WORDS = ["خطا", "کند", "اتصال", "قطع", "ورود", "کاربر", "سرور", "دسترسی", "مجوز", "راه‌اندازی", "کابل",
+                 "تنظیمات", "گواهی", "منقضی", "صف", "چاپ", "همگام‌سازی", "صندوق", "پر", "لایسنس", "درگاه",
+                 "پروکسی", "دیسک", "حافظه", "نصب", "حذف", "بررسی", "مشکل", "سیستم", "پیام"]
+SOLUTION_STEPS = ["Restarted the {} service", "Cleared the {} cache", "Reinstalled the {} driver",
+                  "Reset the {} settings to their defaults", "Updated {} to the latest version",
+                  "سرویس {} دوباره راه‌اندازی شد", "تنظیمات {} بازنشانی شد", "درایور {} دوباره نصب شد",
+                  "حافظه موقت {} پاک شد", "نسخه جدید {} نصب شد"]
+
+# Records span this many days back from today
+DATE_SPAN_DAYS = 3650
+
+# Average length of a solution, most are a few steps but some are long write-ups
+SOLUTION_LENGTH = 2000
+
+
+def sentence(rng, words, length):
+        return " ".join(rng.choice(words) for _ in range(length))
+
+
+def generate_records(count, seed=0, solution_length=SOLUTION_LENGTH):
+        """count reproducible (date, subject, problem, solution) records, mixing Persian and English text"""
+        rng = random.Random(seed)
+        today = jalali_day(jalali_today())
+        # Dates repeat a lot, converting each day once keeps generation fast
+        dates = {}
+        for _ in range(count):
+                persian = rng.random() < 0.6
+                subjects = PERSIAN_SUBJECTS if persian else ENGLISH_SUBJECTS
+                # A third of the records mix the languages, as users paste English error messages
+                words = PERSIAN_WORDS + ENGLISH_WORDS if rng.random() < 0.33 else (
+                        PERSIAN_WORDS if persian else ENGLISH_WORDS)
+                subject = f"{rng.choice(subjects)} {sentence(rng, words, rng.randint(1, 4))}"
+                problem = "\n".join(sentence(rng, words, rng.randint(5, 25)) for _ in range(rng.randint(1, 4)))
+
+                # Exponentially distributed, so a few solutions are many times the average
+                target = int(rng.expovariate(1 / solution_length)) + 20
+                steps = []
+                size = 0
+                while size < target:
+                        step = f"{len(steps) + 1}. {rng.choice(SOLUTION_STEPS).format(rng.choice(subjects))}." \
+                               f" {sentence(rng, words, rng.randint(3, 15))}"
+                        steps.append(step)
+                        size += len(step) + 1
+                solution = "\n".join(steps)
+
+                day = today - rng.randrange(DATE_SPAN_DAYS)
+                if day not in dates:
+                        dates[day] = str(jalali_from_day(day))
+                yield dates[day], subject, problem, solution
+
+
+def build_database(repository, count, seed=0, solution_length=SOLUTION_LENGTH, progress=None):
+        """Fill an empty repository with generate_records, in the batches of a bulk import"""
+        repository.init_schema()
+        batch = []
+        added = 0
+        for record in generate_records(count, seed, solution_length):
+                batch.append(record)
+                if len(batch) >= BULK_ADD_BATCH_SIZE:
+                        added += repository.add_many(batch)
+                        batch.clear()
+                        if progress:
+                                progress(added, count)
+        if batch:
+                added += repository.add_many(batch)
+        return added
+
+
+def main(argv=None):
+        parser = argparse.ArgumentParser(
+                description="Write a synthetic corpus as NDJSON, one record per line, as read by `cli.py bulk-import`")
+        parser.add_argument("count", type=int, help="records to generate, e.g. 10000 to 1000000")
+        parser.add_argument("--seed", type=int, default=0, help="the same seed always gives the same corpus")
+        parser.add_argument("--solution-length", type=int, default=SOLUTION_LENGTH,
+                            help="average characters of a solution")
+        args = parser.parse_args(argv)
+
+        for record in generate_records(args.count, args.seed, args.solution_length):
+                sys.stdout.write(json.dumps(dict(zip(RECORD_FIELDS, record)), ensure_ascii=False) + "\n")
+        return 0
+
+
+if __name__ == "__main__":
+        sys.exit(main())
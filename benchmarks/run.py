@@ -0,0 +1,242 @@
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# Widgets are painted without a display, into the offscreen platform's buffers
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import database
+from backup import IMPORT_REPLACE, export_backup_stream, import_backup_stream
+from database import SEARCH_COLUMNS, FuzzyQuery, ProblemRepository, RecentQuery, SearchQuery
+from corpus import SOLUTION_LENGTH, build_database
+
+# Corpus sizes benchmarked when none are given
+DEFAULT_SIZES = [10000]
+
+# Keywords searched with every filter, one per language of the corpus
+SEARCH_KEYWORDS = {"english": "timeout", "persian": "اتصال"}
+
+# Misspelling searched in fuzzy mode
+FUZZY_KEYWORD = "timout"
+
+
+def load_application():
+        """The Issue-Tracker.py module, whose file name cannot be imported directly"""
+        spec = importlib.util.spec_from_file_location("issue_tracker", os.path.join(ROOT, "Issue-Tracker.py"))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+
+
+def git_revision():
+        try:
+                return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                                      text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+                return None
+
+
+def measure(function, repeat, setup=None):
+        """Seconds taken by each of repeat calls of function, setup() running untimed before every call"""
+        timings = []
+        for _ in range(repeat):
+                if setup:
+                        setup()
+                started = time.perf_counter()
+                function()
+                timings.append(time.perf_counter() - started)
+        return timings
+
+
+def corpus_database(work_dir, count, seed, solution_length):
+        """Path of a database holding the corpus, generated on first use and kept for later runs"""
+        path = os.path.join(work_dir, f"corpus-{count}-{seed}-{solution_length}.db")
+        if os.path.exists(path) and ProblemRepository(path).stats()["records"] == count:
+                return path
+        for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(path + suffix):
+                        os.remove(path + suffix)
+
+        started = time.perf_counter()
+        repository = ProblemRepository(path)
+        build_database(repository, count, seed, solution_length,
+                       lambda done, total: print(f"  generated {done}/{total} records", end="\r", file=sys.stderr))
+        repository.close()
+        print(f"  generated {count} records in {time.perf_counter() - started:.1f} s", file=sys.stderr)
+        return path
+
+
+class Benchmarks:
+        """Times the hot paths of the application on one corpus"""
+
+        def __init__(self, app, application, repository, work_dir, repeat):
+                self.app = app
+                self.application = application
+                self.repository = repository
+                self.work_dir = work_dir
+                self.repeat = repeat
+                self.results = {}
+
+        def run(self, name, function, setup=None):
+                timings = measure(function, self.repeat, setup)
+                self.results[name] = timings
+                print(f"  {name:<32}{statistics.median(timings) * 1000:>10.1f} ms", file=sys.stderr)
+
+        def run_all(self):
+                # The window is shown so that painting and layout happen as they would on screen
+                window = self.application.MainApp()
+                window.show()
+                self.app.processEvents()
+                try:
+                        self.time_window(window)
+                finally:
+                        window.close()
+                self.time_backups()
+                return self.results
+
+        def time_window(self, window):
+                self.run("load_entries", window.load_entries)
+
+                # Each search is timed as the search worker runs it: the first page and the total
+                for field in SEARCH_COLUMNS:
+                        for language, keyword in SEARCH_KEYWORDS.items():
+                                search_query = SearchQuery(keyword, field)
+                                self.run(f"search.{field.lower()}.{language}", lambda: (
+                                        self.repository.fetch_page(search_query), self.repository.count(search_query)))
+
+                # A new query every run, one keeps the scores of its candidates for its later pages and count
+                def fuzzy_search():
+                        fuzzy_query = FuzzyQuery(FUZZY_KEYWORD, "All")
+                        records = self.repository.fetch_page(fuzzy_query)
+                        self.repository.count(fuzzy_query)
+                        if records:
+                                self.repository.fetch_page(fuzzy_query, fuzzy_query.key(records[-1]))
+                self.run("search.fuzzy", fuzzy_search)
+
+                recent_query = RecentQuery()
+                records = self.repository.fetch_page(recent_query)
+                self.run("display_records", lambda: (
+                        window.display_records(recent_query, records), self.app.processEvents()))
+
+                # Painting every visible cell, with the laid-out documents thrown away first and then reused
+                viewport = window.table.viewport()
+                self.run("paint", viewport.grab, window.rtl_delegate.clear_cache)
+                self.run("paint.cached", viewport.grab)
+
+                record_id = records[0][0]
+
+                def open_details():
+                        dialog = self.application.ProblemDetailDialog(window, record_id)
+                        dialog.show()
+                        self.app.processEvents()
+                        dialog.close()
+                        dialog.deleteLater()
+
+                # Read from the database first, then from the record cache the dialogs share
+                self.run("open_problem_detail", open_details, self.application.record_cache.clear)
+                self.run("open_problem_detail.cached", open_details)
+
+                # A saved edit reaches the table as a change to one row, the corpus is rewritten as it was
+                record = self.repository.get(record_id)
+                self.run("update_record", lambda: (self.repository.update(record_id, *record), self.app.processEvents()))
+
+        def time_backups(self):
+                backup_path = os.path.join(self.work_dir, "benchmark.bak.gz")
+                self.run("export_backup", lambda: export_backup_stream(self.repository, backup_path))
+
+                # Imported into a database of its own, replacing its contents on every run
+                target_path = os.path.join(self.work_dir, "import-target.db")
+                for suffix in ("", "-wal", "-shm"):
+                        if os.path.exists(target_path + suffix):
+                                os.remove(target_path + suffix)
+                target = ProblemRepository(target_path)
+                target.init_schema()
+                self.run("import_backup", lambda: import_backup_stream(target, backup_path, IMPORT_REPLACE))
+                target.close()
+                for path in (backup_path, target_path, target_path + "-wal", target_path + "-shm"):
+                        if os.path.exists(path):
+                                os.remove(path)
+
+
+def summarize(timings):
+        return {"runs": timings, "min": min(timings), "median": statistics.median(timings), "max": max(timings)}
+
+
+def compare(results, baseline_path):
+        """Print the change of every median against a results file written by an earlier run"""
+        with open(baseline_path, encoding="utf-8") as file:
+                baseline = json.load(file)
+        print(f"{'records':>9}  {'benchmark':<32}{'baseline ms':>12}{'now ms':>10}{'change':>9}")
+        for size, benchmarks in results["corpora"].items():
+                for name, result in benchmarks.items():
+                        before = baseline.get("corpora", {}).get(size, {}).get(name)
+                        if before is None:
+                                continue
+                        change = result["median"] / before["median"] - 1 if before["median"] else 0.0
+                        print(f"{size:>9}  {name:<32}{before['median'] * 1000:>12.1f}{result['median'] * 1000:>10.1f}"
+                              f"{change:>+9.0%}")
+
+
+def main(argv=None):
+        parser = argparse.ArgumentParser(description="Time the tracker's hot paths on synthetic corpora")
+        parser.add_argument("sizes", type=int, nargs="*", default=DEFAULT_SIZES,
+                            help="records in each corpus, e.g. 10000 100000 1000000")
+        parser.add_argument("--repeat", type=int, default=5, help="timed runs of every benchmark")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--solution-length", type=int, default=SOLUTION_LENGTH,
+                            help="average characters of a solution")
+        parser.add_argument("--work-dir", default=os.path.join(tempfile.gettempdir(), "issue-tracker-benchmarks"),
+                            help="where generated corpora are kept between runs")
+        parser.add_argument("-o", "--output", default="benchmark-results.json", help="JSON file of the results")
+        parser.add_argument("--compare", metavar="BASELINE", help="results file of an earlier run to compare with")
+        args = parser.parse_args(argv)
+
+        os.makedirs(args.work_dir, exist_ok=True)
+        application = load_application()
+        from PyQt6.QtCore import QT_VERSION_STR
+        from PyQt6.QtWidgets import QApplication
+        app = QApplication(sys.argv[:1])
+        app.setStyleSheet(application.APP_STYLESHEET)
+
+        results = {
+                "revision": git_revision(),
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "python": platform.python_version(),
+                "sqlite": sqlite3.sqlite_version,
+                "qt": QT_VERSION_STR,
+                "platform": platform.platform(),
+                "repeat": args.repeat,
+                "seed": args.seed,
+                "solution_length": args.solution_length,
+                "corpora": {},
+        }
+        for size in args.sizes:
+                print(f"{size} records", file=sys.stderr)
+                repository = ProblemRepository(corpus_database(args.work_dir, size, args.seed, args.solution_length))
+                # The window reaches the database through get_repository()
+                database._repository = repository
+                timings = Benchmarks(app, application, repository, args.work_dir, args.repeat).run_all()
+                repository.close()
+                results["corpora"][str(size)] = {name: summarize(values) for name, values in timings.items()}
+
+        with open(args.output, "w", encoding="utf-8") as file:
+                json.dump(results, file, indent=2)
+        print(f"Results written to {args.output}", file=sys.stderr)
+        if args.compare:
+                compare(results, args.compare)
+        return 0
+
+
+if __name__ == "__main__":
+        sys.exit(main())
@@ -0,0 +1,199 @@
+import argparse
+import json
+import sqlite3
+import sys
+import time
+
+from database import (BULK_ADD_BATCH_SIZE, PAGE_SIZE, RECORD_FIELDS, FuzzyQuery, ProblemRepository, RecentQuery,
+                      SearchQuery, day_range, get_repository, jalali_day, jalali_today, record_values)
+
+# Columns a search can be restricted to, as offered by the GUI filter
+SEARCH_FILTERS = ["All", "Subject", "Problem", "Solution"]
+
+
+def open_repository(args):
+        """The repository of --db, or the application's own database, upgraded if needed"""
+        repository = ProblemRepository(args.db) if args.db else get_repository()
+        repository.init_schema()
+        return repository
+
+
+def parse_record(line, default_date):
+        """(date, subject, problem, solution) of an NDJSON line, raising ValueError if it is not a valid record"""
+        return record_values(json.loads(line), default_date)
+
+
+# Commands
+def add_command(args):
+        date = args.date or jalali_today()
+        if jalali_day(date) is None:
+                print(f"Invalid date {date!r}, expected a Jalali YYYY-MM-DD date", file=sys.stderr)
+                return 1
+        repository = open_repository(args)
+        print(repository.add(date, args.subject, args.problem, args.solution))
+        return 0
+
+
+def bulk_import_command(args):
+        repository = open_repository(args)
+        conn = repository.open_connection()
+        default_date = jalali_today()
+        added = skipped = 0
+        started = time.perf_counter()
+        batch = []
+        try:
+                for line_number, line in enumerate(sys.stdin, 1):
+                        if not line.strip():
+                                continue
+                        try:
+                                batch.append(parse_record(line, default_date))
+                        except ValueError as e:
+                                print(f"Line {line_number} skipped: {e}", file=sys.stderr)
+                                skipped += 1
+                                continue
+                        # Each batch is committed on its own, an interrupted import keeps the batches before it
+                        if len(batch) >= args.batch_size:
+                                added += repository.add_many(batch, conn)
+                                batch.clear()
+                                if args.verbose:
+                                        print(f"{added} records imported", file=sys.stderr)
+                if batch:
+                        added += repository.add_many(batch, conn)
+        finally:
+                conn.close()
+
+        elapsed = time.perf_counter() - started
+        print(f"Imported {added} records in {elapsed:.1f} s ({added / elapsed if elapsed else 0:.0f} records/s),"
+              f" skipped {skipped} lines", file=sys.stderr)
+        return 1 if skipped else 0
+
+
+def search_command(args):
+        repository = open_repository(args)
+        try:
+                days = day_range(args.since, args.until)
+        except ValueError as e:
+                print(f"Error: {e}", file=sys.stderr)
+                return 1
+
+        if args.keyword:
+                query_class = FuzzyQuery if args.fuzzy else SearchQuery
+                search_query = query_class(args.keyword, args.field, days)
+        else:
+                search_query = RecentQuery(days)
+
+        # Keyset pages until limit rows have been printed
+        printed = 0
+        after = None
+        while printed < args.limit:
+                rows = repository.fetch_page(search_query, after, min(PAGE_SIZE, args.limit - printed))
+                if not rows:
+                        break
+                for row in rows:
+                        if args.json:
+                                record = {"id": row[0], **dict(zip(RECORD_FIELDS, repository.get(row[0]) or ()))}
+                                print(json.dumps(record, ensure_ascii=False))
+                        else:
+                                print("\t".join(str(value).replace("\t", " ").replace("\n", " ") for value in row[:4]))
+                printed += len(rows)
+                after = search_query.key(rows[-1])
+        return 0
+
+
+def export_command(args):
+        # Loaded here, the other commands never need the backup module
+        from backup import export_backup_stream, export_incremental_backup
+
+        repository = open_repository(args)
+        if args.incremental:
+                if repository.last_backup_revision() is None:
+                        print("No earlier backup to continue from, take a full export first", file=sys.stderr)
+                        return 1
+                written = export_incremental_backup(repository, args.file)
+        else:
+                written = export_backup_stream(repository, args.file)
+        print(f"Exported {written} {'changed or deleted records' if args.incremental else 'records'} to {args.file}",
+              file=sys.stderr)
+        return 0
+
+
+def stats_command(args):
+        stats = open_repository(args).stats()
+        if args.json:
+                print(json.dumps(stats))
+        else:
+                for name, value in stats.items():
+                        print(f"{name.replace('_', ' ').capitalize() + ':':<24}{value}")
+        return 0
+
+
+def serve_command(args):
+        # Loaded here, the other commands never need the server
+        from server import DEFAULT_HOST, DEFAULT_PORT, READ_CONNECTIONS, serve
+
+        serve(open_repository(args), args.host or DEFAULT_HOST, args.port or DEFAULT_PORT,
+              args.readers or READ_CONNECTIONS)
+        return 0
+
+
+def build_parser():
+        parser = argparse.ArgumentParser(prog="cli.py", description="IT Problem Tracker without the GUI")
+        parser.add_argument("--db", help="database file to use instead of the application's own")
+        commands = parser.add_subparsers(dest="command", required=True)
+
+        add = commands.add_parser("add", help="add a record and print its id")
+        add.add_argument("--date", help="Jalali YYYY-MM-DD date, today if omitted")
+        add.add_argument("--subject", required=True)
+        add.add_argument("--problem", default="")
+        add.add_argument("--solution", default="")
+        add.set_defaults(handler=add_command)
+
+        bulk_import = commands.add_parser(
+                "bulk-import", help="add records read from stdin, one JSON object per line",
+                description="Reads objects with date, subject, problem and solution fields, one per line."
+                            " Invalid lines are reported and skipped.")
+        bulk_import.add_argument("--batch-size", type=int, default=BULK_ADD_BATCH_SIZE,
+                                 help="records committed per transaction")
+        bulk_import.add_argument("-v", "--verbose", action="store_true", help="report progress after every batch")
+        bulk_import.set_defaults(handler=bulk_import_command)
+
+        search = commands.add_parser("search", help="search records, newest or best matching first")
+        search.add_argument("keyword", nargs="?", help="list the most recent records if omitted")
+        search.add_argument("--field", choices=SEARCH_FILTERS, default="All")
+        search.add_argument("--fuzzy", action="store_true", help="also match similar spellings of the keyword")
+        search.add_argument("--since", help="first Jalali YYYY-MM-DD date to include")
+        search.add_argument("--until", help="last Jalali YYYY-MM-DD date to include")
+        search.add_argument("--limit", type=int, default=20)
+        search.add_argument("--json", action="store_true", help="print complete records as JSON lines")
+        search.set_defaults(handler=search_command)
+
+        export = commands.add_parser("export", help="write a compressed backup, as made by Export Backup")
+        export.add_argument("file")
+        export.add_argument("--incremental", action="store_true", help="only the changes since the last backup")
+        export.set_defaults(handler=export_command)
+
+        stats = commands.add_parser("stats", help="show record count, date range and backup state")
+        stats.add_argument("--json", action="store_true")
+        stats.set_defaults(handler=stats_command)
+
+        serve = commands.add_parser("serve", help="share the database over an HTTP/JSON API",
+                                    description="Serves /problems, /problems/<id>, /export and /stats."
+                                                " There is no authentication, bind to a trusted network only.")
+        serve.add_argument("--host", help="address to listen on, 127.0.0.1 if omitted")
+        serve.add_argument("--port", type=int, help="port to listen on, 8080 if omitted")
+        serve.add_argument("--readers", type=int, help="read connections, twice the CPUs (at most 8) if omitted")
+        serve.set_defaults(handler=serve_command)
+        return parser
+
+
+def main(argv=None):
+        args = build_parser().parse_args(argv)
+        try:
+                return args.handler(args)
+        except (sqlite3.Error, OSError) as e:
+                print(f"Error: {e}", file=sys.stderr)
+                return 1
+
+
+if __name__ == "__main__":
+        sys.exit(main())
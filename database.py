@@ -0,0 +1,1427 @@
+import hashlib
+import json
+import mimetypes
+import os
+import random
+import sys
+import sqlite3
+import threading
+import time
+from datetime import date
+from functools import lru_cache
+
+from instrumentation import timed, trace
+from migrations import SCHEMA_VERSION, id_ranges, migrate, schema_version, transaction
+
+
+# Get the application data directory
+@lru_cache(maxsize=None)
+def get_data_dir():
+        """Get the appropriate data directory based on the platform"""
+        if getattr(sys, 'frozen', False):
+                # If the application is frozen (PyInstaller bundle)
+                if sys.platform == 'darwin':  # macOS
+                        # On macOS, use ~/Library/Application Support/YourAppName
+                        app_name = "IT_Problem_Tracker"
+                        data_dir = os.path.join(os.path.expanduser("~"), "Library", "Application Support", app_name)
+                elif sys.platform == 'win32':  # Windows
+                        # On Windows, use %APPDATA%\YourAppName
+                        app_name = "IT_Problem_Tracker"
+                        data_dir = os.path.join(os.environ.get('APPDATA', os.path.expanduser("~")), app_name)
+                else:  # Linux and other platforms
+                        # On Linux, use ~/.local/share/YourAppName
+                        app_name = "it_problem_tracker"
+                        data_dir = os.path.join(os.path.expanduser("~"), ".local", "share", app_name)
+        else:
+                # If running in development mode, use the current directory
+                data_dir = os.path.abspath(os.path.dirname(sys.argv[0]))
+
+        # Create the directory if it doesn't exist
+        os.makedirs(data_dir, exist_ok=True)
+
+        return data_dir
+
+
+# Get database path
+@lru_cache(maxsize=None)
+def get_db_path():
+        """Get the full path to the database file"""
+        return os.path.join(get_data_dir(), "problems.db")
+
+
+# Connection tuning
+BUSY_TIMEOUT_MS = 5000
+# Writes still finding the database locked after the busy timeout are retried this many times,
+# after a randomized delay starting at WRITE_RETRY_DELAY seconds and doubling every attempt
+WRITE_RETRIES = 4
+WRITE_RETRY_DELAY = 0.05
+CACHE_SIZE_KB = 32 * 1024
+MMAP_SIZE = 256 * 1024 * 1024
+
+# Statements cached per connection, all SQL below is built from a fixed set of strings
+CACHED_STATEMENTS = 256
+
+
+# Text normalization
+# Arabic code points commonly typed in place of their Persian counterparts, and digits mapped to ASCII
+NORMALIZED_CHARACTERS = {
+        "\u064a": "\u06cc",  # Arabic yeh
+        "\u0649": "\u06cc",  # Alef maksura
+        "\u0643": "\u06a9",  # Arabic kaf
+        **{chr(0x06f0 + digit): str(digit) for digit in range(10)},  # Persian digits
+        **{chr(0x0660 + digit): str(digit) for digit in range(10)},  # Arabic-Indic digits
+}
+
+# Characters that only affect how text is rendered: ZWNJ, ZWJ, tatweel and the diacritics
+IGNORED_CHARACTERS = ["\u200c", "\u200d", "\u0640", "\u0670"] + [chr(code) for code in range(0x064b, 0x0660)]
+
+NORMALIZE_TABLE = str.maketrans({**NORMALIZED_CHARACTERS, **dict.fromkeys(IGNORED_CHARACTERS)})
+
+
+def normalize_text(text):
+        """Fold the spelling variants of Persian text so that they match each other"""
+        if text is None:
+                return None
+        return str(text).translate(NORMALIZE_TABLE).lower()
+
+
+def trigrams(text):
+        """Set of the three-character substrings of text, the unit the trigram tokenizer indexes"""
+        return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+@lru_cache(maxsize=64)
+def keyword_trigrams(keyword):
+        return tuple(trigrams(keyword))
+
+
+def trigram_similarity(keyword, text):
+        """Share of the trigrams of keyword that occur in text, from 0.0 to 1.0, both already normalized"""
+        wanted = keyword_trigrams(keyword)
+        if not wanted or text is None:
+                return 0.0
+        # A few substring searches of the text, rather than building the trigrams of the whole of it
+        return sum(trigram in text for trigram in wanted) / len(wanted)
+
+
+# Dates
+# Records store the Jalali date as text, e.g. "1403-01-15", and are indexed by day number counted from this epoch
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+@lru_cache(maxsize=4096)
+def jalali_day(text):
+        """Day number of a Jalali "YYYY-MM-DD" date, or None if text is not one"""
+        # Imported on first use, persiantools is slow to import and startup converts no dates
+        from persiantools.jdatetime import JalaliDate
+        try:
+                year, month, day = (int(part) for part in str(text).replace("/", "-").split("-"))
+                return JalaliDate(year, month, day).to_gregorian().toordinal() - EPOCH_ORDINAL
+        except (TypeError, ValueError):
+                return None
+
+
+def jalali_from_day(day):
+        """The JalaliDate with day number day"""
+        from persiantools.jdatetime import JalaliDate
+        return JalaliDate(date.fromordinal(day + EPOCH_ORDINAL))
+
+
+def day_range(first=None, last=None):
+        """Day numbers of the records dated from first to last (Jalali, inclusive, either end open), None if both are"""
+        if first is None and last is None:
+                return None
+        days = (jalali_day(first) if first else 1 - EPOCH_ORDINAL,
+                jalali_day(last) if last else jalali_day(jalali_today()))
+        if None in days:
+                raise ValueError("invalid date range, expected Jalali YYYY-MM-DD dates")
+        return days
+
+
+def jalali_today():
+        """Today's date as a Jalali "YYYY-MM-DD" string, the date new records get"""
+        from persiantools.jdatetime import JalaliDate
+        return str(JalaliDate.today())
+
+
+def jalali_month_start():
+        """The first day of the current Jalali month as a "YYYY-MM-DD" string"""
+        return jalali_today()[:-2] + "01"
+
+
+# Fields of a record as exchanged with the command line and the API server
+RECORD_FIELDS = ("date", "subject", "problem", "solution")
+
+
+def record_values(record, default_date):
+        """(date, subject, problem, solution) of a record given as a dict, raising ValueError if it is not valid"""
+        if not isinstance(record, dict):
+                raise ValueError("not a JSON object")
+        values = []
+        for field in RECORD_FIELDS:
+                value = record.get(field)
+                if value is None:
+                        value = default_date if field == "date" else ""
+                if not isinstance(value, str):
+                        raise ValueError(f"{field} is not a string")
+                values.append(value)
+        if jalali_day(values[0]) is None:
+                raise ValueError(f"invalid date {values[0]!r}, expected a Jalali YYYY-MM-DD date")
+        return tuple(values)
+
+
+def connect(db_path, check_same_thread=True):
+        """Open a connection to db_path tuned for this application"""
+        conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=check_same_thread,
+                               cached_statements=CACHED_STATEMENTS)
+        # WAL lets readers run alongside the writer and makes commits a sequential append
+        conn.execute("PRAGMA journal_mode=WAL")
+        # In WAL mode NORMAL is still safe against corruption and skips the fsync on every commit
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KB}")
+        conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+        conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+        # Called by the search index triggers, so every connection that writes to problems needs it
+        conn.create_function("fa_normalize", 1, normalize_text, deterministic=True)
+        conn.create_function("trigram_similarity", 2, trigram_similarity, deterministic=True)
+        conn.create_function("jalali_day", 1, jalali_day, deterministic=True)
+        # Statements are only traced for the slow-operation log while instrumentation is enabled
+        trace(conn, db_path)
+        return conn
+
+
+# Columns of problems_fts searched by each filter_combo option
+SEARCH_COLUMNS = {
+        "All": None,
+        "Subject": "subject",
+        "Problem": "problem",
+        "Solution": "solution",
+}
+
+# The trigram tokenizer cannot match phrases shorter than three characters
+MIN_FTS_KEYWORD_LENGTH = 3
+
+# Fuzzy search looks up the rarest trigrams of the keyword in the index, as many as fit in FUZZY_MAX_POSTINGS
+# documents, reranks the best FUZZY_CANDIDATES rows by trigram similarity and keeps those sharing at least
+# FUZZY_MIN_SIMILARITY of the trigrams
+FUZZY_MAX_POSTINGS = 20000
+FUZZY_CANDIDATES = 200
+FUZZY_MIN_SIMILARITY = 0.4
+
+# Rows indexed per statement when problems_fts is filled from problems
+SEARCH_INDEX_BATCH_SIZE = 5000
+
+# Number of rows fetched each time the table is scrolled to its end
+PAGE_SIZE = 100
+
+# Characters of problem and solution kept in problem_summaries, longer text gets PREVIEW_SUFFIX appended
+PREVIEW_LENGTH = 100
+PREVIEW_SUFFIX = "..."
+
+# Rows copied per statement when problem_summaries is filled from problems
+SUMMARY_BATCH_SIZE = 5000
+
+
+def preview_sql(column):
+        """SQL expression truncating column to its preview"""
+        return (f"CASE WHEN length({column}) > {PREVIEW_LENGTH} "
+                f"THEN substr({column}, 1, {PREVIEW_LENGTH}) || '{PREVIEW_SUFFIX}' ELSE {column} END")
+
+
+def is_truncated_preview(text):
+        """Whether text is a preview cut short of the full value"""
+        return len(text) == PREVIEW_LENGTH + len(PREVIEW_SUFFIX) and text.endswith(PREVIEW_SUFFIX)
+
+
+# Triggers paused while a bulk load fills the derived tables itself, the tracking delete trigger keeps
+# running so that rows a load does not bring back leave tombstones
+BULK_LOAD_TRIGGERS = ("problems_fts_insert", "problems_fts_update", "problems_fts_delete",
+                      "problems_track_insert", "problems_track_update",
+                      "problems_summary_insert", "problems_summary_update", "problems_summary_delete")
+
+# Condition of those triggers. bulk_load only has a row inside the write transaction of a bulk load,
+# which no other connection ever sees, so pausing them takes no schema change
+UNLESS_BULK_LOAD = "WHEN NOT EXISTS (SELECT 1 FROM bulk_load)"
+
+# Records added per transaction by add_many callers, bulk imports commit after each batch
+BULK_ADD_BATCH_SIZE = 5000
+
+# Attachment contents are streamed through incremental blob I/O in chunks of this many bytes
+BLOB_CHUNK_SIZE = 64 * 1024
+
+# Columns selected by the list queries, the full problem and solution are only read on demand
+SUMMARY_COLUMNS = "s.id, s.date, s.subject, s.problem_preview, s.solution_preview"
+
+# Kinds of change reported to the listeners of a repository, with the ids of the records concerned
+CHANGE_INSERT = "insert"
+CHANGE_UPDATE = "update"
+CHANGE_DELETE = "delete"
+# Too many records changed to list them, e.g. by a bulk load or a restore
+CHANGE_RESET = "reset"
+
+
+def id_list(record_ids):
+        """SQL placeholders for record_ids, as used in IN (...)"""
+        return ", ".join("?" for _ in record_ids)
+
+
+# Tags are facet:name pairs, e.g. vendor:HP. The tag editor offers these facets, others can be typed in
+TAG_FACETS = ("system", "vendor", "severity", "site")
+TAG_SEPARATOR = ":"
+
+
+def parse_tag(text):
+        """(facet, name) of a tag written as facet:name, the facet is empty for a plain name"""
+        facet, separator, name = text.partition(TAG_SEPARATOR)
+        if not separator:
+                facet, name = "", facet
+        facet, name = facet.strip().lower(), " ".join(name.split())
+        if not name:
+                raise ValueError(f"Tag without a name: {text!r}")
+        return facet, name
+
+
+def format_tag(facet, name):
+        return f"{facet}{TAG_SEPARATOR}{name}" if facet else name
+
+
+def tag_condition(tags):
+        """SQL condition and parameters keeping the rows carrying the tags, a {facet: tag ids} mapping.
+        Rows need one of the tags of each facet"""
+        if not tags:
+                return "", ()
+        sql = ""
+        params = ()
+        for tag_ids in tags.values():
+                # Reads the postings of the tags from the primary key of problem_tags
+                sql += f" AND s.id IN (SELECT problem_id FROM problem_tags WHERE tag_id IN ({id_list(tag_ids)}))"
+                params += tuple(tag_ids)
+        return sql, params
+
+
+# Keyset-paginated queries feeding the problems table
+def day_condition(days):
+        """SQL condition and parameters keeping the rows dated within days, an inclusive (first, last) range"""
+        if days is None:
+                return "", ()
+        return " AND s.day BETWEEN ? AND ?", tuple(days)
+
+
+class RecentQuery:
+        """All problems, or those dated within days and carrying the tags if given, newest first"""
+
+        def __init__(self, days=None, tags=None):
+                self.days = days
+                self.tags = tags or {}
+                day_sql, day_params = day_condition(days)
+                tag_sql, tag_params = tag_condition(self.tags)
+                self.filter_sql = day_sql + tag_sql
+                self.filter_params = day_params + tag_params
+
+        def with_tags(self, tags):
+                return RecentQuery(self.days, tags)
+
+        def prepare(self, conn):
+                """Nothing to compute before the statements run"""
+
+        def page(self, after, limit):
+                """SQL and parameters for the page following the row keyed by after (None for the first page)"""
+                if self.days is not None:
+                        # A range scan of the (day, id) index, which also yields the rows in order
+                        query = f"SELECT {SUMMARY_COLUMNS}, s.day FROM problem_summaries s WHERE 1{self.filter_sql}"
+                        if after is None:
+                                return query + " ORDER BY s.day DESC, s.id DESC LIMIT ?", self.filter_params + (limit,)
+                        return (query + " AND (s.day, s.id) < (?, ?) ORDER BY s.day DESC, s.id DESC LIMIT ?",
+                                self.filter_params + tuple(after) + (limit,))
+                if after is None:
+                        return (f"SELECT {SUMMARY_COLUMNS} FROM problem_summaries s WHERE 1{self.filter_sql}"
+                                " ORDER BY s.id DESC LIMIT ?", self.filter_params + (limit,))
+                return (f"SELECT {SUMMARY_COLUMNS} FROM problem_summaries s WHERE s.id < ?{self.filter_sql}"
+                        " ORDER BY s.id DESC LIMIT ?", (after,) + self.filter_params + (limit,))
+
+        def key(self, row):
+                return (row[5], row[0]) if self.days is not None else row[0]
+
+        def sort_key(self, row):
+                """Value sorting rows in the order of the pages"""
+                return (-row[5], -row[0]) if self.days is not None else -row[0]
+
+        def rows(self, record_ids):
+                """SQL and parameters for those of record_ids that the query returns, as the pages list them"""
+                columns = f"{SUMMARY_COLUMNS}, s.day" if self.days is not None else SUMMARY_COLUMNS
+                return (f"SELECT {columns} FROM problem_summaries s WHERE s.id IN ({id_list(record_ids)}){self.filter_sql}",
+                        tuple(record_ids) + self.filter_params)
+
+        def ids(self):
+                """SQL and parameters selecting the id of every row the query returns"""
+                return f"SELECT s.id FROM problem_summaries s WHERE 1{self.filter_sql}", self.filter_params
+
+        def count(self):
+                if self.filter_sql:
+                        return f"SELECT COUNT(*) FROM problem_summaries s WHERE 1{self.filter_sql}", self.filter_params
+                # The narrow summaries table is much quicker to count than problems itself
+                return "SELECT COUNT(*) FROM problem_summaries", ()
+
+
+class SearchQuery:
+        """Problems matching keyword in the columns selected by filter_by, dated within days and carrying the tags
+        if given"""
+
+        def __init__(self, keyword, filter_by, days=None, tags=None):
+                self.keyword = keyword
+                self.filter_by = filter_by
+                self.column = SEARCH_COLUMNS.get(filter_by)
+                self.days = days
+                self.tags = tags or {}
+                # Tags narrow the matches down in the same statement, through the postings of problem_tags
+                day_sql, day_params = day_condition(days)
+                tag_sql, tag_params = tag_condition(self.tags)
+                self.filter_sql = day_sql + tag_sql
+                self.filter_params = day_params + tag_params
+                # Too short for the index, fall back to a plain substring scan
+                self.use_index = len(keyword) >= MIN_FTS_KEYWORD_LENGTH
+
+                if self.use_index:
+                        # Quote the keyword as a single FTS5 phrase so operators and punctuation are matched literally
+                        phrase = '"' + normalize_text(keyword).replace('"', '""') + '"'
+                        self.phrase = f"{self.column} : {phrase}" if self.column else phrase
+                else:
+                        columns = [self.column] if self.column else ["subject", "problem", "solution"]
+                        self.where = " OR ".join(f"f.{name} LIKE ?" for name in columns)
+                        self.patterns = tuple(f"%{normalize_text(keyword)}%" for _ in columns)
+
+        def with_tags(self, tags):
+                return SearchQuery(self.keyword, self.filter_by, self.days, tags)
+
+        def prepare(self, conn):
+                """Nothing to compute before the statements run"""
+
+        def page(self, after, limit):
+                """SQL and parameters for the page following the row keyed by after (None for the first page)"""
+                if not self.use_index:
+                        # Scans the normalized copy of the text kept by problems_fts, only the previews are returned
+                        query = f"SELECT {SUMMARY_COLUMNS} FROM problem_summaries s JOIN problems_fts f ON f.rowid = s.id"
+                        if after is None:
+                                return (f"{query} WHERE ({self.where}){self.filter_sql} ORDER BY s.id DESC LIMIT ?",
+                                        self.patterns + self.filter_params + (limit,))
+                        return (f"{query} WHERE s.id < ? AND ({self.where}){self.filter_sql} ORDER BY s.id DESC LIMIT ?",
+                                (after,) + self.patterns + self.filter_params + (limit,))
+
+                # Ranked by bm25, so pages are keyed on (score, id) rather than id alone
+                query = f"""SELECT * FROM (
+                        SELECT {SUMMARY_COLUMNS}, bm25(problems_fts) AS score
+                        FROM problems_fts JOIN problem_summaries s ON s.id = problems_fts.rowid
+                        WHERE problems_fts MATCH ?{self.filter_sql})"""
+                if after is None:
+                        return query + " ORDER BY score, id DESC LIMIT ?", (self.phrase,) + self.filter_params + (limit,)
+                score, record_id = after
+                return (query + " WHERE score > ? OR (score = ? AND id < ?) ORDER BY score, id DESC LIMIT ?",
+                        (self.phrase,) + self.filter_params + (score, score, record_id, limit))
+
+        def key(self, row):
+                return (row[5], row[0]) if self.use_index else row[0]
+
+        def sort_key(self, row):
+                """Value sorting rows in the order of the pages"""
+                return (row[5], -row[0]) if self.use_index else -row[0]
+
+        def rows(self, record_ids):
+                """SQL and parameters for those of record_ids that the query returns, as the pages list them"""
+                if not self.use_index:
+                        return (f"""SELECT {SUMMARY_COLUMNS} FROM problem_summaries s JOIN problems_fts f ON f.rowid = s.id
+                            WHERE s.id IN ({id_list(record_ids)}) AND ({self.where}){self.filter_sql}""",
+                                tuple(record_ids) + self.patterns + self.filter_params)
+                # The index is only probed for the given rows, the scores are those the pages would show
+                return (f"""SELECT {SUMMARY_COLUMNS}, bm25(problems_fts) AS score
+                    FROM problems_fts JOIN problem_summaries s ON s.id = problems_fts.rowid
+                    WHERE problems_fts MATCH ? AND problems_fts.rowid IN ({id_list(record_ids)}){self.filter_sql}""",
+                        (self.phrase,) + tuple(record_ids) + self.filter_params)
+
+        def ids(self):
+                """SQL and parameters selecting the id of every row the query returns"""
+                if not self.use_index:
+                        return (f"""SELECT s.id FROM problem_summaries s JOIN problems_fts f ON f.rowid = s.id
+                            WHERE ({self.where}){self.filter_sql}""", self.patterns + self.filter_params)
+                return (f"""SELECT s.id FROM problems_fts JOIN problem_summaries s ON s.id = problems_fts.rowid
+                    WHERE problems_fts MATCH ?{self.filter_sql}""", (self.phrase,) + self.filter_params)
+
+        def count(self):
+                if self.filter_sql:
+                        if self.use_index:
+                                return (f"""SELECT COUNT(*) FROM problems_fts JOIN problem_summaries s
+                                    ON s.id = problems_fts.rowid WHERE problems_fts MATCH ?{self.filter_sql}""",
+                                        (self.phrase,) + self.filter_params)
+                        return (f"""SELECT COUNT(*) FROM problem_summaries s JOIN problems_fts f ON f.rowid = s.id
+                            WHERE ({self.where}){self.filter_sql}""", self.patterns + self.filter_params)
+                if self.use_index:
+                        return "SELECT COUNT(*) FROM problems_fts WHERE problems_fts MATCH ?", (self.phrase,)
+                return f"SELECT COUNT(*) FROM problems_fts f WHERE {self.where}", self.patterns
+
+
+class FuzzyQuery:
+        """Problems resembling keyword in the columns selected by filter_by, tolerating typos"""
+
+        def __init__(self, keyword, filter_by, days=None, tags=None):
+                self.keyword = normalize_text(keyword)
+                self.filter_by = filter_by
+                self.column = SEARCH_COLUMNS.get(filter_by)
+                self.days = days
+                self.tags = tags or {}
+                # Without a single trigram to look up there is nothing fuzzy to do
+                self.use_index = len(self.keyword) >= MIN_FTS_KEYWORD_LENGTH
+                if not self.use_index:
+                        self.fallback = SearchQuery(keyword, filter_by, days, tags)
+                        return
+                day_sql, day_params = day_condition(days)
+                tag_sql, tag_params = tag_condition(self.tags)
+                filter_sql = day_sql + tag_sql
+                filter_params = day_params + tag_params
+
+                self.terms = sorted(trigrams(self.keyword))
+                compared = f"c.{self.column}" if self.column else "c.subject || ' ' || c.problem || ' ' || c.solution"
+                column_filter = f"'{self.column} : (' || " if self.column else "'(' || "
+
+                # Candidates contain any of the rarest trigrams of the keyword that occur in the index at all,
+                # the ones a typo broke have no documents. The rarest one is always used, the others only
+                # while their documents fit in FUZZY_MAX_POSTINGS. Counting stops at that limit, so common
+                # trigrams cost no more than rare ones
+                plan = f"""SELECT coalesce({column_filter} group_concat(phrase, ' OR ') || ')', '""') AS expression,
+                        coalesce(MIN(doc) <= {FUZZY_MAX_POSTINGS}, 0) AS selective
+                    FROM (SELECT phrase, doc, SUM(doc) OVER (ORDER BY doc, phrase) AS postings FROM (
+                            SELECT '"' || replace(value, '"', '""') || '"' AS phrase,
+                                (SELECT COUNT(*) FROM (SELECT 1 FROM problems_fts
+                                    WHERE problems_fts MATCH '"' || replace(value, '"', '""') || '"'
+                                    LIMIT {FUZZY_MAX_POSTINGS + 1})) AS doc
+                            FROM json_each(?))
+                          WHERE doc > 0)
+                    WHERE postings <= {FUZZY_MAX_POSTINGS} OR postings = doc"""
+                # Ranking by bm25 means scoring every match, so when even the rarest trigram is common
+                # the newest rows containing it are taken instead. The branch not taken gets the empty
+                # phrase '""', which matches nothing without reading the index
+                candidates = f"""SELECT * FROM (SELECT rowid, subject, problem, solution FROM problems_fts
+                        WHERE problems_fts MATCH (SELECT iif(selective, expression, '""') FROM plan)
+                        ORDER BY rank LIMIT {FUZZY_CANDIDATES})
+                    UNION ALL
+                    SELECT * FROM (SELECT rowid, subject, problem, solution FROM problems_fts
+                        WHERE problems_fts MATCH (SELECT iif(selective, '""', expression) FROM plan)
+                        ORDER BY rowid DESC LIMIT {FUZZY_CANDIDATES})"""
+                # A date range or tags only narrow the candidates down, they do not widen the search
+                self.scoring = f"""WITH plan AS MATERIALIZED ({plan}), candidates AS ({candidates})
+                    SELECT * FROM (
+                        SELECT s.id, -trigram_similarity(?, {compared}) AS score
+                        FROM candidates c JOIN problem_summaries s ON s.id = c.rowid WHERE 1{filter_sql})
+                    WHERE score <= -{FUZZY_MIN_SIMILARITY}"""
+                self.scoring_params = (json.dumps(self.terms), self.keyword) + filter_params
+                # The pages, the count and the facets all read the (id, score) pairs scored by prepare
+                self.ranked = f"""SELECT * FROM (SELECT {SUMMARY_COLUMNS}, json_extract(r.value, '$[1]') AS score
+                    FROM json_each(?) r JOIN problem_summaries s ON s.id = json_extract(r.value, '$[0]')) WHERE 1"""
+                # (revision, JSON array of the (id, score) pairs) of the last scoring
+                self.ranking = None
+
+        @property
+        def params(self):
+                return (self.ranking[1],)
+
+        def prepare(self, conn):
+                """Score the candidates on conn, once for every revision of the records the query is run at"""
+                if not self.use_index:
+                        return
+                revision = conn.execute("SELECT revision FROM revision_counter").fetchone()[0]
+                if self.ranking is None or self.ranking[0] != revision:
+                        scores = conn.execute(self.scoring, self.scoring_params).fetchall()
+                        self.ranking = (revision, json.dumps(scores))
+
+        def with_tags(self, tags):
+                return FuzzyQuery(self.keyword, self.filter_by, self.days, tags)
+
+        def page(self, after, limit):
+                """SQL and parameters for the page following the row keyed by after (None for the first page)"""
+                if not self.use_index:
+                        return self.fallback.page(after, limit)
+                # Most similar first, pages are keyed on (score, id) like ranked searches
+                if after is None:
+                        return self.ranked + " ORDER BY score, id DESC LIMIT ?", self.params + (limit,)
+                score, record_id = after
+                return (self.ranked + " AND (score > ? OR (score = ? AND id < ?)) ORDER BY score, id DESC LIMIT ?",
+                        self.params + (score, score, record_id, limit))
+
+        def key(self, row):
+                return (row[5], row[0]) if self.use_index else self.fallback.key(row)
+
+        def sort_key(self, row):
+                """Value sorting rows in the order of the pages"""
+                return (row[5], -row[0]) if self.use_index else self.fallback.sort_key(row)
+
+        def rows(self, record_ids):
+                """SQL and parameters for those of record_ids that the query returns, as the pages list them"""
+                if not self.use_index:
+                        return self.fallback.rows(record_ids)
+                # Whether a row is a candidate depends on the others, the candidates are bounded though
+                return (f"{self.ranked} AND id IN ({id_list(record_ids)})", self.params + tuple(record_ids))
+
+        def ids(self):
+                """SQL and parameters selecting the id of every row the query returns"""
+                if not self.use_index:
+                        return self.fallback.ids()
+                return "SELECT json_extract(r.value, '$[0]') AS id FROM json_each(?) r", self.params
+
+        def count(self):
+                if not self.use_index:
+                        return self.fallback.count()
+                return "SELECT json_array_length(?)", self.params
+
+
+class ConflictError(Exception):
+        """Raised by update when the record was changed or deleted since the revision it was read at"""
+
+        def __init__(self, record_id, current):
+                super().__init__(f"Record {record_id} was changed by someone else")
+                self.record_id = record_id
+                # (date, subject, problem, solution, revision) as saved by the other writer, None if it was deleted
+                self.current = current
+
+
+class AttachmentCancelled(Exception):
+        """Raised while copying an attachment when the user cancels it"""
+
+
+class BlobWriter:
+        """Streams content into a new row of blobs through an incremental blob handle, checking it against its hash"""
+
+        def __init__(self, conn, digest, size):
+                limit = conn.getlimit(sqlite3.SQLITE_LIMIT_LENGTH)
+                if size > limit:
+                        raise ValueError(f"Attachments can be at most {limit} bytes")
+                self.digest = digest
+                self.size = size
+                self.written = 0
+                self.hasher = hashlib.sha256()
+                # zeroblob reserves the space without building the content in memory
+                self.blob_id = conn.execute("INSERT INTO blobs (hash, size, data) VALUES (?, ?, zeroblob(?))",
+                                            (digest, size, size)).lastrowid
+                self.blob = conn.blobopen("blobs", "data", self.blob_id)
+
+        def write(self, data):
+                if self.written + len(data) > self.size:
+                        raise ValueError("Attachment is larger than its recorded size")
+                self.blob.write(data)
+                self.hasher.update(data)
+                self.written += len(data)
+
+        def close(self):
+                """Id of the finished blob, raising ValueError if the content was not what its hash promised"""
+                self.blob.close()
+                if self.written != self.size or self.hasher.hexdigest() != self.digest:
+                        raise ValueError("Attachment content does not match its hash")
+                return self.blob_id
+
+
+def is_busy(error):
+        """Whether error means another connection holds the lock, as opposed to a real failure"""
+        if not isinstance(error, sqlite3.OperationalError):
+                return False
+        code = getattr(error, "sqlite_errorcode", None)
+        if code is not None:
+                # The primary code, extended ones such as SQLITE_BUSY_SNAPSHOT carry it in their low byte
+                return code & 0xFF in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+        # Python before 3.11 only reports the message
+        return "locked" in str(error) or "busy" in str(error)
+
+
+def query_name(repository, search_query, *args, **kwargs):
+        """Instrumentation name of the query a repository method runs, loading recent records or searching"""
+        return type(search_query).__name__
+
+
+# Data access layer
+class ProblemRepository:
+        """Owns the database connections and every query the application runs"""
+
+        def __init__(self, db_path):
+                self.db_path = db_path
+                self.local = threading.local()
+                self.connections = []
+                self.lock = threading.Lock()
+                self.listeners = []
+
+        def connection(self):
+                """The calling thread's long-lived connection"""
+                conn = getattr(self.local, "conn", None)
+                if conn is None:
+                        conn = connect(self.db_path)
+                        self.local.conn = conn
+                        with self.lock:
+                                self.connections.append(conn)
+                return conn
+
+        def open_connection(self, check_same_thread=True):
+                """A separate connection owned by the caller, e.g. one that other threads may interrupt()"""
+                return connect(self.db_path, check_same_thread=check_same_thread)
+
+        def close(self):
+                """Close the calling thread's connection"""
+                conn = getattr(self.local, "conn", None)
+                if conn is not None:
+                        self.local.conn = None
+                        with self.lock:
+                                self.connections.remove(conn)
+                        conn.close()
+
+        # Change notification
+        def add_listener(self, listener):
+                """Call listener(kind, record_ids) after every change committed through this repository
+
+                Listeners run on the thread that made the change, kind is one of the CHANGE_ constants.
+                """
+                with self.lock:
+                        self.listeners.append(listener)
+
+        def remove_listener(self, listener):
+                with self.lock:
+                        self.listeners.remove(listener)
+
+        def notify(self, kind, record_ids=()):
+                with self.lock:
+                        listeners = list(self.listeners)
+                for listener in listeners:
+                        listener(kind, list(record_ids))
+
+        # Schema
+        def init_schema(self, conn=None, progress=None, is_cancelled=None):
+                """Create or upgrade the schema, on conn if given, returning True if it had to be changed"""
+                return migrate(self, conn or self.connection(), progress, is_cancelled)
+
+        def needs_upgrade(self, conn=None):
+                """Whether the schema is older than this version of the application"""
+                return schema_version(conn or self.connection()) < SCHEMA_VERSION
+
+        # Migrations, see migrations.MIGRATIONS
+        def create_problems_table(self, conn):
+                conn.execute('''CREATE TABLE IF NOT EXISTS problems (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        date TEXT,
+                        subject TEXT,
+                        problem TEXT,
+                        solution TEXT
+                    )''')
+
+        def create_search_index(self, conn):
+                """Replace the search index of older versions, which mirrored problems through external content"""
+                for trigger in ("problems_fts_insert", "problems_fts_update", "problems_fts_delete"):
+                        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+                conn.execute("DROP TABLE IF EXISTS problems_fts")
+                self.init_search_index(conn)
+
+        def init_search_index(self, conn):
+                """Create the FTS5 index over the normalized text of problems and keep it in sync through triggers"""
+                self.init_bulk_load(conn)
+                # Trigram tokenizer so that MATCH keeps the substring semantics of the old LIKE '%kw%' search.
+                # The table keeps its own normalized copy of the text for searches the index cannot answer
+                conn.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS problems_fts USING fts5(
+                        subject, problem, solution,
+                        tokenize='trigram'
+                    )''')
+                conn.execute(f'''CREATE TRIGGER IF NOT EXISTS problems_fts_insert AFTER INSERT ON problems {UNLESS_BULK_LOAD} BEGIN
+                        INSERT INTO problems_fts(rowid, subject, problem, solution)
+                        VALUES (new.id, fa_normalize(new.subject), fa_normalize(new.problem), fa_normalize(new.solution));
+                    END''')
+                conn.execute(f'''CREATE TRIGGER IF NOT EXISTS problems_fts_delete AFTER DELETE ON problems {UNLESS_BULK_LOAD} BEGIN
+                        DELETE FROM problems_fts WHERE rowid = old.id;
+                    END''')
+                conn.execute(f'''CREATE TRIGGER IF NOT EXISTS problems_fts_update
+                    AFTER UPDATE OF subject, problem, solution ON problems {UNLESS_BULK_LOAD} BEGIN
+                        UPDATE problems_fts SET subject = fa_normalize(new.subject), problem = fa_normalize(new.problem),
+                            solution = fa_normalize(new.solution)
+                        WHERE rowid = new.id;
+                    END''')
+
+        def fill_search_index(self, conn, after_id, last_id):
+                """Index the records with ids in (after_id, last_id]"""
+                conn.execute("""INSERT INTO problems_fts(rowid, subject, problem, solution)
+                    SELECT id, fa_normalize(subject), fa_normalize(problem), fa_normalize(solution)
+                    FROM problems WHERE id > ? AND id <= ?""", (after_id, last_id))
+
+        def rebuild_search_index(self, conn):
+                """Refill problems_fts from problems, in batches of SEARCH_INDEX_BATCH_SIZE rows"""
+                conn.execute("DELETE FROM problems_fts")
+                for after_id, last_id in list(id_ranges(conn, "problems", SEARCH_INDEX_BATCH_SIZE)):
+                        self.fill_search_index(conn, after_id, last_id)
+
+        def add_change_tracking(self, conn):
+                """Add revision numbers, tombstones and the backup manifest to a database"""
+                columns = [row[1] for row in conn.execute("PRAGMA table_info(problems)")]
+                if "revision" not in columns:
+                        # Existing rows get revision 0, they are only covered by full backups
+                        conn.execute("ALTER TABLE problems ADD COLUMN revision INTEGER NOT NULL DEFAULT 0")
+                if "updated_at" not in columns:
+                        conn.execute("ALTER TABLE problems ADD COLUMN updated_at INTEGER")
+                conn.execute("CREATE INDEX IF NOT EXISTS problems_revision ON problems (revision)")
+
+                # Single-row counter handing out a revision number to every change
+                conn.execute('''CREATE TABLE IF NOT EXISTS revision_counter (
+                        id INTEGER PRIMARY KEY CHECK (id = 0),
+                        revision INTEGER NOT NULL
+                    )''')
+                conn.execute("INSERT OR IGNORE INTO revision_counter (id, revision) VALUES (0, 0)")
+
+                # Tombstones recording which ids were deleted, and at which revision
+                conn.execute('''CREATE TABLE IF NOT EXISTS deleted_problems (
+                        id INTEGER PRIMARY KEY,
+                        revision INTEGER NOT NULL,
+                        deleted_at INTEGER NOT NULL
+                    )''')
+                conn.execute("CREATE INDEX IF NOT EXISTS deleted_problems_revision ON deleted_problems (revision)")
+
+                # Backups taken so far, incremental backups start from the last one
+                conn.execute('''CREATE TABLE IF NOT EXISTS backup_manifest (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        kind TEXT NOT NULL,
+                        file_path TEXT NOT NULL,
+                        base_revision INTEGER,
+                        revision INTEGER NOT NULL,
+                        created_at INTEGER NOT NULL
+                    )''')
+
+                self.init_change_tracking_triggers(conn)
+
+        def init_change_tracking_triggers(self, conn):
+                """Stamp every inserted or edited row with a new revision, and leave a tombstone for deleted ones"""
+                self.init_bulk_load(conn)
+                conn.execute(f'''CREATE TRIGGER IF NOT EXISTS problems_track_insert AFTER INSERT ON problems {UNLESS_BULK_LOAD} BEGIN
+                        UPDATE revision_counter SET revision = revision + 1;
+                        UPDATE problems SET revision = (SELECT revision FROM revision_counter),
+                            updated_at = CAST(strftime('%s', 'now') AS INTEGER)
+                        WHERE id = new.id;
+                        DELETE FROM deleted_problems WHERE id = new.id;
+                    END''')
+                conn.execute(f'''CREATE TRIGGER IF NOT EXISTS problems_track_update
+                    AFTER UPDATE OF date, subject, problem, solution ON problems {UNLESS_BULK_LOAD} BEGIN
+                        UPDATE revision_counter SET revision = revision + 1;
+                        UPDATE problems SET revision = (SELECT revision FROM revision_counter),
+                            updated_at = CAST(strftime('%s', 'now') AS INTEGER)
+                        WHERE id = new.id;
+                    END''')
+                conn.execute('''CREATE TRIGGER IF NOT EXISTS problems_track_delete AFTER DELETE ON problems BEGIN
+                        UPDATE revision_counter SET revision = revision + 1;
+                        INSERT OR REPLACE INTO deleted_problems (id, revision, deleted_at)
+                        VALUES (old.id, (SELECT revision FROM revision_counter),
+                                CAST(strftime('%s', 'now') AS INTEGER));
+                    END''')
+
+        def init_summaries(self, conn):
+                """Create problem_summaries, the narrow copy of problems read by the list queries"""
+                conn.execute('''CREATE TABLE IF NOT EXISTS problem_summaries (
+                        id INTEGER PRIMARY KEY,
+                        date TEXT,
+                        subject TEXT,
+                        problem_preview TEXT,
+                        solution_preview TEXT,
+                        day INTEGER
+                    )''')
+                self.init_summary_triggers(conn)
+
+        def init_summary_triggers(self, conn):
+                """Keep problem_summaries in sync with problems"""
+                self.init_bulk_load(conn)
+                # Plain INSERT and UPDATE, the conflict clause of an outer upsert would override an OR REPLACE here
+                conn.execute(f'''CREATE TRIGGER IF NOT EXISTS problems_summary_insert AFTER INSERT ON problems {UNLESS_BULK_LOAD} BEGIN
+                        INSERT INTO problem_summaries (id, date, subject, problem_preview, solution_preview, day)
+                        VALUES (new.id, new.date, new.subject, {preview_sql('new.problem')}, {preview_sql('new.solution')},
+                                jalali_day(new.date));
+                    END''')
+                conn.execute(f'''CREATE TRIGGER IF NOT EXISTS problems_summary_update
+                    AFTER UPDATE OF date, subject, problem, solution ON problems {UNLESS_BULK_LOAD} BEGIN
+                        UPDATE problem_summaries SET date = new.date, subject = new.subject,
+                            problem_preview = {preview_sql('new.problem')}, solution_preview = {preview_sql('new.solution')},
+                            day = jalali_day(new.date)
+                        WHERE id = new.id;
+                    END''')
+                conn.execute(f'''CREATE TRIGGER IF NOT EXISTS problems_summary_delete AFTER DELETE ON problems {UNLESS_BULK_LOAD} BEGIN
+                        DELETE FROM problem_summaries WHERE id = old.id;
+                    END''')
+
+        def fill_summaries(self, conn, after_id, last_id):
+                """Summarize the records with ids in (after_id, last_id]"""
+                conn.execute(f"""INSERT INTO problem_summaries (id, date, subject, problem_preview, solution_preview, day)
+                    SELECT id, date, subject, {preview_sql('problem')}, {preview_sql('solution')}, jalali_day(date)
+                    FROM problems WHERE id > ? AND id <= ?""", (after_id, last_id))
+
+        def rebuild_summaries(self, conn):
+                """Refill problem_summaries from problems, in batches of SUMMARY_BATCH_SIZE rows"""
+                conn.execute("DELETE FROM problem_summaries")
+                for after_id, last_id in list(id_ranges(conn, "problems", SUMMARY_BATCH_SIZE)):
+                        self.fill_summaries(conn, after_id, last_id)
+
+        def add_day_column(self, conn):
+                """Index records by the day number of their Jalali date, for date-range filters"""
+                columns = [row[1] for row in conn.execute("PRAGMA table_info(problem_summaries)")]
+                if "day" not in columns:
+                        conn.execute("ALTER TABLE problem_summaries ADD COLUMN day INTEGER")
+                        for trigger in ("problems_summary_insert", "problems_summary_update"):
+                                conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+                        self.init_summary_triggers(conn)
+                # Serves both the range scan and the newest-first order of date-filtered lists
+                conn.execute("CREATE INDEX IF NOT EXISTS problem_summaries_day ON problem_summaries (day, id)")
+
+        def fill_days(self, conn, after_id, last_id):
+                """Compute the day numbers of the summaries with ids in (after_id, last_id]"""
+                # Dates repeat a lot, so jalali_day mostly answers from its cache
+                conn.execute("UPDATE problem_summaries SET day = jalali_day(date) WHERE id > ? AND id <= ? AND day IS NULL",
+                             (after_id, last_id))
+
+        def add_attachments(self, conn):
+                """Store attachments as content-addressed blobs, outside the tables read by lists and searches"""
+                # One row per distinct content, shared by every attachment with that SHA-256
+                conn.execute('''CREATE TABLE IF NOT EXISTS blobs (
+                        id INTEGER PRIMARY KEY,
+                        hash TEXT NOT NULL UNIQUE,
+                        size INTEGER NOT NULL,
+                        data BLOB NOT NULL
+                    )''')
+                conn.execute('''CREATE TABLE IF NOT EXISTS attachments (
+                        id INTEGER PRIMARY KEY,
+                        problem_id INTEGER NOT NULL,
+                        blob_id INTEGER NOT NULL,
+                        name TEXT NOT NULL,
+                        mime_type TEXT,
+                        added_at INTEGER
+                    )''')
+                conn.execute("CREATE INDEX IF NOT EXISTS attachments_problem ON attachments (problem_id)")
+                conn.execute("CREATE INDEX IF NOT EXISTS attachments_blob ON attachments (blob_id)")
+                # Made on first display and kept until their blob goes away
+                conn.execute('''CREATE TABLE IF NOT EXISTS thumbnails (
+                        blob_id INTEGER PRIMARY KEY,
+                        data BLOB NOT NULL
+                    )''')
+
+                # Last change to the attachments of a record, for incremental backups. Kept apart from revision
+                # so that attaching a file does not make a concurrent edit of the record's text a conflict
+                columns = [row[1] for row in conn.execute("PRAGMA table_info(problems)")]
+                if "attachments_revision" not in columns:
+                        conn.execute("ALTER TABLE problems ADD COLUMN attachments_revision INTEGER NOT NULL DEFAULT 0")
+                conn.execute("CREATE INDEX IF NOT EXISTS problems_attachments_revision ON problems (attachments_revision)")
+                self.init_attachment_triggers(conn)
+
+        def init_attachment_triggers(self, conn):
+                """Stamp records whose attachments change, and drop attachments and blobs nothing refers to"""
+                conn.execute('''CREATE TRIGGER IF NOT EXISTS problems_attachments_delete AFTER DELETE ON problems BEGIN
+                        DELETE FROM attachments WHERE problem_id = old.id;
+                    END''')
+                conn.execute('''CREATE TRIGGER IF NOT EXISTS attachments_track_insert AFTER INSERT ON attachments BEGIN
+                        UPDATE revision_counter SET revision = revision + 1;
+                        UPDATE problems SET attachments_revision = (SELECT revision FROM revision_counter)
+                        WHERE id = new.problem_id;
+                    END''')
+                conn.execute('''CREATE TRIGGER IF NOT EXISTS attachments_track_delete AFTER DELETE ON attachments BEGIN
+                        UPDATE revision_counter SET revision = revision + 1;
+                        UPDATE problems SET attachments_revision = (SELECT revision FROM revision_counter)
+                        WHERE id = old.problem_id;
+                        DELETE FROM blobs WHERE id = old.blob_id
+                            AND NOT EXISTS (SELECT 1 FROM attachments WHERE blob_id = old.blob_id);
+                    END''')
+                conn.execute('''CREATE TRIGGER IF NOT EXISTS blobs_delete AFTER DELETE ON blobs BEGIN
+                        DELETE FROM thumbnails WHERE blob_id = old.id;
+                    END''')
+
+        def add_tags(self, conn):
+                """Create the tags, the record to tag links and the per-tag record counts"""
+                # records counts the links of each tag, so the facets of the whole database never scan problem_tags
+                conn.execute('''CREATE TABLE IF NOT EXISTS tags (
+                        id INTEGER PRIMARY KEY,
+                        facet TEXT NOT NULL,
+                        name TEXT NOT NULL,
+                        records INTEGER NOT NULL DEFAULT 0,
+                        UNIQUE (facet, name)
+                    )''')
+                # Clustered by tag, the primary key holds the sorted postings of every tag. The second index
+                # lists the tags of each record, both cover every query on the table
+                conn.execute('''CREATE TABLE IF NOT EXISTS problem_tags (
+                        tag_id INTEGER NOT NULL,
+                        problem_id INTEGER NOT NULL,
+                        PRIMARY KEY (tag_id, problem_id)
+                    ) WITHOUT ROWID''')
+                conn.execute("CREATE INDEX IF NOT EXISTS problem_tags_problem ON problem_tags (problem_id, tag_id)")
+                self.init_tag_triggers(conn)
+
+        def init_tag_triggers(self, conn):
+                """Keep the tag counts up to date, and stamp records whose tags change with a new revision"""
+                # Tags are part of a record, changing them is an edit like any other: it reaches incremental
+                # backups and conflicts with concurrent edits of the record
+                conn.execute('''CREATE TRIGGER IF NOT EXISTS problem_tags_insert AFTER INSERT ON problem_tags BEGIN
+                        UPDATE tags SET records = records + 1 WHERE id = new.tag_id;
+                        UPDATE revision_counter SET revision = revision + 1;
+                        UPDATE problems SET revision = (SELECT revision FROM revision_counter),
+                            updated_at = CAST(strftime('%s', 'now') AS INTEGER)
+                        WHERE id = new.problem_id;
+                    END''')
+                conn.execute('''CREATE TRIGGER IF NOT EXISTS problem_tags_delete AFTER DELETE ON problem_tags BEGIN
+                        UPDATE tags SET records = records - 1 WHERE id = old.tag_id;
+                        UPDATE revision_counter SET revision = revision + 1;
+                        UPDATE problems SET revision = (SELECT revision FROM revision_counter),
+                            updated_at = CAST(strftime('%s', 'now') AS INTEGER)
+                        WHERE id = old.problem_id;
+                    END''')
+                conn.execute('''CREATE TRIGGER IF NOT EXISTS problems_tags_delete AFTER DELETE ON problems BEGIN
+                        DELETE FROM problem_tags WHERE problem_id = old.id;
+                    END''')
+
+        def gate_bulk_load_triggers(self, conn):
+                """Pause the per-row triggers during bulk loads through a flag row rather than by dropping them"""
+                for trigger in BULK_LOAD_TRIGGERS:
+                        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+                self.init_triggers(conn)
+
+        def init_triggers(self, conn):
+                """Create the triggers keeping the search index, revisions and summaries in sync with problems"""
+                self.init_search_index(conn)
+                self.init_change_tracking_triggers(conn)
+                self.init_summary_triggers(conn)
+
+        def add_database_id(self, conn):
+                """Give the database a random id, telling copies made from it apart from the original"""
+                conn.execute('''CREATE TABLE IF NOT EXISTS database_id (
+                        id INTEGER PRIMARY KEY CHECK (id = 0),
+                        value TEXT NOT NULL
+                    )''')
+                conn.execute("INSERT OR IGNORE INTO database_id (id, value) VALUES (0, lower(hex(randomblob(16))))")
+
+        # Bulk loads
+        def init_bulk_load(self, conn):
+                """Create the flag table of UNLESS_BULK_LOAD, before any trigger checking it"""
+                conn.execute("CREATE TABLE IF NOT EXISTS bulk_load (active INTEGER NOT NULL)")
+
+        def begin_bulk_load(self, conn):
+                """Pause the per-row triggers for the rest of the caller's write transaction, see end_bulk_load"""
+                # Filling the derived tables once at the end is much cheaper than the per-row triggers,
+                # and the whole load is stamped with a single revision afterwards
+                conn.execute("INSERT INTO bulk_load (active) VALUES (1)")
+
+        def resume_triggers(self, conn):
+                """Run the triggers paused by begin_bulk_load again, before the transaction commits"""
+                conn.execute("DELETE FROM bulk_load")
+
+        def end_bulk_load(self, conn):
+                """Stamp the loaded rows, rebuild the derived tables and resume the triggers"""
+                conn.execute("UPDATE revision_counter SET revision = revision + 1")
+                conn.execute("""UPDATE problems SET revision = (SELECT revision FROM revision_counter),
+                    updated_at = CAST(strftime('%s', 'now') AS INTEGER)""")
+                conn.execute("DELETE FROM deleted_problems WHERE id IN (SELECT id FROM problems)")
+                self.rebuild_search_index(conn)
+                self.rebuild_summaries(conn)
+                self.resume_triggers(conn)
+
+        # Records
+        @timed("db.get")
+        def get(self, record_id):
+                """(date, subject, problem, solution) of a record, or None if it does not exist"""
+                return self.connection().execute(
+                        "SELECT date, subject, problem, solution FROM problems WHERE id = ?", (record_id,)).fetchone()
+
+        @timed("db.get_for_update")
+        def get_for_update(self, record_id, conn=None):
+                """(date, subject, problem, solution, revision) of a record, the revision is passed back to update"""
+                conn = conn or self.connection()
+                return conn.execute("SELECT date, subject, problem, solution, revision FROM problems WHERE id = ?",
+                                    (record_id,)).fetchone()
+
+        @timed("db.get_many_for_update")
+        def get_many_for_update(self, record_ids, conn=None):
+                """(id, date, subject, problem, solution, revision) of those of the given records that exist"""
+                conn = conn or self.connection()
+                return conn.execute(f"""SELECT id, date, subject, problem, solution, revision FROM problems
+                    WHERE id IN ({id_list(record_ids)})""", list(record_ids)).fetchall()
+
+        @timed("db.get_summaries")
+        def get_summaries(self, record_ids, conn=None):
+                """List rows of the given records in the same order, skipping those that no longer exist"""
+                conn = conn or self.connection()
+                placeholders = ", ".join("?" for _ in record_ids)
+                rows = {row[0]: row for row in conn.execute(
+                        f"SELECT {SUMMARY_COLUMNS} FROM problem_summaries s WHERE s.id IN ({placeholders})",
+                        list(record_ids))}
+                return [rows[record_id] for record_id in record_ids if record_id in rows]
+
+        @timed("db.full_text")
+        def full_text(self, record_id, field):
+                """The complete problem or solution of a record, whose list rows only carry a preview"""
+                if field not in ("problem", "solution"):
+                        raise ValueError(f"Unknown text field: {field}")
+                row = self.connection().execute(f"SELECT {field} FROM problems WHERE id = ?", (record_id,)).fetchone()
+                return row[0] if row else None
+
+        def write(self, operation, conn=None):
+                """Run operation(conn) in its own short write transaction and return its result
+
+                The transaction takes the write lock up front, other processes writing to the same file make it wait
+                for the busy timeout and then retry with backoff, rather than fail with "database is locked".
+                """
+                conn = conn or self.connection()
+                delay = WRITE_RETRY_DELAY
+                for attempt in range(WRITE_RETRIES + 1):
+                        try:
+                                with transaction(conn):
+                                        return operation(conn)
+                        except sqlite3.OperationalError as e:
+                                # The last busy error is raised as it is, the caller sees what kept the lock
+                                if not is_busy(e) or attempt == WRITE_RETRIES:
+                                        raise
+                        # Randomized so that writers which collided do not retry in lockstep
+                        time.sleep(delay * (1 + random.random()))
+                        delay *= 2
+
+        @timed("db.add")
+        def add(self, date, subject, problem, solution, tags=None):
+                """Insert a record, tagged with the (facet, name) tags if given, and return its id"""
+                def insert(conn):
+                        record_id = conn.execute("INSERT INTO problems (date, subject, problem, solution) VALUES (?, ?, ?, ?)",
+                                                 (date, subject, problem, solution)).lastrowid
+                        if tags:
+                                self.set_tags(conn, record_id, tags)
+                        return record_id
+
+                record_id = self.write(insert)
+                self.notify(CHANGE_INSERT, [record_id])
+                return record_id
+
+        @timed("db.add_many")
+        def add_many(self, records, conn=None):
+                """Insert (date, subject, problem, solution) records in one transaction and return how many were added"""
+                # A list, a retried transaction goes over the records again
+                records = list(records)
+
+                def insert(conn):
+                        # Indexing the whole batch with one statement per table is several times faster than
+                        # the per-row triggers, and the batch is stamped with a single revision
+                        self.begin_bulk_load(conn)
+                        # AUTOINCREMENT ids, so the new records are exactly those after the current last one
+                        after_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM problems").fetchone()[0]
+                        conn.execute("UPDATE revision_counter SET revision = revision + 1")
+                        added = conn.executemany("""INSERT INTO problems (date, subject, problem, solution, revision, updated_at)
+                            VALUES (?, ?, ?, ?, (SELECT revision FROM revision_counter),
+                                    CAST(strftime('%s', 'now') AS INTEGER))""", records).rowcount
+                        last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM problems").fetchone()[0]
+                        self.fill_search_index(conn, after_id, last_id)
+                        self.fill_summaries(conn, after_id, last_id)
+                        self.resume_triggers(conn)
+                        return added
+
+                added = self.write(insert, conn)
+                self.notify(CHANGE_RESET)
+                return added
+
+        @timed("db.update")
+        def update(self, record_id, date, subject, problem, solution, revision=None, tags=None):
+                """Rewrite a record, and replace its tags if given, returning False if it does not exist
+
+                Given the revision the record was read at (see get_for_update), the record is only rewritten if nobody
+                changed it since, ConflictError is raised otherwise instead of silently overwriting their edit.
+                """
+                def rewrite(conn):
+                        if revision is None:
+                                updated = conn.execute("UPDATE problems SET date=?, subject=?, problem=?, solution=? WHERE id=?",
+                                                       (date, subject, problem, solution, record_id)).rowcount > 0
+                        elif conn.execute("""UPDATE problems SET date=?, subject=?, problem=?, solution=?
+                            WHERE id=? AND revision=?""", (date, subject, problem, solution, record_id, revision)).rowcount:
+                                updated = True
+                        else:
+                                raise ConflictError(record_id, self.get_for_update(record_id, conn))
+                        if updated and tags is not None:
+                                self.set_tags(conn, record_id, tags)
+                        return updated
+
+                updated = self.write(rewrite)
+                if updated:
+                        self.notify(CHANGE_UPDATE, [record_id])
+                return updated
+
+        @timed("db.delete")
+        def delete(self, record_id):
+                """Delete a record, returning False if it did not exist"""
+                deleted = self.write(lambda conn: conn.execute("DELETE FROM problems WHERE id = ?", (record_id,)).rowcount > 0)
+                if deleted:
+                        self.notify(CHANGE_DELETE, [record_id])
+                return deleted
+
+        def fetch_records(self, after_id, limit, conn=None):
+                """Complete (id, date, subject, problem, solution) rows of the records after after_id, in id order"""
+                conn = conn or self.connection()
+                return conn.execute("SELECT id, date, subject, problem, solution FROM problems WHERE id > ? ORDER BY id LIMIT ?",
+                                    (after_id, limit)).fetchall()
+
+        # Listing and search
+        @timed("db.fetch_page", query_name)
+        def fetch_page(self, search_query, after=None, limit=PAGE_SIZE, conn=None):
+                """One keyset page of search_query, on conn if given"""
+                conn = conn or self.connection()
+                search_query.prepare(conn)
+                return conn.execute(*search_query.page(after, limit)).fetchall()
+
+        @timed("db.fetch_rows", query_name)
+        def fetch_rows(self, search_query, record_ids, conn=None):
+                """Rows of those of record_ids that search_query returns, e.g. to show changes to them"""
+                conn = conn or self.connection()
+                search_query.prepare(conn)
+                return conn.execute(*search_query.rows(record_ids)).fetchall()
+
+        @timed("db.count", query_name)
+        def count(self, search_query, conn=None):
+                conn = conn or self.connection()
+                search_query.prepare(conn)
+                return conn.execute(*search_query.count()).fetchone()[0]
+
+        # Change tracking
+        def current_revision(self, conn=None):
+                """Revision of the most recent change"""
+                conn = conn or self.connection()
+                return conn.execute("SELECT revision FROM revision_counter").fetchone()[0]
+
+        def data_version(self, conn=None):
+                """Number that changes whenever another connection, of this process or another, commits a change"""
+                conn = conn or self.connection()
+                return conn.execute("PRAGMA data_version").fetchone()[0]
+
+        def database_id(self, conn=None):
+                """Random id of the database, a restored snapshot gets a new one even though it copies the old one"""
+                conn = conn or self.connection()
+                return conn.execute("SELECT value FROM database_id").fetchone()[0]
+
+        def renew_database_id(self, conn):
+                """Give the database a new id, once its contents were replaced wholesale"""
+                with conn:
+                        conn.execute("UPDATE database_id SET value = lower(hex(randomblob(16)))")
+
+        def last_backup_revision(self, conn=None):
+                """Revision covered by the most recent backup, or None if there is none"""
+                conn = conn or self.connection()
+                return conn.execute("SELECT MAX(revision) FROM backup_manifest").fetchone()[0]
+
+        # Tags
+        def set_tags(self, conn, record_id, tags):
+                """Give a record exactly the (facet, name) tags, in the caller's write transaction on conn"""
+                tag_ids = set()
+                for facet, name in tags:
+                        conn.execute("INSERT OR IGNORE INTO tags (facet, name) VALUES (?, ?)", (facet, name))
+                        tag_ids.add(conn.execute("SELECT id FROM tags WHERE facet = ? AND name = ?",
+                                                 (facet, name)).fetchone()[0])
+                current = {row[0] for row in conn.execute("SELECT tag_id FROM problem_tags WHERE problem_id = ?",
+                                                          (record_id,))}
+                conn.executemany("DELETE FROM problem_tags WHERE tag_id = ? AND problem_id = ?",
+                                 [(tag_id, record_id) for tag_id in current - tag_ids])
+                conn.executemany("INSERT INTO problem_tags (tag_id, problem_id) VALUES (?, ?)",
+                                 [(tag_id, record_id) for tag_id in tag_ids - current])
+
+        def tags_of(self, record_id, conn=None):
+                """(facet, name) tags of a record, in order"""
+                conn = conn or self.connection()
+                return conn.execute("""SELECT t.facet, t.name FROM problem_tags pt JOIN tags t ON t.id = pt.tag_id
+                    WHERE pt.problem_id = ? ORDER BY t.facet, t.name""", (record_id,)).fetchall()
+
+        def all_tags(self, conn=None):
+                """(facet, name) of every tag some record carries, in order"""
+                conn = conn or self.connection()
+                return conn.execute("SELECT facet, name FROM tags WHERE records > 0 ORDER BY facet, name").fetchall()
+
+        @timed("db.facet_counts", query_name)
+        def facet_counts(self, search_query, conn=None):
+                """{facet: [(tag_id, name, records)]} of the tags of the rows search_query returns, most used first
+
+                The counts of a facet the query filters on leave out that filter, they tell how many rows picking
+                another tag of the facet as well would add.
+                """
+                conn = conn or self.connection()
+                facets = {}
+                for tag_id, facet, name, records in self.tag_counts(search_query, conn):
+                        if facet not in search_query.tags:
+                                facets.setdefault(facet, []).append((tag_id, name, records))
+                for facet in search_query.tags:
+                        others = {other: tag_ids for other, tag_ids in search_query.tags.items() if other != facet}
+                        facets[facet] = [(tag_id, name, records) for tag_id, _, name, records
+                                         in self.tag_counts(search_query.with_tags(others), conn, facet)]
+                for counts in facets.values():
+                        counts.sort(key=lambda count: (-count[2], count[1]))
+                return facets
+
+        def tag_counts(self, search_query, conn, facet=None):
+                """(tag_id, facet, name, records) of the tags of the rows search_query returns, of one facet if given"""
+                where, params = (" AND t.facet = ?", (facet,)) if facet is not None else ("", ())
+                if isinstance(search_query, RecentQuery) and not search_query.filter_sql:
+                        # Every record, counted as the links are made
+                        return conn.execute(f"SELECT t.id, t.facet, t.name, t.records FROM tags t WHERE t.records > 0{where}",
+                                            params).fetchall()
+                # Walks the tags of each matching row through the covering (problem_id, tag_id) index
+                search_query.prepare(conn)
+                ids_sql, ids_params = search_query.ids()
+                return conn.execute(f"""SELECT t.id, t.facet, t.name, COUNT(*) FROM ({ids_sql}) m
+                    JOIN problem_tags pt ON pt.problem_id = m.id JOIN tags t ON t.id = pt.tag_id
+                    WHERE 1{where} GROUP BY t.id""", ids_params + params).fetchall()
+
+        # Attachments, never read by the list and search queries
+        @timed("db.list_attachments")
+        def list_attachments(self, record_id, conn=None):
+                """(id, name, mime_type, size, blob_id) of the attachments of a record, oldest first"""
+                conn = conn or self.connection()
+                return conn.execute("""SELECT a.id, a.name, a.mime_type, b.size, b.id
+                    FROM attachments a JOIN blobs b ON b.id = a.blob_id WHERE a.problem_id = ? ORDER BY a.id""",
+                                    (record_id,)).fetchall()
+
+        def find_blob(self, conn, digest):
+                """Id of the blob holding the content with this SHA-256 hex digest, None if it is not stored"""
+                row = conn.execute("SELECT id FROM blobs WHERE hash = ?", (digest,)).fetchone()
+                return row[0] if row else None
+
+        def open_blob(self, blob_id, conn=None):
+                """Read-only incremental handle of a blob, for reading parts of it where they are needed"""
+                conn = conn or self.connection()
+                return conn.blobopen("blobs", "data", blob_id, readonly=True)
+
+        def blob_chunks(self, blob_id, conn=None):
+                """The content of a blob, BLOB_CHUNK_SIZE bytes at a time"""
+                conn = conn or self.connection()
+                with conn.blobopen("blobs", "data", blob_id, readonly=True) as blob:
+                        while True:
+                                chunk = blob.read(BLOB_CHUNK_SIZE)
+                                if not chunk:
+                                        return
+                                yield chunk
+
+        @timed("db.add_attachment")
+        def add_attachment(self, record_id, file_path, name=None, progress=None, is_cancelled=None):
+                """Attach a file to a record, storing its content only if no other attachment has the same.
+                Returns the attachment id, None if the record does not exist"""
+                name = name or os.path.basename(file_path)
+                size = os.path.getsize(file_path)
+                # Progress covers hashing the file and then copying it
+                done = 0
+
+                def file_chunks():
+                        nonlocal done
+                        with open(file_path, "rb") as file:
+                                for chunk in iter(lambda: file.read(BLOB_CHUNK_SIZE), b""):
+                                        if is_cancelled and is_cancelled():
+                                                raise AttachmentCancelled()
+                                        yield chunk
+                                        done += len(chunk)
+                                        if progress:
+                                                progress(done, 2 * size)
+
+                # Hashed ahead of the write transaction, which then only has to copy content that is new
+                hasher = hashlib.sha256()
+                for chunk in file_chunks():
+                        hasher.update(chunk)
+                digest = hasher.hexdigest()
+
+                def insert(conn):
+                        nonlocal done
+                        if not conn.execute("SELECT 1 FROM problems WHERE id = ?", (record_id,)).fetchone():
+                                return None
+                        blob_id = self.find_blob(conn, digest)
+                        if blob_id is None:
+                                done = size
+                                writer = BlobWriter(conn, digest, size)
+                                for chunk in file_chunks():
+                                        writer.write(chunk)
+                                blob_id = writer.close()
+                        return conn.execute("""INSERT INTO attachments (problem_id, blob_id, name, mime_type, added_at)
+                            VALUES (?, ?, ?, ?, CAST(strftime('%s', 'now') AS INTEGER))""",
+                                            (record_id, blob_id, name, mimetypes.guess_type(name)[0])).lastrowid
+
+                # A private connection, files are copied on a worker thread
+                conn = self.open_connection()
+                try:
+                        return self.write(insert, conn)
+                finally:
+                        conn.close()
+
+        @timed("db.save_attachment")
+        def save_attachment(self, attachment_id, file_path, progress=None, is_cancelled=None):
+                """Copy the content of an attachment to file_path, returning False if it does not exist"""
+                conn = self.open_connection()
+                temp_path = file_path + ".part"
+                try:
+                        row = conn.execute("""SELECT b.id, b.size FROM attachments a JOIN blobs b ON b.id = a.blob_id
+                            WHERE a.id = ?""", (attachment_id,)).fetchone()
+                        if row is None:
+                                return False
+                        blob_id, size = row
+                        done = 0
+                        with open(temp_path, "wb") as file:
+                                for chunk in self.blob_chunks(blob_id, conn):
+                                        if is_cancelled and is_cancelled():
+                                                raise AttachmentCancelled()
+                                        file.write(chunk)
+                                        done += len(chunk)
+                                        if progress:
+                                                progress(done, size)
+                        # Only replace an existing file once the copy is complete
+                        os.replace(temp_path, file_path)
+                        return True
+                except BaseException:
+                        if os.path.exists(temp_path):
+                                os.remove(temp_path)
+                        raise
+                finally:
+                        conn.close()
+
+        @timed("db.delete_attachment")
+        def delete_attachment(self, attachment_id):
+                """Remove an attachment, and its content if no other attachment shares it"""
+                return self.write(lambda conn: conn.execute("DELETE FROM attachments WHERE id = ?",
+                                                            (attachment_id,)).rowcount > 0)
+
+        def thumbnail(self, blob_id, conn=None):
+                """Cached thumbnail image of a blob, None if none was made yet"""
+                conn = conn or self.connection()
+                row = conn.execute("SELECT data FROM thumbnails WHERE blob_id = ?", (blob_id,)).fetchone()
+                return row[0] if row else None
+
+        def save_thumbnail(self, blob_id, data, conn=None):
+                # Nothing is saved if the blob was deleted meanwhile
+                self.write(lambda conn: conn.execute(
+                        "INSERT OR REPLACE INTO thumbnails (blob_id, data) SELECT id, ? FROM blobs WHERE id = ?",
+                        (data, blob_id)), conn)
+
+        def stats(self, conn=None):
+                """Record count, date range and change tracking state of the database"""
+                conn = conn or self.connection()
+                records = conn.execute("SELECT COUNT(*) FROM problem_summaries").fetchone()[0]
+                # Both ends of the day index
+                first_day = conn.execute("SELECT MIN(day) FROM problem_summaries").fetchone()[0]
+                last_day = conn.execute("SELECT MAX(day) FROM problem_summaries").fetchone()[0]
+                return {
+                        "records": records,
+                        "first_date": str(jalali_from_day(first_day)) if first_day is not None else None,
+                        "last_date": str(jalali_from_day(last_day)) if last_day is not None else None,
+                        "revision": self.current_revision(conn),
+                        "last_backup_revision": self.last_backup_revision(conn),
+                        "schema_version": schema_version(conn),
+                        "size_bytes": os.path.getsize(self.db_path) if os.path.exists(self.db_path) else 0,
+                }
+
+        def record_backup(self, conn, kind, file_path, base_revision, revision):
+                """Add a backup to the manifest"""
+                with conn:
+                        conn.execute('''INSERT INTO backup_manifest (kind, file_path, base_revision, revision, created_at)
+                            VALUES (?, ?, ?, ?, CAST(strftime('%s', 'now') AS INTEGER))''',
+                                     (kind, file_path, base_revision, revision))
+
+
+_repository = None
+
+
+def get_repository():
+        """The repository shared by the whole application"""
+        global _repository
+        if _repository is None:
+                _repository = ProblemRepository(get_db_path())
+        return _repository
+
+
+# Database Setup
+def init_db(progress=None, is_cancelled=None):
+        """Create or upgrade the database on a connection of the calling thread's own, True if it had to be changed"""
+        repository = get_repository()
+        conn = repository.open_connection()
+        try:
+                return repository.init_schema(conn, progress, is_cancelled)
+        finally:
+                conn.close()
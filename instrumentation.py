@@ -0,0 +1,204 @@
+import bisect
+import functools
+import json
+import sqlite3
+import threading
+import time
+from collections import deque
+
+# Upper bounds in milliseconds of the latency histogram buckets, the last one catches everything slower
+BUCKET_BOUNDS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, float("inf"))
+
+# Operations taking at least this long are written to the slow-operation log with their SQL and query plans
+SLOW_OPERATION_MS = 100
+
+# Slow operations kept in memory for the diagnostics dialog, and statements kept per operation
+SLOW_LOG_SIZE = 200
+MAX_STATEMENTS = 20
+
+# Off unless enable() is called, timed functions then cost a single global lookup
+ENABLED = False
+
+
+class Histogram:
+        """Latencies of one operation, counted in BUCKET_BOUNDS_MS buckets"""
+
+        def __init__(self):
+                self.buckets = [0] * len(BUCKET_BOUNDS_MS)
+                self.count = 0
+                self.total_ms = 0.0
+                self.min_ms = float("inf")
+                self.max_ms = 0.0
+
+        def add(self, elapsed_ms):
+                self.buckets[bisect.bisect_left(BUCKET_BOUNDS_MS, elapsed_ms)] += 1
+                self.count += 1
+                self.total_ms += elapsed_ms
+                self.min_ms = min(self.min_ms, elapsed_ms)
+                self.max_ms = max(self.max_ms, elapsed_ms)
+
+        def percentile(self, fraction):
+                """Upper bound of the bucket holding the given share of the latencies, at most the slowest one"""
+                if not self.count:
+                        return 0.0
+                rank = max(1, round(fraction * self.count))
+                seen = 0
+                for bound, count in zip(BUCKET_BOUNDS_MS, self.buckets):
+                        seen += count
+                        if seen >= rank:
+                                return min(bound, self.max_ms)
+                return self.max_ms
+
+        def to_json(self):
+                return {"count": self.count, "total_ms": self.total_ms,
+                        "mean_ms": self.total_ms / self.count if self.count else 0.0,
+                        "min_ms": self.min_ms if self.count else 0.0, "max_ms": self.max_ms,
+                        "p50_ms": self.percentile(0.5), "p95_ms": self.percentile(0.95),
+                        "p99_ms": self.percentile(0.99),
+                        "buckets": {("inf" if bound == float("inf") else str(bound)): count
+                                    for bound, count in zip(BUCKET_BOUNDS_MS, self.buckets) if count}}
+
+
+class Recorder:
+        """Histograms of every timed operation and the log of the slow ones, shared by all threads"""
+
+        def __init__(self):
+                self.lock = threading.Lock()
+                self.histograms = {}
+                self.slow_operations = deque(maxlen=SLOW_LOG_SIZE)
+                self.slow_log_path = None
+                self.slow_threshold_ms = SLOW_OPERATION_MS
+                # Per thread, the statements run by each operation in progress, innermost last
+                self.local = threading.local()
+
+        def reset(self):
+                with self.lock:
+                        self.histograms.clear()
+                        self.slow_operations.clear()
+
+        def operations(self):
+                stack = getattr(self.local, "operations", None)
+                if stack is None:
+                        stack = self.local.operations = []
+                return stack
+
+        def statement(self, db_path, sql):
+                """Trace callback of the connections to db_path, keeps the statements of the operation running"""
+                stack = getattr(self.local, "operations", None)
+                # Statements run inside triggers and virtual tables come as "--" comments
+                if stack and not sql.startswith("--"):
+                        statements = stack[-1]
+                        # and are then reported again under the statement that ran them
+                        if len(statements) < MAX_STATEMENTS and (not statements or statements[-1][1] != sql):
+                                statements.append((db_path, sql))
+
+        def record(self, name, elapsed_ms, statements):
+                with self.lock:
+                        histogram = self.histograms.get(name)
+                        if histogram is None:
+                                histogram = self.histograms[name] = Histogram()
+                        histogram.add(elapsed_ms)
+                if elapsed_ms >= self.slow_threshold_ms:
+                        self.log_slow(name, elapsed_ms, statements)
+
+        def log_slow(self, name, elapsed_ms, statements):
+                entry = {"time": time.strftime("%Y-%m-%d %H:%M:%S"), "operation": name,
+                         "duration_ms": round(elapsed_ms, 3), "thread": threading.current_thread().name,
+                         "statements": [{"sql": sql, "plan": query_plan(db_path, sql)} for db_path, sql in statements]}
+                with self.lock:
+                        self.slow_operations.append(entry)
+                        if self.slow_log_path:
+                                try:
+                                        with open(self.slow_log_path, "a", encoding="utf-8") as file:
+                                                file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                                except OSError:
+                                        # Losing a log line must never break the operation being logged
+                                        pass
+
+        def snapshot(self):
+                """Everything recorded so far as JSON-compatible data"""
+                with self.lock:
+                        return {"enabled": ENABLED, "slow_threshold_ms": self.slow_threshold_ms,
+                                "histograms": {name: histogram.to_json()
+                                               for name, histogram in sorted(self.histograms.items())},
+                                "slow_operations": list(self.slow_operations)}
+
+        def dump(self, file_path):
+                with open(file_path, "w", encoding="utf-8") as file:
+                        json.dump(self.snapshot(), file, ensure_ascii=False, indent=2)
+
+
+recorder = Recorder()
+
+
+def enable(slow_log_path=None, slow_threshold_ms=SLOW_OPERATION_MS):
+        """Start timing operations, before the database connections are opened so that their SQL is traced"""
+        global ENABLED
+        recorder.slow_log_path = slow_log_path
+        recorder.slow_threshold_ms = slow_threshold_ms
+        ENABLED = True
+
+
+def query_plan(db_path, sql):
+        """EXPLAIN QUERY PLAN lines of a read statement, on a read-only connection of its own"""
+        if not sql.lstrip().upper().startswith(("SELECT", "WITH")):
+                return []
+        try:
+                conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        except sqlite3.Error:
+                return []
+        try:
+                # Functions of the application used in queries, enough to prepare them for the plan
+                for function, arguments in (("fa_normalize", 1), ("trigram_similarity", 2), ("jalali_day", 1)):
+                        conn.create_function(function, arguments, lambda *args: None)
+                return [detail for _, _, _, detail in conn.execute(f"EXPLAIN QUERY PLAN {sql}")]
+        except sqlite3.Error as e:
+                return [f"(no plan: {e})"]
+        finally:
+                conn.close()
+
+
+def trace(conn, db_path):
+        """Report the statements conn runs to the operation in progress, if instrumentation is enabled"""
+        if ENABLED:
+                conn.set_trace_callback(functools.partial(recorder.statement, db_path))
+
+
+class operation:
+        """Times the block it wraps as name, also usable where the timed code is not a whole function"""
+
+        __slots__ = ("name", "started")
+
+        def __init__(self, name):
+                self.name = name
+                self.started = None
+
+        def __enter__(self):
+                if ENABLED:
+                        recorder.operations().append([])
+                        self.started = time.perf_counter()
+                return self
+
+        def __exit__(self, *exc_info):
+                if self.started is not None:
+                        elapsed_ms = (time.perf_counter() - self.started) * 1000
+                        stack = recorder.operations()
+                        statements = stack.pop()
+                        if stack:
+                                # The enclosing operation ran these statements too
+                                stack[-1].extend(statements[:MAX_STATEMENTS - len(stack[-1])])
+                        recorder.record(self.name, elapsed_ms, statements)
+                return False
+
+
+def timed(name, detail=None):
+        """Decorator timing every call as name, suffixed with [detail(*args)] if given"""
+        def decorate(function):
+                @functools.wraps(function)
+                def wrapper(*args, **kwargs):
+                        if not ENABLED:
+                                return function(*args, **kwargs)
+                        with operation(name if detail is None else f"{name}[{detail(*args, **kwargs)}]"):
+                                return function(*args, **kwargs)
+                return wrapper
+        return decorate
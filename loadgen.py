@@ -0,0 +1,177 @@
+import argparse
+import asyncio
+import json
+import math
+import random
+import sys
+import time
+from urllib.parse import urlencode
+
+from server import DEFAULT_HOST, DEFAULT_PORT
+
+# Keywords searched when none are given, common words of IT problem reports
+DEFAULT_KEYWORDS = ["printer", "network", "vpn", "password", "outlook", "driver", "update", "slow"]
+
+# Share of the read requests going to each kind of read
+READ_MIX = {"search": 0.4, "get": 0.4, "list": 0.2}
+
+
+class HTTPConnection:
+        """A keep-alive HTTP/1.1 client connection, enough for the API server's responses"""
+
+        def __init__(self, host, port):
+                self.host = host
+                self.port = port
+                self.reader = None
+                self.writer = None
+
+        async def request(self, method, path, payload=None):
+                """(status, body) of a request, reconnecting if the server closed the connection"""
+                if self.writer is None:
+                        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+                body = json.dumps(payload).encode() if payload is not None else b""
+                self.writer.write((f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\nContent-Length: {len(body)}\r\n"
+                                   f"Content-Type: application/json\r\n\r\n").encode("latin-1") + body)
+                await self.writer.drain()
+
+                status = int((await self.reader.readline()).split()[1])
+                headers = {}
+                while True:
+                        line = await self.reader.readline()
+                        if line in (b"\r\n", b""):
+                                break
+                        name, _, value = line.decode("latin-1").partition(":")
+                        headers[name.strip().lower()] = value.strip()
+
+                if headers.get("transfer-encoding") == "chunked":
+                        chunks = []
+                        while True:
+                                size = int((await self.reader.readline()).strip(), 16)
+                                chunks.append(await self.reader.readexactly(size + 2))
+                                if size == 0:
+                                        break
+                        body = b"".join(chunk[:-2] for chunk in chunks)
+                else:
+                        body = await self.reader.readexactly(int(headers.get("content-length", 0)))
+                if headers.get("connection") == "close":
+                        self.close()
+                return status, body
+
+        def close(self):
+                if self.writer is not None:
+                        self.writer.close()
+                        self.writer = None
+
+
+def percentile(sorted_values, fraction):
+        if not sorted_values:
+                return 0.0
+        return sorted_values[max(0, math.ceil(fraction * len(sorted_values)) - 1)]
+
+
+class LoadGenerator:
+        """Keeps concurrency connections busy with a mix of requests and records their latencies"""
+
+        def __init__(self, host, port, concurrency, duration, write_ratio, keywords):
+                self.host = host
+                self.port = port
+                self.concurrency = concurrency
+                self.duration = duration
+                self.write_ratio = write_ratio
+                self.keywords = keywords
+                self.record_ids = []
+                self.latencies = {}
+                self.errors = {}
+
+        def next_request(self, rng):
+                """(kind, method, path, payload) of a random request"""
+                if rng.random() < self.write_ratio:
+                        payload = {"subject": f"Load test {rng.randrange(10 ** 6)}", "problem": rng.choice(self.keywords),
+                                   "solution": "Generated by loadgen.py"}
+                        if self.record_ids and rng.random() < 0.5:
+                                return "update", "PUT", f"/problems/{rng.choice(self.record_ids)}", payload
+                        return "add", "POST", "/problems", payload
+
+                kind = rng.choices(list(READ_MIX), weights=list(READ_MIX.values()))[0]
+                if kind == "get" and self.record_ids:
+                        return kind, "GET", f"/problems/{rng.choice(self.record_ids)}", None
+                if kind == "search":
+                        query = {"q": rng.choice(self.keywords), "limit": 50}
+                        return kind, "GET", f"/problems?{urlencode(query)}", None
+                return "list", "GET", "/problems?limit=50", None
+
+        async def worker(self, seed, deadline):
+                rng = random.Random(seed)
+                connection = HTTPConnection(self.host, self.port)
+                try:
+                        while time.perf_counter() < deadline:
+                                kind, method, path, payload = self.next_request(rng)
+                                started = time.perf_counter()
+                                try:
+                                        status, _ = await connection.request(method, path, payload)
+                                except (OSError, ValueError, IndexError, asyncio.IncompleteReadError):
+                                        connection.close()
+                                        status = None
+                                elapsed = time.perf_counter() - started
+                                if status is None or status >= 400:
+                                        self.errors[kind] = self.errors.get(kind, 0) + 1
+                                else:
+                                        self.latencies.setdefault(kind, []).append(elapsed)
+                finally:
+                        connection.close()
+
+        async def run(self):
+                # Ids to read and update, from the most recent records
+                connection = HTTPConnection(self.host, self.port)
+                status, body = await connection.request("GET", "/problems?limit=1000")
+                connection.close()
+                if status != 200:
+                        raise ConnectionError(f"GET /problems answered {status}")
+                self.record_ids = [record["id"] for record in json.loads(body)["records"]]
+
+                started = time.perf_counter()
+                deadline = started + self.duration
+                await asyncio.gather(*(self.worker(seed, deadline) for seed in range(self.concurrency)))
+                return time.perf_counter() - started
+
+        def report(self, elapsed):
+                total = sum(len(values) for values in self.latencies.values())
+                print(f"{total} requests in {elapsed:.1f} s over {self.concurrency} connections: "
+                      f"{total / elapsed:.0f} requests/s, {sum(self.errors.values())} errors")
+                print(f"{'request':<10}{'count':>8}{'errors':>8}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+                everything = []
+                for kind in sorted(set(self.latencies) | set(self.errors)):
+                        values = sorted(self.latencies.get(kind, []))
+                        everything.extend(values)
+                        print(f"{kind:<10}{len(values):>8}{self.errors.get(kind, 0):>8}{percentile(values, 0.5) * 1000:>10.1f}"
+                              f"{percentile(values, 0.99) * 1000:>10.1f}{(values[-1] if values else 0) * 1000:>10.1f}")
+                everything.sort()
+                print(f"{'all':<10}{len(everything):>8}{sum(self.errors.values()):>8}"
+                      f"{percentile(everything, 0.5) * 1000:>10.1f}{percentile(everything, 0.99) * 1000:>10.1f}"
+                      f"{(everything[-1] if everything else 0) * 1000:>10.1f}")
+
+
+def main(argv=None):
+        parser = argparse.ArgumentParser(description="Load the API server of `cli.py serve` and report latencies")
+        parser.add_argument("--host", default=DEFAULT_HOST)
+        parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+        parser.add_argument("-c", "--concurrency", type=int, default=32, help="connections kept busy at once")
+        parser.add_argument("-d", "--duration", type=float, default=10, help="seconds to run for")
+        parser.add_argument("-w", "--write-ratio", type=float, default=0.0,
+                            help="share of requests adding or updating records, which stay in the database")
+        parser.add_argument("-k", "--keywords", default=",".join(DEFAULT_KEYWORDS), help="comma-separated search keywords")
+        args = parser.parse_args(argv)
+
+        generator = LoadGenerator(args.host, args.port, args.concurrency, args.duration, args.write_ratio,
+                                  [keyword for keyword in args.keywords.split(",") if keyword])
+        try:
+                elapsed = asyncio.run(generator.run())
+        except OSError as e:
+                print(f"Could not reach the server at {args.host}:{args.port}: {e}", file=sys.stderr)
+                return 1
+        generator.report(elapsed)
+        return 0
+
+
+if __name__ == "__main__":
+        sys.exit(main())
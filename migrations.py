@@ -0,0 +1,159 @@
+import sqlite3
+from contextlib import contextmanager
+
+
+# Rows filled per transaction by data migrations, each batch is a checkpoint an upgrade resumes from
+MIGRATION_BATCH_SIZE = 5000
+
+
+class MigrationCancelled(Exception):
+        """Raised when an upgrade is cancelled between batches, it resumes from the last one next time"""
+
+
+class Migration:
+        """One step of the schema history, bringing a database up to version.
+
+        apply names the repository method making the schema changes, run in a single transaction.
+        fill optionally names the repository method filling derived data for the ids in (after_id, last_id],
+        it is run over the rows of source in batches of MIGRATION_BATCH_SIZE.
+        """
+
+        def __init__(self, version, description, apply, fill=None, source="problems"):
+                self.version = version
+                self.description = description
+                self.apply = apply
+                self.fill = fill
+                self.source = source
+
+
+# Every schema version so far, in order. Version 4, the normalized search index added with user-011, was
+# replaced by migration 5, which also upgrades databases left at version 4
+MIGRATIONS = [
+        Migration(1, "Create the problems table", "create_problems_table"),
+        Migration(2, "Track changes for incremental backups", "add_change_tracking"),
+        Migration(3, "Summarize records for the problems list", "init_summaries", fill="fill_summaries"),
+        Migration(5, "Index normalized text for search", "create_search_index", fill="fill_search_index"),
+        Migration(6, "Index records by date", "add_day_column", fill="fill_days", source="problem_summaries"),
+        Migration(7, "Store attachments", "add_attachments"),
+        Migration(8, "Tag records", "add_tags"),
+        Migration(9, "Pause triggers during bulk loads without dropping them", "gate_bulk_load_triggers"),
+        Migration(10, "Identify each database, and every snapshot restored over it", "add_database_id"),
+]
+
+# Version of the schema, stored in PRAGMA user_version and in backup headers
+SCHEMA_VERSION = MIGRATIONS[-1].version
+
+
+@contextmanager
+def transaction(conn):
+        """Run the block in a write transaction on conn, rolling it back on any error"""
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+                yield
+                conn.execute("COMMIT")
+        except BaseException:
+                # A COMMIT that failed, e.g. busy, leaves the transaction open as well. The error raised is
+                # always the one that ended the block, never a failure to roll back after it
+                if conn.in_transaction:
+                        try:
+                                conn.execute("ROLLBACK")
+                        except sqlite3.Error:
+                                pass
+                raise
+
+
+def id_ranges(conn, table, batch_size, after_id=-1):
+        """Consecutive (after_id, last_id] ranges of the ids of table, batch_size rows each"""
+        while True:
+                last_id = conn.execute(f"SELECT MAX(id) FROM (SELECT id FROM {table} WHERE id > ? ORDER BY id LIMIT ?)",
+                                       (after_id, batch_size)).fetchone()[0]
+                if last_id is None:
+                        return
+                yield after_id, last_id
+                after_id = last_id
+
+
+def schema_version(conn):
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(repository, conn, progress=None, is_cancelled=None):
+        """Apply the migrations conn's database has not seen yet, returning True if there were any"""
+        version = schema_version(conn)
+        pending = [migration for migration in MIGRATIONS if migration.version > version]
+        if not pending:
+                return False
+
+        with transaction(conn):
+                # Checkpoints of data migrations that were interrupted
+                conn.execute('''CREATE TABLE IF NOT EXISTS schema_migration_state (
+                        version INTEGER PRIMARY KEY,
+                        last_id INTEGER NOT NULL
+                    )''')
+
+        # Progress is counted in rows, every data migration goes over each record once
+        problems_exists = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'problems'").fetchone()
+        rows = conn.execute("SELECT COUNT(*) FROM problems").fetchone()[0] if problems_exists else 0
+        total = rows * sum(1 for migration in pending if migration.fill)
+        done = 0
+
+        for migration in pending:
+                with transaction(conn):
+                        # Another connection may have upgraded the database since its version was read above
+                        applied = schema_version(conn) >= migration.version
+                        if not applied:
+                                checkpoint = conn.execute("SELECT last_id FROM schema_migration_state WHERE version = ?",
+                                                          (migration.version,)).fetchone()
+                                if checkpoint is None:
+                                        getattr(repository, migration.apply)(conn)
+                                        if migration.fill:
+                                                conn.execute("INSERT INTO schema_migration_state (version, last_id) VALUES (?, ?)",
+                                                             (migration.version, -1))
+                                else:
+                                        # Resuming an interrupted upgrade, the schema changes are already in place
+                                        done += conn.execute(f"SELECT COUNT(*) FROM {migration.source} WHERE id <= ?",
+                                                             (checkpoint[0],)).fetchone()[0]
+                if applied:
+                        continue
+
+                if migration.fill:
+                        fill = getattr(repository, migration.fill)
+                        while True:
+                                if is_cancelled and is_cancelled():
+                                        raise MigrationCancelled(f"Upgrade to version {migration.version} paused")
+                                batch = fill_batch(conn, migration, fill)
+                                if batch is None:
+                                        break
+                                after_id, last_id = batch
+                                done += conn.execute(f"SELECT COUNT(*) FROM {migration.source} WHERE id > ? AND id <= ?",
+                                                     (after_id, last_id)).fetchone()[0]
+                                if progress:
+                                        progress(done, total)
+
+                with transaction(conn):
+                        if schema_version(conn) < migration.version:
+                                conn.execute("DELETE FROM schema_migration_state WHERE version = ?", (migration.version,))
+                                conn.execute(f"PRAGMA user_version={migration.version}")
+        return True
+
+
+def fill_batch(conn, migration, fill):
+        """Fill the rows following the checkpoint of migration in one transaction, moving the checkpoint past them.
+
+        Returns the (after_id, last_id] range filled, or None once every row is filled or another connection
+        finished the migration. The checkpoint is read in the same transaction, so connections upgrading at
+        the same time never fill a range twice.
+        """
+        with transaction(conn):
+                if schema_version(conn) >= migration.version:
+                        return None
+                after_id = conn.execute("SELECT last_id FROM schema_migration_state WHERE version = ?",
+                                        (migration.version,)).fetchone()[0]
+                batch = next(id_ranges(conn, migration.source, MIGRATION_BATCH_SIZE, after_id), None)
+                if batch is None:
+                        return None
+                fill(conn, *batch)
+                conn.execute("UPDATE schema_migration_state SET last_id = ? WHERE version = ?",
+                             (batch[1], migration.version))
+        return batch
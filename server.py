@@ -0,0 +1,332 @@
+import asyncio
+import json
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+
+from database import (SEARCH_COLUMNS, ConflictError, FuzzyQuery, RecentQuery, SearchQuery, day_range,
+                      jalali_today, record_values)
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8080
+
+# Threads, each with its own read connection, answering reads side by side over WAL
+READ_CONNECTIONS = min(8, (os.cpu_count() or 1) * 2)
+
+# Records per page of /problems, and the most a client may ask for
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 1000
+
+# Records written per chunk of /export
+EXPORT_CHUNK_SIZE = 1000
+
+# Largest request body accepted, records are text only
+MAX_BODY_SIZE = 1024 * 1024
+
+# Idle keep-alive connections are closed after this many seconds
+KEEP_ALIVE_TIMEOUT = 30
+
+
+class HTTPError(Exception):
+        """Ends a request with status and a JSON error message"""
+
+        def __init__(self, status, message=None, details=None):
+                super().__init__(message or status.phrase)
+                self.status = status
+                self.message = message or status.phrase
+                # Further fields of the error response
+                self.details = details or {}
+
+        def payload(self):
+                return {"error": self.message, **self.details}
+
+
+class Request:
+        def __init__(self, method, target, version, headers, body):
+                self.method = method
+                self.version = version
+                url = urlsplit(target)
+                self.path = url.path.rstrip("/") or "/"
+                self.query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+                self.headers = headers
+                self.body = body
+
+        def json(self):
+                try:
+                        return json.loads(self.body)
+                except ValueError:
+                        raise HTTPError(HTTPStatus.BAD_REQUEST, "Request body is not valid JSON")
+
+
+def summary_json(row):
+        """A list row of a query as JSON, problem and solution are cut to their previews"""
+        return {"id": row[0], "date": row[1], "subject": row[2], "problem_preview": row[3], "solution_preview": row[4]}
+
+
+def record_json(record_id, record):
+        """A complete record as JSON, with its revision if record has one (see get_for_update)"""
+        date, subject, problem, solution = record[:4]
+        payload = {"id": record_id, "date": date, "subject": subject, "problem": problem, "solution": solution}
+        if len(record) > 4:
+                payload["revision"] = record[4]
+        return payload
+
+
+class ProblemServer:
+        """Serves the repository over HTTP/JSON, reads on a pool of connections and writes on a single one
+
+        GET    /problems         recent records, or a search with q, field, fuzzy, since, until; paged with limit and after
+        POST   /problems         add a record, returns its id
+        GET    /problems/<id>    a complete record, with the revision it was read at
+        PUT    /problems/<id>    rewrite a record, 409 if it changed since the revision given with it
+        DELETE /problems/<id>    delete a record
+        GET    /export           every complete record as chunked NDJSON
+        GET    /stats            record count, date range and backup state
+        """
+
+        def __init__(self, repository, readers=READ_CONNECTIONS):
+                self.repository = repository
+                # Every thread has its own connection through repository.connection()
+                self.readers = ThreadPoolExecutor(readers, thread_name_prefix="reader", initializer=self.init_reader)
+                # One writer keeps writes serialized instead of having them wait on each other's locks
+                self.writer = ThreadPoolExecutor(1, thread_name_prefix="writer")
+
+        def init_reader(self):
+                # Reads can never take the write lock away from the writer
+                self.repository.connection().execute("PRAGMA query_only=1")
+
+        async def read(self, function, *args):
+                return await asyncio.get_running_loop().run_in_executor(self.readers, function, *args)
+
+        async def write(self, function, *args):
+                return await asyncio.get_running_loop().run_in_executor(self.writer, function, *args)
+
+        def close(self):
+                self.readers.shutdown()
+                self.writer.shutdown()
+
+        # Connections
+        async def handle_connection(self, reader, writer):
+                try:
+                        while True:
+                                request = await asyncio.wait_for(self.read_request(reader), KEEP_ALIVE_TIMEOUT)
+                                if request is None:
+                                        break
+                                keep_alive = request.headers.get("connection", "").lower() != "close"
+                                try:
+                                        await self.dispatch(request, writer, keep_alive)
+                                except HTTPError as e:
+                                        await self.send_json(writer, e.status, e.payload(), keep_alive)
+                                except sqlite3.Error as e:
+                                        await self.send_json(writer, HTTPStatus.SERVICE_UNAVAILABLE,
+                                                             {"error": f"Database error: {e}"}, keep_alive)
+                                # A response without a length ends with the connection
+                                if not keep_alive or writer.is_closing():
+                                        break
+                except HTTPError as e:
+                        # The request could not be parsed, so the connection cannot be reused
+                        await self.send_json(writer, e.status, e.payload(), False)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                        pass
+                finally:
+                        writer.close()
+
+        async def read_request(self, reader):
+                """The next request on a connection, or None once the client has closed it"""
+                request_line = await reader.readline()
+                if not request_line:
+                        return None
+                try:
+                        method, target, version = request_line.decode("latin-1").split()
+                except ValueError:
+                        raise HTTPError(HTTPStatus.BAD_REQUEST, "Malformed request line")
+
+                headers = {}
+                while True:
+                        line = await reader.readline()
+                        if line in (b"\r\n", b"\n", b""):
+                                break
+                        name, _, value = line.decode("latin-1").partition(":")
+                        headers[name.strip().lower()] = value.strip()
+                if version == "HTTP/1.0" and headers.get("connection", "").lower() != "keep-alive":
+                        headers["connection"] = "close"
+
+                # Digits only, int() would also take a sign, spaces and underscores
+                length = headers.get("content-length", "0")
+                if not (length.isascii() and length.isdigit()):
+                        raise HTTPError(HTTPStatus.BAD_REQUEST, "Invalid Content-Length")
+                length = int(length)
+                if length > MAX_BODY_SIZE:
+                        raise HTTPError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+                body = await reader.readexactly(length) if length else b""
+                return Request(method, target, version, headers, body)
+
+        # Responses
+        async def send_json(self, writer, status, payload, keep_alive):
+                body = json.dumps(payload, ensure_ascii=False).encode() if payload is not None else b""
+                headers = [f"HTTP/1.1 {status.value} {status.phrase}", f"Content-Length: {len(body)}"]
+                if payload is not None:
+                        headers.append("Content-Type: application/json; charset=utf-8")
+                headers.append(f"Connection: {'keep-alive' if keep_alive else 'close'}")
+                writer.write(("\r\n".join(headers) + "\r\n\r\n").encode("latin-1") + body)
+                await writer.drain()
+
+        async def send_chunked(self, writer, request, content_type, chunks, keep_alive):
+                """Stream the byte strings produced by the async iterator chunks with chunked transfer encoding"""
+                if request.version == "HTTP/1.0":
+                        return await self.send_until_close(writer, content_type, chunks)
+                writer.write((f"HTTP/1.1 200 OK\r\nContent-Type: {content_type}\r\nTransfer-Encoding: chunked\r\n"
+                              f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n").encode("latin-1"))
+                async for chunk in chunks:
+                        if chunk:
+                                writer.write(f"{len(chunk):x}\r\n".encode("latin-1") + chunk + b"\r\n")
+                                # Waits for slow clients, so only one chunk at a time is held in memory
+                                await writer.drain()
+                writer.write(b"0\r\n\r\n")
+                await writer.drain()
+
+        async def send_until_close(self, writer, content_type, chunks):
+                """Stream chunks to an HTTP/1.0 client, which knows no chunked encoding: closing the connection
+                ends the body"""
+                writer.write(f"HTTP/1.0 200 OK\r\nContent-Type: {content_type}\r\nConnection: close\r\n\r\n"
+                             .encode("latin-1"))
+                async for chunk in chunks:
+                        if chunk:
+                                writer.write(chunk)
+                                await writer.drain()
+                writer.close()
+
+        # Routing
+        async def dispatch(self, request, writer, keep_alive):
+                parts = request.path.strip("/").split("/")
+                if parts[0] == "problems" and len(parts) == 1:
+                        if request.method == "GET":
+                                payload = await self.list_problems(request)
+                                return await self.send_json(writer, HTTPStatus.OK, payload, keep_alive)
+                        if request.method == "POST":
+                                payload = await self.add_problem(request)
+                                return await self.send_json(writer, HTTPStatus.CREATED, payload, keep_alive)
+                elif parts[0] == "problems" and len(parts) == 2:
+                        if not parts[1].isdigit():
+                                raise HTTPError(HTTPStatus.NOT_FOUND)
+                        record_id = int(parts[1])
+                        if request.method == "GET":
+                                record = await self.read(self.repository.get_for_update, record_id)
+                                if record is None:
+                                        raise HTTPError(HTTPStatus.NOT_FOUND, f"No record {record_id}")
+                                return await self.send_json(writer, HTTPStatus.OK, record_json(record_id, record),
+                                                            keep_alive)
+                        if request.method == "PUT":
+                                payload = await self.update_problem(request, record_id)
+                                return await self.send_json(writer, HTTPStatus.OK, payload, keep_alive)
+                        if request.method == "DELETE":
+                                if not await self.write(self.repository.delete, record_id):
+                                        raise HTTPError(HTTPStatus.NOT_FOUND, f"No record {record_id}")
+                                return await self.send_json(writer, HTTPStatus.NO_CONTENT, None, keep_alive)
+                elif request.path == "/export" and request.method == "GET":
+                        return await self.send_chunked(writer, request, "application/x-ndjson", self.export_chunks(),
+                                                       keep_alive)
+                elif request.path == "/stats" and request.method == "GET":
+                        payload = await self.read(self.repository.stats)
+                        return await self.send_json(writer, HTTPStatus.OK, payload, keep_alive)
+                else:
+                        raise HTTPError(HTTPStatus.NOT_FOUND)
+                raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED)
+
+        # Endpoints
+        def search_query(self, query):
+                """The RecentQuery, SearchQuery or FuzzyQuery described by the parameters of a request"""
+                try:
+                        days = day_range(query.get("since"), query.get("until"))
+                except ValueError as e:
+                        raise HTTPError(HTTPStatus.BAD_REQUEST, str(e))
+                keyword = query.get("q", "").strip()
+                if not keyword:
+                        return RecentQuery(days)
+                field = query.get("field", "All")
+                if field not in SEARCH_COLUMNS:
+                        raise HTTPError(HTTPStatus.BAD_REQUEST, f"field must be one of {', '.join(SEARCH_COLUMNS)}")
+                query_class = FuzzyQuery if query.get("fuzzy") in ("1", "true") else SearchQuery
+                return query_class(keyword, field, days)
+
+        async def list_problems(self, request):
+                """One keyset page of a query, with the cursor of the next page"""
+                search_query = self.search_query(request.query)
+                try:
+                        limit = int(request.query.get("limit", DEFAULT_PAGE_SIZE))
+                        # The cursor is the sort key of the last row of the previous page
+                        after = json.loads(request.query["after"]) if "after" in request.query else None
+                        if isinstance(after, list):
+                                after = tuple(after)
+                        if after is not None and not all(isinstance(value, (int, float))
+                                                         for value in (after if isinstance(after, tuple) else (after,))):
+                                raise ValueError("after is not a cursor")
+                except (ValueError, TypeError):
+                        raise HTTPError(HTTPStatus.BAD_REQUEST, "limit must be a number and after a cursor from next")
+                if not 1 <= limit <= MAX_PAGE_SIZE:
+                        raise HTTPError(HTTPStatus.BAD_REQUEST, f"limit must be between 1 and {MAX_PAGE_SIZE}")
+
+                try:
+                        rows = await self.read(self.repository.fetch_page, search_query, after, limit)
+                except (sqlite3.ProgrammingError, TypeError, ValueError):
+                        # A cursor of another kind of query, with the wrong number of values
+                        raise HTTPError(HTTPStatus.BAD_REQUEST, "after is not a cursor of this query")
+                next_cursor = json.dumps(search_query.key(rows[-1])) if len(rows) == limit else None
+                return {"records": [summary_json(row) for row in rows], "next": next_cursor}
+
+        def parse_record(self, request):
+                try:
+                        return record_values(request.json(), jalali_today())
+                except ValueError as e:
+                        raise HTTPError(HTTPStatus.BAD_REQUEST, str(e))
+
+        async def add_problem(self, request):
+                record_id = await self.write(self.repository.add, *self.parse_record(request))
+                return {"id": record_id}
+
+        async def update_problem(self, request, record_id):
+                record = self.parse_record(request)
+                # Without a revision the record is overwritten whatever happened to it since it was read
+                revision = request.json().get("revision")
+                if revision is not None and (not isinstance(revision, int) or isinstance(revision, bool)):
+                        raise HTTPError(HTTPStatus.BAD_REQUEST, "revision must be the number returned by GET")
+                try:
+                        updated = await self.write(self.repository.update, record_id, *record, revision)
+                except ConflictError as e:
+                        current = record_json(record_id, e.current) if e.current is not None else None
+                        raise HTTPError(HTTPStatus.CONFLICT, str(e), {"current": current})
+                if not updated:
+                        raise HTTPError(HTTPStatus.NOT_FOUND, f"No record {record_id}")
+                return {"id": record_id}
+
+        async def export_chunks(self):
+                """Every record as NDJSON, EXPORT_CHUNK_SIZE records per chunk"""
+                after_id = 0
+                while True:
+                        rows = await self.read(self.repository.fetch_records, after_id, EXPORT_CHUNK_SIZE)
+                        if not rows:
+                                return
+                        yield "".join(json.dumps(record_json(row[0], row[1:]), ensure_ascii=False) + "\n"
+                                      for row in rows).encode()
+                        after_id = rows[-1][0]
+
+
+async def run_server(repository, host=DEFAULT_HOST, port=DEFAULT_PORT, readers=READ_CONNECTIONS):
+        server = ProblemServer(repository, readers)
+        listener = await asyncio.start_server(server.handle_connection, host, port)
+        print(f"Serving {repository.db_path} on http://{host}:{port} with {readers} read connections")
+        try:
+                async with listener:
+                        await listener.serve_forever()
+        finally:
+                server.close()
+
+
+def serve(repository, host=DEFAULT_HOST, port=DEFAULT_PORT, readers=READ_CONNECTIONS):
+        """Run the API server until interrupted"""
+        try:
+                asyncio.run(run_server(repository, host, port, readers))
+        except KeyboardInterrupt:
+                print("Server stopped")
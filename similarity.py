@@ -0,0 +1,327 @@
+import os
+import re
+import zipfile
+import zlib
+
+import numpy as np
+
+from database import get_data_dir, normalize_text
+
+
+# Words are hashed into a fixed feature space, so the index needs no vocabulary
+N_FEATURES = 1 << 20
+
+# Single characters carry no meaning for similarity
+WORD_PATTERN = re.compile(r"\w{2,}")
+
+# Files holding the index in the data directory, the delta is rewritten on every change and the main
+# file only when the delta is merged into it
+INDEX_FILE = "similarity.npz"
+DELTA_FILE = "similarity-delta.npz"
+
+# Rows vectorized per query when the index is built from the database
+BUILD_BATCH_SIZE = 5000
+
+# Changed rows kept in the delta before it is merged into the main postings
+MAX_DELTA_ROWS = 5000
+
+# Words found in more than this share of the problems say nothing about similarity and are not looked up
+MAX_DOCUMENT_FREQUENCY = 0.5
+
+# Suggestions returned by default, and the lowest cosine similarity worth suggesting
+SUGGESTION_COUNT = 5
+MIN_SIMILARITY = 0.2
+
+# Raised by a missing, corrupt or partly written index file, or by arrays of it that no longer fit together
+INDEX_ERRORS = (OSError, ValueError, KeyError, IndexError, EOFError, MemoryError, zipfile.BadZipFile, zlib.error)
+
+
+def document_text(subject, problem):
+        """Text of a problem compared by the index"""
+        return normalize_text(f"{subject or ''}\n{problem or ''}")
+
+
+def vectorize(texts):
+        """Sparse unit-length vectors of texts as (row, feature, weight) arrays, row being the position in texts"""
+        rows = []
+        hashes = []
+        for row, text in enumerate(texts):
+                words = WORD_PATTERN.findall(text)
+                rows.extend([row] * len(words))
+                hashes.extend(zlib.crc32(word.encode("utf-8")) for word in words)
+        if not hashes:
+                return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, np.float32)
+
+        # Count each (row, feature) pair once, with sublinear term frequency
+        keys = np.array(rows, dtype=np.int64) * N_FEATURES + np.array(hashes, dtype=np.int64) % N_FEATURES
+        keys, counts = np.unique(keys, return_counts=True)
+        rows, features = np.divmod(keys, N_FEATURES)
+        weights = 1.0 + np.log(counts)
+        norms = np.sqrt(np.bincount(rows, weights=weights * weights))
+        return rows, features, (weights / norms[rows]).astype(np.float32)
+
+
+class SimilarityIndex:
+        """TF-IDF search over the subject and problem of every record, for finding likely duplicates.
+
+        Document vectors are normalized term frequencies, and inverse document frequency is applied on the
+        query side, so a vector never changes once computed and rows can be added without rebuilding.
+        The bulk of the rows are stored as per-feature postings, rows changed since then in a small delta.
+        """
+
+        def __init__(self):
+                # Row position of each record's vector, and whether it is still current
+                self.ids = np.empty(0, np.int64)
+                self.alive = np.empty(0, bool)
+                # Postings of the main rows, grouped by feature
+                self.indptr = np.zeros(N_FEATURES + 1, np.int64)
+                self.rows = np.empty(0, np.int32)
+                self.weights = np.empty(0, np.float32)
+                # Vectors of the rows added since the postings were built
+                self.delta_rows = np.empty(0, np.int32)
+                self.delta_features = np.empty(0, np.int32)
+                self.delta_weights = np.empty(0, np.float32)
+                # Records replaced or deleted since the postings were built
+                self.removed = np.empty(0, np.int64)
+                self.df = np.zeros(N_FEATURES, np.int32)
+                # Database the index was built from, and the revision of it covered by the index and by its main
+                # file on disk
+                self.database_id = None
+                self.revision = 0
+                self.base_revision = 0
+                self.main_rows = 0
+
+        # Building
+        @classmethod
+        def build(cls, repository, conn):
+                """An index of every record of the database"""
+                index = cls()
+                index.rebuild(repository, conn)
+                return index
+
+        def rebuild(self, repository, conn):
+                """Vectorize every record of the database"""
+                database_id = repository.database_id(conn)
+                revision = repository.current_revision(conn)
+                ids, rows, features, weights = [], [], [], []
+                row_count = 0
+                last_id = -1
+                while True:
+                        batch = conn.execute("SELECT id, subject, problem FROM problems WHERE id > ? ORDER BY id LIMIT ?",
+                                             (last_id, BUILD_BATCH_SIZE)).fetchall()
+                        if not batch:
+                                break
+                        batch_rows, batch_features, batch_weights = vectorize(
+                                [document_text(subject, problem) for _, subject, problem in batch])
+                        ids.append(np.array([record[0] for record in batch], dtype=np.int64))
+                        rows.append(batch_rows + row_count)
+                        features.append(batch_features)
+                        weights.append(batch_weights)
+                        row_count += len(batch)
+                        last_id = batch[-1][0]
+
+                if ids:
+                        self.set_postings(np.concatenate(ids), np.concatenate(rows), np.concatenate(features),
+                                          np.concatenate(weights))
+                else:
+                        self.set_postings(np.empty(0, np.int64), np.empty(0, np.int32), np.empty(0, np.int64),
+                                          np.empty(0, np.float32))
+                self.database_id = database_id
+                self.revision = revision
+
+        def set_postings(self, ids, rows, features, weights):
+                """Replace the whole index with the given vectors"""
+                order = np.argsort(features, kind="stable")
+                self.ids = ids
+                self.alive = np.ones(len(ids), bool)
+                self.indptr = np.zeros(N_FEATURES + 1, np.int64)
+                np.cumsum(np.bincount(features, minlength=N_FEATURES), out=self.indptr[1:])
+                self.rows = rows[order].astype(np.int32)
+                self.weights = weights[order]
+                self.df = np.bincount(features, minlength=N_FEATURES).astype(np.int32)
+                self.delta_rows = np.empty(0, np.int32)
+                self.delta_features = np.empty(0, np.int32)
+                self.delta_weights = np.empty(0, np.float32)
+                self.removed = np.empty(0, np.int64)
+                self.main_rows = len(ids)
+
+        def compact(self):
+                """Merge the delta into the main postings, dropping the rows no longer current"""
+                main_features = np.repeat(np.arange(N_FEATURES), np.diff(self.indptr))
+                rows = np.concatenate([self.rows, self.delta_rows])
+                features = np.concatenate([main_features, self.delta_features])
+                weights = np.concatenate([self.weights, self.delta_weights])
+
+                keep = self.alive[rows]
+                renumbered = np.cumsum(self.alive) - 1
+                self.set_postings(self.ids[self.alive], renumbered[rows[keep]], features[keep], weights[keep])
+
+        # Updates
+        def refresh(self, repository, conn):
+                """Catch up with the changes made since self.revision, True if there were any"""
+                if repository.database_id(conn) != self.database_id:
+                        # A restored snapshot, whose revisions may be equal to or past the index's and still differ
+                        self.rebuild(repository, conn)
+                        return True
+
+                revision = repository.current_revision(conn)
+                if revision == self.revision:
+                        return False
+
+                changed_count = conn.execute("SELECT COUNT(*) FROM problems WHERE revision > ?",
+                                             (self.revision,)).fetchone()[0]
+                if changed_count > MAX_DELTA_ROWS or revision < self.revision:
+                        # A bulk import, or a database whose history was rolled back
+                        self.rebuild(repository, conn)
+                        return True
+
+                changed = conn.execute("SELECT id, subject, problem FROM problems WHERE revision > ?",
+                                       (self.revision,)).fetchall()
+                deleted = [row[0] for row in conn.execute("SELECT id FROM deleted_problems WHERE revision > ?",
+                                                          (self.revision,))]
+                self.remove(np.array([record[0] for record in changed] + deleted, dtype=np.int64))
+                self.add(changed)
+                self.revision = revision
+                if len(self.ids) - self.main_rows > MAX_DELTA_ROWS:
+                        self.compact()
+                return True
+
+        def remove(self, record_ids):
+                stale = np.isin(self.ids, record_ids) & self.alive
+                if not stale.any():
+                        return
+                self.alive &= ~stale
+                self.removed = np.union1d(self.removed, record_ids)
+
+        def add(self, records):
+                """Append vectors for (id, subject, problem) records"""
+                if not records:
+                        return
+                rows, features, weights = vectorize([document_text(subject, problem) for _, subject, problem in records])
+                first = len(self.ids)
+                self.ids = np.concatenate([self.ids, np.array([record[0] for record in records], dtype=np.int64)])
+                self.alive = np.concatenate([self.alive, np.ones(len(records), bool)])
+                self.delta_rows = np.concatenate([self.delta_rows, (rows + first).astype(np.int32)])
+                self.delta_features = np.concatenate([self.delta_features, features.astype(np.int32)])
+                self.delta_weights = np.concatenate([self.delta_weights, weights])
+                # Frequencies only ever grow between compactions, which is close enough for weighting
+                np.add.at(self.df, features, 1)
+
+        # Queries
+        def query(self, text, k=SUGGESTION_COUNT, exclude=None):
+                """Up to k (id, similarity) pairs of the records most similar to text, best first"""
+                alive_count = int(self.alive.sum())
+                _, features, weights = vectorize([normalize_text(text)])
+                if not alive_count or not len(features):
+                        return []
+
+                # Skip words so common that their postings would cost far more than they tell
+                df = self.df[features]
+                useful = (df > 0) & (df <= MAX_DOCUMENT_FREQUENCY * alive_count)
+                features = features[useful]
+                if not len(features):
+                        return []
+                weights = weights[useful] * (np.log((alive_count + 1) / (df[useful] + 1)) + 1)
+                weights /= np.linalg.norm(weights)
+
+                # Gather the postings of the query's features and accumulate them per row
+                starts = self.indptr[features]
+                lengths = self.indptr[features + 1] - starts
+                offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+                scores = np.bincount(self.rows[offsets], weights=self.weights[offsets] * np.repeat(weights, lengths),
+                                     minlength=len(self.ids))
+                if len(self.delta_rows):
+                        dense = np.zeros(N_FEATURES, np.float32)
+                        dense[features] = weights
+                        scores += np.bincount(self.delta_rows, weights=self.delta_weights * dense[self.delta_features],
+                                              minlength=len(self.ids))
+
+                scores[~self.alive] = 0.0
+                if exclude is not None:
+                        scores[self.ids == exclude] = 0.0
+                k = min(k, len(scores))
+                best = np.argpartition(-scores, k - 1)[:k]
+                best = best[np.argsort(-scores[best])]
+                return [(int(self.ids[row]), float(scores[row])) for row in best if scores[row] >= MIN_SIMILARITY]
+
+        # Storage
+        @classmethod
+        def load(cls, data_dir=None):
+                """The index saved in data_dir, or None if there is none or it cannot be read"""
+                data_dir = data_dir or get_data_dir()
+                index_path = os.path.join(data_dir, INDEX_FILE)
+                if not os.path.exists(index_path):
+                        return None
+                try:
+                        return cls.read(data_dir)
+                except INDEX_ERRORS:
+                        return None
+
+        @staticmethod
+        def discard(data_dir=None):
+                """Delete the saved index, the next load then finds none and it is built again"""
+                data_dir = data_dir or get_data_dir()
+                for name in (INDEX_FILE, DELTA_FILE):
+                        path = os.path.join(data_dir, name)
+                        if os.path.exists(path):
+                                os.remove(path)
+
+        @classmethod
+        def read(cls, data_dir):
+                index_path = os.path.join(data_dir, INDEX_FILE)
+
+                index = cls()
+                with np.load(index_path) as data:
+                        index.set_postings(data["ids"], np.empty(0, np.int32), np.empty(0, np.int64),
+                                           np.empty(0, np.float32))
+                        index.indptr = data["indptr"]
+                        index.rows = data["rows"]
+                        index.weights = data["weights"]
+                        index.df = data["df"]
+                        index.database_id = str(data["database_id"])
+                        index.revision = index.base_revision = int(data["revision"])
+
+                delta_path = os.path.join(data_dir, DELTA_FILE)
+                if os.path.exists(delta_path):
+                        with np.load(delta_path) as data:
+                                # A delta left over from before the main file was last written is already merged
+                                if int(data["base_revision"]) == index.revision:
+                                        index.remove(data["removed"])
+                                        first = len(index.ids)
+                                        index.ids = np.concatenate([index.ids, data["ids"]])
+                                        index.alive = np.concatenate([index.alive, np.ones(len(data["ids"]), bool)])
+                                        index.alive[first:] = data["alive"]
+                                        index.delta_rows = data["rows"] + first
+                                        index.delta_features = data["features"]
+                                        index.delta_weights = data["weights"]
+                                        index.df = data["df"]
+                                        index.revision = int(data["revision"])
+                return index
+
+        def save(self, data_dir=None, full=False):
+                """Write the delta to data_dir, and the main postings too if full or they changed"""
+                data_dir = data_dir or get_data_dir()
+                index_path = os.path.join(data_dir, INDEX_FILE)
+                delta_path = os.path.join(data_dir, DELTA_FILE)
+
+                if full or not len(self.delta_rows) and not len(self.removed):
+                        _save_arrays(index_path, ids=self.ids[:self.main_rows], indptr=self.indptr, rows=self.rows,
+                                     weights=self.weights, df=self.df, database_id=self.database_id,
+                                     revision=self.revision)
+                        self.base_revision = self.revision
+                        if os.path.exists(delta_path):
+                                os.remove(delta_path)
+                        return
+
+                _save_arrays(delta_path, base_revision=self.base_revision, revision=self.revision,
+                             ids=self.ids[self.main_rows:], alive=self.alive[self.main_rows:],
+                             rows=self.delta_rows - self.main_rows, features=self.delta_features,
+                             weights=self.delta_weights, removed=self.removed, df=self.df)
+
+
+def _save_arrays(path, **arrays):
+        """np.savez through a temporary file, so a crash never leaves a truncated index behind"""
+        temp_path = path + ".part"
+        with open(temp_path, "wb") as f:
+                np.savez(f, **arrays)
+        os.replace(temp_path, path)